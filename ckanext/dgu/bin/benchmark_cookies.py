@@ -0,0 +1,63 @@
+'''
+Micro-benchmark of the cookie parsing done by AuthAPIMiddleware on every
+request, comparing the single-pass scanner with the previous
+implementation (environ scan plus two SimpleCookie parses).
+
+Usage: python ckanext/dgu/bin/benchmark_cookies.py [repeats]
+'''
+import sys
+import timeit
+import Cookie
+
+from ckanext.dgu.middleware import scan_cookies
+
+analytics_cookies = '__utma=217959684.178461911.1286034407.1286034407.1286178542.2; __utmz=217959684.1286178542.2.2.utmcsr=google|utmccn=(organic)|utmcmd=organic|utmctr=coi%20london; __utmb=217959684.3.10.1286178542; __utmc=217959684; _ga=GA1.3.1645507268.1266337989; has_js=1'
+cookie_headers = {
+    'anonymous': analytics_cookies,
+    'drupal signed in': analytics_cookies + '; DRXtrArgs=James+Gardner; DRXtrArgs2=3e174e7f1e1d3fab5ca138c0a023e13a; SESS9854522e7c5dba5831db083c5372623c=4160a72a4d6831abec1ac57d7b5a59eb',
+    'ckan signed in': analytics_cookies + '; DRXtrArgs=James+Gardner; DRXtrArgs2=3e174e7f1e1d3fab5ca138c0a023e13a; SESS9854522e7c5dba5831db083c5372623c=4160a72a4d6831abec1ac57d7b5a59eb; auth_tkt="a578c4a0d21bdbde7f80cd271d60b66f4ceabc3f4466!"; ckan_apikey="3a51edc6-6461-46b8-bfe2-57445cbdeb2b"; ckan_display_name="James Gardner"; ckan_user="4466"',
+    }
+# other keys found in a typical mod_wsgi environ
+environ_base = dict(('HTTP_HEADER_%i' % i, 'value') for i in range(30))
+
+def previous_implementation(environ):
+    def drupal_extract_cookie(cookie_string):
+        cookies = Cookie.SimpleCookie()
+        cookies.load(str(cookie_string))
+        for cookie in cookies:
+            if cookie.startswith('SESS'):
+                return cookies[cookie].value
+        return None
+
+    def is_ckan_signed_in(cookie_string):
+        cookies = Cookie.SimpleCookie()
+        cookies.load(str(cookie_string))
+        return 'auth_tkt' in cookies
+
+    ckan_signed_in = drupal_signed_in = False
+    for k, v in environ.items():
+        if k.lower() == 'http_cookie':
+            ckan_signed_in = is_ckan_signed_in(v)
+            drupal_signed_in = drupal_extract_cookie(v)
+    return drupal_signed_in, ckan_signed_in
+
+def current_implementation(environ):
+    return scan_cookies(environ.get('HTTP_COOKIE', ''))
+
+def command():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    print 'Cookie parsing, %i requests each' % repeats
+    for name, cookie_header in sorted(cookie_headers.items()):
+        environ = dict(environ_base, HTTP_COOKIE=cookie_header)
+        assert previous_implementation(environ) == \
+               current_implementation(environ), name
+        timings = []
+        for func in (previous_implementation, current_implementation):
+            timings.append(timeit.timeit(lambda: func(environ),
+                                         number=repeats))
+        print '  %-18s previous: %.1fus  current: %.1fus  speed-up: %.1fx' % \
+              (name, timings[0] / repeats * 1e6, timings[1] / repeats * 1e6,
+               timings[0] / timings[1])
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,71 @@
+'''
+Benchmark of the PackageGov3Controller db-to-form schema validation for a
+UKLP-sized package (with 40+ extras), comparing convert_from_extras with
+the previous implementation (a scan of all the data for each extras
+field). Checks that both give the same form data.
+
+Needs CKAN installed.
+
+Usage: python ckanext/dgu/bin/benchmark_gov3_extras.py [repeats]
+'''
+import sys
+import timeit
+
+from ckan.lib.navl.dictization_functions import validate
+
+from ckanext.dgu.controllers import package_gov3
+from ckanext.dgu.controllers.package_gov3 import PackageGov3Controller
+
+def previous_convert_from_extras(key, data, errors, context):
+    for data_key, data_value in data.iteritems():
+        if (data_key[0] == 'extras'
+            and data_key[-1] == 'key'
+            and data_value == key[-1]):
+            data[key] = data[('extras', data_key[1], 'value')]
+
+def uklp_package_dict(num_extras=45):
+    extras = [{'key': key, 'value': value} for key, value in [
+        ('date_released', '2010-05-01'),
+        ('date_updated', '2011-01-05'),
+        ('update_frequency', 'monthly'),
+        ('geographic_granularity', 'local authority'),
+        ('geographic_coverage', '111100: United Kingdom (England, Scotland, Wales, Northern Ireland)'),
+        ('temporal_granularity', 'year'),
+        ('temporal_coverage-from', '2009-01-01'),
+        ('temporal_coverage-to', '2009-12-31'),
+        ('published_by', 'Ordnance Survey [1234]'),
+        ('national_statistic', 'no'),
+        ]]
+    for i in range(num_extras - len(extras)):
+        # the INSPIRE fields, e.g. spatial-reference-system, bbox-east-long
+        extras.append({'key': 'uklp-field-%i' % i, 'value': 'value %i' % i})
+    return {'name': 'os-mastermap', 'title': 'OS MasterMap',
+            'notes': 'Large scale topographic data',
+            'extras': extras, 'tags': [], 'resources': []}
+
+def to_form(pkg_dict, schema):
+    return validate(pkg_dict, schema, {})
+
+def command():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    pkg_dict = uklp_package_dict()
+    schema = PackageGov3Controller._db_to_form_schema.im_func(None)
+    current_convert_from_extras = package_gov3.convert_from_extras
+    previous_schema = dict((key, [previous_convert_from_extras \
+                                  if converter is current_convert_from_extras \
+                                  else converter for converter in converters]) \
+                           if isinstance(converters, list) else (key, converters) \
+                           for key, converters in schema.items())
+    assert to_form(pkg_dict, schema) == to_form(pkg_dict, previous_schema)
+    print 'db-to-form validation of a package with %i extras, %i times' % \
+          (len(pkg_dict['extras']), repeats)
+    timings = []
+    for s in (previous_schema, schema):
+        timings.append(timeit.timeit(lambda: to_form(pkg_dict, s),
+                                     number=repeats))
+    print '  previous: %.2fms  current: %.2fms  speed-up: %.1fx' % \
+          (timings[0] / repeats * 1e3, timings[1] / repeats * 1e3,
+           timings[0] / timings[1])
+
+if __name__ == '__main__':
+    command()
@@ -0,0 +1,60 @@
+'''
+Benchmark of TagSuggester.suggest_tags over the packages in a dump,
+comparing it with the previous implementation (a scan of each field for
+each keyword, munging each keyword found). Checks that both suggest the
+same tags for every package.
+
+Usage: python ckanext/dgu/bin/benchmark_tag_suggester.py dumpfile.json.zip [repeats]
+'''
+import sys
+import json
+import time
+
+from ckanext.dgu.schema import TagSuggester, tag_pool, tag_search_fields, \
+     tag_munge
+from ckanext.dgu.bin.dump_analysis import open_dump
+
+def previous_implementation(pkg_dict):
+    tags = set()
+    for field_name in tag_search_fields:
+        if pkg_dict.has_key(field_name):
+            text = pkg_dict[field_name]
+        else:
+            if pkg_dict.has_key('extras'):
+                text = pkg_dict['extras'].get(field_name)
+        if text and isinstance(text, (str, unicode)):
+            text_lower = text.lower()
+            for keyword in tag_pool:
+                if keyword in text_lower:
+                    tags.add(tag_munge(keyword))
+    return tags
+
+def current_implementation(pkg_dict):
+    return TagSuggester.suggest_tags(pkg_dict)
+
+def command():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    dump_filepath = sys.argv[1]
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    packages = json.load(open_dump(dump_filepath))
+    print 'Tag suggestions for %i packages, best of %i' % (len(packages), repeats)
+    for pkg_dict in packages:
+        assert previous_implementation(pkg_dict) == \
+               current_implementation(pkg_dict), pkg_dict['name']
+    timings = []
+    for func in (previous_implementation, current_implementation):
+        best = None
+        for i in range(repeats):
+            start = time.time()
+            for pkg_dict in packages:
+                func(pkg_dict)
+            duration = time.time() - start
+            best = duration if best is None else min(best, duration)
+        timings.append(best)
+    print '  previous: %.2fs  current: %.2fs  speed-up: %.1fx' % \
+          (timings[0], timings[1], timings[0] / timings[1])
+
+if __name__ == '__main__':
+    command()
@@ -7,7 +7,10 @@ import datetime
 import os
 import logging
 import re
+import csv
+import ast
 import glob
+import random
 
 from datautil.tabular import TabularData, CsvReader, CsvWriter
 from sqlalchemy.util import OrderedDict
@@ -65,11 +68,16 @@ def get_run_info():
     return run_info
 
 class AnalysisFile(object):
-    def __init__(self, analysis_filepath, run_info=None):
+    def __init__(self, analysis_filepath, run_info=None, load=True):
+        '''@param load - False if the existing file is to be replaced
+                       without reading it'''
         self.analysis_filepath = analysis_filepath
         self.data_by_date = None # {date: analysis_dict}
         self.run_info = run_info
-        self.load()
+        if load:
+            self.load()
+        else:
+            self.init()
 
     def load(self):
         '''Load analysis file and store in self.data_by_date'''
@@ -90,6 +98,14 @@ class AnalysisFile(object):
         assert isinstance(analysis_dict, dict)
         self.data_by_date[date] = analysis_dict
 
+    @classmethod
+    def append_analysis(cls, analysis_filepath, run_info, date, analysis_dict):
+        '''Adds an analysis to the end of an existing analysis file without
+        reading the rest of it, if it can.
+        @return True if it was added, or False if instead the whole file
+                needs to be written (e.g. with add_analysis and save)'''
+        return False
+
     def get_data_by_date_sorted(self):
         '''Returns the data as a list of tuples (date, analysis),
         sorted by date.'''
@@ -97,6 +113,9 @@ class AnalysisFile(object):
                       key=lambda (date, analysis): date)
 
 class TabularAnalysisFile(AnalysisFile):
+    # order of the columns, if known (e.g. from an AnalysisHistory)
+    columns = None
+
     def load(self):
         '''Load analysis file and store in self.data_by_date'''
         assert self.data_by_date == None, 'Data already present'
@@ -119,7 +138,9 @@ class TabularAnalysisFile(AnalysisFile):
 
     def save(self):
         '''Save self.data_by_date to analysis file'''
-        if self.data_by_date:
+        if self.data_by_date and self.columns:
+            header = ['date'] + list(self.columns)
+        elif self.data_by_date:
             header = ['date']
             for date in self.data_by_date:
                 for column in self.data_by_date[date].keys():
@@ -141,6 +162,35 @@ class TabularAnalysisFile(AnalysisFile):
         raise NotImplementedError
 
 class CsvAnalysisFile(TabularAnalysisFile):
+    @classmethod
+    def append_analysis(cls, analysis_filepath, run_info, date, analysis_dict):
+        '''Appends a row, unless the analysis has keys that are not in the
+        header or the date is not after the last one in the file.'''
+        if not os.path.exists(analysis_filepath):
+            return False
+        fileobj = open(analysis_filepath, 'rb+')
+        try:
+            header = list(csv.reader([fileobj.readline()]))[0:1]
+            if not header or not header[0] or header[0][0] != 'date':
+                return False
+            header = header[0]
+            analysis_dict = dict((_utf8(key), value) for key, value \
+                                 in analysis_dict.items())
+            if [key for key in analysis_dict if key not in header]:
+                # new columns
+                return False
+            last_date_str = read_last_line(fileobj).split(',')[0]
+            if last_date_str != 'date' and \
+                   parse_date(last_date_str) >= date:
+                return False
+            fileobj.seek(0, os.SEEK_END)
+            row = [format_date(date)] + [_utf8(analysis_dict.get(title)) \
+                                         for title in header[1:]]
+            csv.writer(fileobj).writerow(row)
+        finally:
+            fileobj.close()
+        return True
+
     def load_table(self):
         if not os.path.exists(self.analysis_filepath):
             log.info('Creating new analysis file: %s', self.analysis_filepath)
@@ -156,13 +206,41 @@ class CsvAnalysisFile(TabularAnalysisFile):
             fileobj.close()
 
 class TxtAnalysisFile(AnalysisFile):
+    line_regex = re.compile(r'^(\d{4}-\d{2}-\d{2}) : (.*)\n')
+    date_updated_regex = re.compile(r'^Date last updated: .*$', re.MULTILINE)
+
+    @classmethod
+    def append_analysis(cls, analysis_filepath, run_info, date, analysis_dict):
+        '''Appends a line, unless the date is not after the last one in the
+        file. The date in the run info at the top is updated in place.'''
+        if not os.path.exists(analysis_filepath):
+            return False
+        fileobj = open(analysis_filepath, 'rb+')
+        try:
+            match = cls.line_regex.match(read_last_line(fileobj) + '\n')
+            if match and parse_date(match.group(1)) >= date:
+                return False
+            fileobj.seek(0)
+            head = fileobj.read(len(run_info) + 1024)
+            old_match = cls.date_updated_regex.search(head)
+            new_match = cls.date_updated_regex.search(run_info)
+            if old_match and new_match and \
+                   len(old_match.group()) == len(new_match.group()):
+                fileobj.seek(old_match.start())
+                fileobj.write(new_match.group())
+            fileobj.seek(0, os.SEEK_END)
+            fileobj.write('%s : %s\n' % (format_date(date), repr(analysis_dict)))
+        finally:
+            fileobj.close()
+        return True
+
     def load(self):
         self.data_by_date = {}
         if not os.path.exists(self.analysis_filepath):
             log.info('Creating new analysis file: %s', self.analysis_filepath)
             return
         fileobj = open(self.analysis_filepath, 'r')
-        regex = re.compile(r'^(\d{4}-\d{2}-\d{2}) : (.*)\n')
+        regex = self.line_regex
         try:
             while True:
                 line = fileobj.readline()
@@ -192,7 +270,339 @@ class TxtAnalysisFile(AnalysisFile):
                 fileobj.write(line)
         finally:
             fileobj.close()
-        
+
+class AnalysisHistory(object):
+    '''The analyses of all the dumps, by date, stored in an SQLite file so
+    that a day's analysis is added without reading or rewriting the rest.
+
+    The columns table is the schema: it lists the analysis keys in the
+    order they first appeared, and a key is added to it when an analysis
+    first has it. Each date's analysis is stored as a JSON list of values
+    in column order.
+
+    The whole history can be written out in the CSV and TXT formats with
+    materialise().
+    '''
+    def __init__(self, filepath):
+        import sqlite3
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        dirpath = os.path.dirname(self.filepath)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self._conn = sqlite3.connect(self.filepath, timeout=10)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS columns '
+                           '(position INTEGER PRIMARY KEY, name TEXT UNIQUE, '
+                           'added TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS analysis '
+                           '(date TEXT PRIMARY KEY, row TEXT)')
+        self._conn.commit()
+
+    def get_columns(self):
+        '''Returns the analysis keys, in the order they were added.'''
+        columns = []
+        for (name,) in self._conn.execute(
+            'SELECT name FROM columns ORDER BY position'):
+            # sqlite returns unicode, but keep ascii keys as str, as they
+            # are in a DumpAnalysis, so the TXT report is unchanged
+            try:
+                name = str(name)
+            except UnicodeEncodeError:
+                pass
+            columns.append(name)
+        return columns
+
+    def add_analysis(self, date, analysis_dict):
+        '''Adds (or replaces) the analysis for a date.'''
+        assert isinstance(date, datetime.date)
+        assert isinstance(analysis_dict, dict)
+        try:
+            columns = self.get_columns()
+            for key in analysis_dict:
+                if key not in columns:
+                    self._conn.execute('INSERT INTO columns VALUES (?, ?, ?)',
+                                       (len(columns), key, format_date(date)))
+                    columns.append(key)
+            row = [analysis_dict.get(column) for column in columns]
+            self._conn.execute('INSERT OR REPLACE INTO analysis VALUES (?, ?)',
+                               (format_date(date), json.dumps(row)))
+            self._conn.commit()
+        except:
+            self._conn.rollback()
+            raise
+
+    def import_analysis_file(self, analysis_file):
+        '''Adds the analyses in a CsvAnalysisFile or TxtAnalysisFile, e.g. to
+        start the history from an existing report.'''
+        for date, analysis in analysis_file.get_data_by_date_sorted():
+            if isinstance(analysis, basestring):
+                # TxtAnalysisFile has the repr of each analysis_dict
+                try:
+                    analysis = ast.literal_eval(analysis)
+                except (ValueError, SyntaxError):
+                    log.warning('Could not import analysis for %s: %r',
+                                format_date(date), analysis)
+                    continue
+            analysis_dict = OrderedDict()
+            for key, value in analysis.items():
+                if value in (None, ''):
+                    continue
+                if isinstance(value, basestring) and value.isdigit():
+                    value = int(value)
+                analysis_dict[key] = value
+            self.add_analysis(date, analysis_dict)
+
+    def get_data_by_date_sorted(self):
+        '''Returns a list of tuples (date, analysis_dict), sorted by
+        date.'''
+        columns = self.get_columns()
+        data = []
+        for date_str, row_json in self._conn.execute(
+            'SELECT date, row FROM analysis ORDER BY date'):
+            analysis_dict = OrderedDict()
+            for column, value in zip(columns, json.loads(row_json)):
+                if value is not None:
+                    analysis_dict[column] = value
+            data.append((parse_date(date_str), analysis_dict))
+        return data
+
+    def materialise(self, analysis_file):
+        '''Replaces the contents of an AnalysisFile (e.g. CsvAnalysisFile)
+        with the whole history, and saves it.'''
+        analysis_file.data_by_date = dict(self.get_data_by_date_sorted())
+        analysis_file.columns = self.get_columns()
+        analysis_file.save()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+def open_history(history_filepath, analysis_files=()):
+    '''Opens the AnalysisHistory. If it is new, it is started with the
+    analyses in the given analysis files (e.g. the existing reports). For a
+    date in more than one of them, the last file's analysis is kept.'''
+    history = AnalysisHistory(history_filepath)
+    if not len(history):
+        for analysis_file in analysis_files:
+            if analysis_file.data_by_date:
+                log.info('Adding to analysis history from: %s',
+                         analysis_file.analysis_filepath)
+                history.import_analysis_file(analysis_file)
+    return history
+
+def read_last_line(fileobj, block_size=4096):
+    '''Returns the last non-empty line of a file (without its line
+    ending), reading only the end of the file.'''
+    fileobj.seek(0, os.SEEK_END)
+    position = fileobj.tell()
+    data = ''
+    while position > 0:
+        read_size = min(block_size, position)
+        position -= read_size
+        fileobj.seek(position)
+        data = fileobj.read(read_size) + data
+        if '\n' in data.rstrip('\r\n'):
+            break
+    lines = data.rstrip('\r\n').splitlines()
+    return lines[-1] if lines else ''
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return value
+
+def open_dump(dump_filepath):
+    '''Opens a JSON dump file, which can be zipped, gzipped or plain.'''
+    if zipfile.is_zipfile(dump_filepath):
+        log.info('Unzipping...')
+        zf = zipfile.ZipFile(dump_filepath)
+        assert len(zf.infolist()) == 1, 'Archive must contain one file: %r' % zf.infolist()
+        return zf.open(zf.namelist()[0])
+    elif dump_filepath.endswith('gz'):
+        return gzip.open(dump_filepath, 'rb')
+    else:
+        return open(dump_filepath, 'rb')
+
+def iter_json_array(fileobj, chunk_size=64 * 1024):
+    '''Parses a JSON array from a file incrementally, yielding each of its
+    items in turn, so that the whole array does not need to be in memory.'''
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+    # what might be the rest of a number, e.g. ".5" or "e6"
+    number_rest = re.compile(r'[0-9.eE+-]*')
+    buf = ''
+    pos = 0
+    eof = False
+    def read_more(buf, pos):
+        # drop what has been parsed already, then add the next chunk
+        chunk = fileobj.read(chunk_size)
+        return buf[pos:] + chunk, 0, not chunk
+    # opening bracket
+    while True:
+        pos = whitespace.match(buf, pos).end()
+        if pos < len(buf) or eof:
+            break
+        buf, pos, eof = read_more(buf, pos)
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('Expected a JSON array')
+    pos += 1
+    expect_item = None # i.e. an item or the end of the array
+    while True:
+        pos = whitespace.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Unexpected end of JSON array')
+            buf, pos, eof = read_more(buf, pos)
+            continue
+        if expect_item is not True and buf[pos] == ']':
+            return
+        if expect_item is False:
+            if buf[pos] != ',':
+                raise ValueError('Expected "," or "]" at %r' % buf[pos:pos + 20])
+            pos += 1
+            expect_item = True
+            continue
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            # the item is not all in the buffer yet
+            buf, pos, eof = read_more(buf, pos)
+            continue
+        if not eof and isinstance(item, (int, long, float)) and \
+               not isinstance(item, bool) and \
+               number_rest.match(buf, end).end() == len(buf):
+            # a number at the end of the buffer might continue, and the
+            # decoder stops at the end of its integer part if the rest of
+            # it is not read yet
+            buf, pos, eof = read_more(buf, pos)
+            continue
+        pos = end
+        expect_item = False
+        yield item
+
+def iter_dump(dump_filepath):
+    '''Yields the package dicts in a JSON dump file one at a time. The
+    dump can be zipped, gzipped or plain.'''
+    fileobj = open_dump(dump_filepath)
+    try:
+        for pkg in iter_json_array(fileobj):
+            yield pkg
+    finally:
+        fileobj.close()
+
+class PackageBins(object):
+    '''Counts packages in bins (e.g. by their source), keeping a random
+    sample of the names in each as examples, no bigger than max_examples.'''
+    def __init__(self, max_examples=1):
+        self.max_examples = max_examples
+        self.counts = defaultdict(int)
+        self.examples = defaultdict(list)
+        self._random = random.Random(0)
+
+    def add(self, bin, pkg_name):
+        self.counts[bin] += 1
+        examples = self.examples[bin]
+        if len(examples) < self.max_examples:
+            examples.append(pkg_name)
+        elif self.max_examples:
+            # reservoir sampling, so each name is equally likely to be kept
+            index = self._random.randrange(self.counts[bin])
+            if index < self.max_examples:
+                examples[index] = pkg_name
+
+    def items(self):
+        '''Returns a list of (bin, count, examples), largest bin first.'''
+        return [(bin, count, self.examples[bin]) for bin, count in \
+                sorted(self.counts.items(),
+                       key=lambda (bin, count): (-count, bin))]
+
+class Analysis(object):
+    '''An analysis of the active packages in a dump, which is given the
+    packages one at a time. Subclasses say which bins a package goes in.'''
+    option = None # e.g. 'analyse_by_source' for --analyse-by-source
+    title = None # start of the keys in the analysis_dict
+
+    def __init__(self, max_examples=1):
+        self.bins = PackageBins(max_examples)
+
+    def add(self, pkg):
+        for bin in self.get_bins(pkg):
+            self.bins.add(bin, pkg['name'])
+
+    def get_bins(self, pkg):
+        '''Returns the bins that the package goes in.'''
+        raise NotImplementedError
+
+    def results(self):
+        '''Returns a list of (analysis_dict key, count).'''
+        return [('%s: %s' % (self.title, bin), count) \
+                for bin, count, examples in self.bins.items()]
+
+# Analysis classes, in the order their results are listed
+analysis_classes = []
+
+def register_analysis(analysis_class):
+    '''Adds an analysis, which can then be selected by its option.'''
+    assert analysis_class.option not in \
+           [cls.option for cls in analysis_classes], analysis_class.option
+    analysis_classes.append(analysis_class)
+    return analysis_class
+
+class SourceAnalysis(Analysis):
+    option = 'analyse_by_source'
+    title = 'Packages by source'
+
+    def get_bins(self, pkg):
+        import_source = pkg['extras'].get('import_source')
+        if import_source:
+            for prefix in import_source_prefixes:
+                if import_source.startswith(prefix):
+                    import_source = import_source_prefixes[prefix]
+                    break
+            return [import_source]
+        if pkg['extras'].get('UKLP') == 'True':
+            return ['UKLP']
+        if (pkg.get('url') or '').startswith('http://www.data4nr.net/resources/'):
+            return [import_source_prefixes['DATA4NR']]
+        if pkg['extras'].get('co_id'):
+            return [import_source_prefixes['COSPREAD']]
+        return [manual_creation]
+register_analysis(SourceAnalysis)
+
+class OnsPublishedByAnalysis(Analysis):
+    option = 'analyse_ons_by_published_by'
+    title = 'ONS packages by published_by'
+    remove_id_regex = re.compile(' \[\d+\]')
+
+    def get_bins(self, pkg):
+        import_source = pkg['extras'].get('import_source')
+        if not (import_source and import_source.startswith('ONS')):
+            return []
+        published_by = pkg['extras'].get('published_by') or ''
+        published_by = self.remove_id_regex.sub('', published_by)
+        return [published_by or 'No value']
+register_analysis(OnsPublishedByAnalysis)
+
+class LicenseAnalysis(Analysis):
+    option = 'analyse_by_license'
+    title = 'Packages by license'
+
+    def get_bins(self, pkg):
+        return [pkg.get('license_id') or 'No value']
+register_analysis(LicenseAnalysis)
+
+class ResourceFormatAnalysis(Analysis):
+    '''Counts the resources (not packages) by format.'''
+    option = 'analyse_by_resource_format'
+    title = 'Resources by format'
+
+    def get_bins(self, pkg):
+        return [(resource.get('format') or '').strip().upper() or 'No value' \
+                for resource in pkg.get('resources') or []]
+register_analysis(ResourceFormatAnalysis)
 
 class DumpAnalysis(object):
     def __init__(self, dump_filepath, options):
@@ -204,22 +614,30 @@ class DumpAnalysis(object):
     def run(self):
         self.save_date()
         self.analysis_dict = OrderedDict()
-        packages = self.get_packages()
-        self.analysis_dict['Total active and deleted packages'] = len(packages)
-        packages = self.filter_out_deleted_packages(packages)
-        self.analysis_dict['Total active packages'] = len(packages)
-
-        if self.options.analyse_by_source:
-            pkg_bins = self.analyse_by_source(packages)
-            for bin, pkgs in pkg_bins.items():
-                self.analysis_dict['Packages by source: %s' % bin] = len(pkgs)
-        if self.options.analyse_ons_by_published_by:
-            ons_packages = self.filter_by_ons_packages(packages)
-            pkg_bins = self.analyse_by_published_by(ons_packages)
-            for bin, pkgs in pkg_bins.items():
-                self.analysis_dict['ONS packages by published_by: %s' % bin] = len(pkgs)
-                
-        self.print_analysis(pkg_bins)
+        max_examples = int(self.options.examples or 0)
+        self.analyses = [analysis_class(max_examples) \
+                         for analysis_class in analysis_classes \
+                         if getattr(self.options, analysis_class.option)]
+
+        # All the analyses are done in one pass through the dump
+        num_packages = num_active_packages = 0
+        for pkg in self.get_packages():
+            num_packages += 1
+            if not self.is_active_package(pkg):
+                continue
+            num_active_packages += 1
+            for analysis in self.analyses:
+                analysis.add(pkg)
+        log.info('Read in packages: %i', num_packages)
+        log.info('Deleted packages discarded: %i', num_packages - num_active_packages)
+        log.info('Number of active packages: %i', num_active_packages)
+
+        self.analysis_dict['Total active and deleted packages'] = num_packages
+        self.analysis_dict['Total active packages'] = num_active_packages
+        for analysis in self.analyses:
+            for key, count in analysis.results():
+                self.analysis_dict[key] = count
+            self.print_analysis(analysis)
 
     def save_date(self):
         try:
@@ -231,86 +649,108 @@ class DumpAnalysis(object):
         log.info('Date of dumpfile: %r', datestr)
 
     def get_packages(self):
-        if zipfile.is_zipfile(self.dump_filepath):
-            log.info('Unzipping...')
-            zf = zipfile.ZipFile(self.dump_filepath)
-            assert len(zf.infolist()) == 1, 'Archive must contain one file: %r' % zf.infolist()
-            f = zf.open(zf.namelist()[0])
-        elif self.dump_filepath.endswith('gz'):            
-            f = gzip.open(self.dump_filepath, 'rb')
-        else:
-            f = open(self.dump_filepath, 'rb')
+        '''Yields the packages in the dump, one at a time.'''
         log.info('Reading file...')
-        json_buf = f.read()
-        log.info('Parsing JSON...')
-        packages = json.loads(json_buf)
-        log.info('Read in packages: %i' % len(packages))
-        return packages
-
-    def filter_out_deleted_packages(self, packages):
-        filtered_pkgs = []
-        for pkg in packages:
-            if pkg.has_key('state'):
-                is_active = pkg['state'] == 'active'
-            else:
-                is_active = pkg['state_id'] == 1
-            if is_active:
-                filtered_pkgs.append(pkg)
-        log.info('Deleted packages discarded: %i', (len(packages) - len(filtered_pkgs)))
-        log.info('Number of active packages: %i', (len(filtered_pkgs)))
-        return filtered_pkgs
-
-    def filter_by_ons_packages(self, packages):
-        filtered_pkgs = []
-        ons_prefix = 'ONS'
-        for pkg in packages:
-            import_source = pkg['extras'].get('import_source')
-            if import_source and import_source.startswith(ons_prefix):
-                filtered_pkgs.append(pkg)
-        log.info('Number of ONS packages: %i', (len(filtered_pkgs)))
-        return filtered_pkgs
-
-    def analyse_by_source(self, packages):
-        pkg_bins = defaultdict(list)
-        for pkg in packages:
-            import_source = pkg['extras'].get('import_source')
-            if import_source:
-                for prefix in import_source_prefixes:
-                    if import_source.startswith(prefix):
-                        import_source = import_source_prefixes[prefix]
-                        break
-                pkg_bins[import_source].append(pkg['name'])
-                continue
-            if pkg['extras'].get('UKLP') == 'True':
-                pkg_bins['UKLP'].append(pkg['name'])
-                continue
-            if (pkg.get('url') or '').startswith('http://www.data4nr.net/resources/'):
-                import_source = import_source_prefixes['DATA4NR']
-                pkg_bins[import_source].append(pkg['name'])
-                continue
-            if pkg['extras'].get('co_id'):
-                import_source = import_source_prefixes['COSPREAD']
-                pkg_bins[import_source].append(pkg['name'])
-                continue                
-            pkg_bins[manual_creation].append(pkg['name'])
-        return pkg_bins
-
-    def analyse_by_published_by(self, packages):
-        pkg_bins = defaultdict(list)
-        remove_id_regex = re.compile(' \[\d+\]')
-        for pkg in packages:
-            published_by = pkg['extras'].get('published_by')
-            published_by = remove_id_regex.sub('', published_by)
-            if published_by:
-                pkg_bins[published_by].append(pkg['name'])
-                continue
-            pkg_bins['No value'].append(pkg['name'])
-        return pkg_bins
+        return iter_dump(self.dump_filepath)
 
-    def print_analysis(self, pkg_bins):
-        log.info('* Analysis by source *')
-        for pkg_bin, pkgs in sorted(pkg_bins.items(), key=lambda (pkg_bin, pkgs): -len(pkgs)):
-            log.info('  %s: %i (e.g. %r)', pkg_bin, len(pkgs), pkgs[:int(self.options.examples)])
+    @staticmethod
+    def is_active_package(pkg):
+        if pkg.has_key('state'):
+            return pkg['state'] == 'active'
+        else:
+            return pkg['state_id'] == 1
+
+    def print_analysis(self, analysis):
+        log.info('* %s *', analysis.title)
+        for pkg_bin, count, examples in analysis.bins.items():
+            log.info('  %s: %i (e.g. %r)', pkg_bin, count, examples)
+
+analysis_cache_suffix = '.analysis.json'
+
+def analysis_cache_filepath(dump_filepath, cache_dir):
+    '''Returns the path of the file that caches a dump's analysis. It is
+    kept in its own directory, not amongst the dumps, so that it is not
+    taken for a dump itself.'''
+    return os.path.join(cache_dir,
+                        os.path.basename(dump_filepath) + analysis_cache_suffix)
+
+def analyse_dump(dump_filepath, options, cache_dir=None):
+    '''Analyses a dump, unless the analysis is already cached in cache_dir
+    (if given). The cached analysis is used as long as the dump has the
+    same size and modification time and the same analyses are requested.
+
+    @return (date, analysis_dict)
+    '''
+    stat = os.stat(dump_filepath)
+    cache_key = {'size': stat.st_size,
+                 'mtime': int(stat.st_mtime),
+                 'analyses': [analysis_class.option \
+                              for analysis_class in analysis_classes \
+                              if getattr(options, analysis_class.option)]}
+    if not cache_dir:
+        analysis = DumpAnalysis(dump_filepath, options)
+        return analysis.date, analysis.analysis_dict
+    cache_filepath = analysis_cache_filepath(dump_filepath, cache_dir)
+    if os.path.exists(cache_filepath):
+        try:
+            fileobj = open(cache_filepath, 'rb')
+            try:
+                cache = json.load(fileobj)
+            finally:
+                fileobj.close()
+        except (IOError, ValueError), e:
+            log.warning('Ignoring analysis cache %s: %s', cache_filepath, e)
+        else:
+            if cache.get('key') == cache_key:
+                log.info('Using cached analysis: %s', cache_filepath)
+                date = parse_date(cache['date']) if cache['date'] else None
+                return date, OrderedDict(cache['analysis'])
+
+    analysis = DumpAnalysis(dump_filepath, options)
+    cache = {'key': cache_key,
+             'date': format_date(analysis.date) if analysis.date else None,
+             'analysis': analysis.analysis_dict.items()}
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fileobj = open(cache_filepath, 'wb')
+        try:
+            json.dump(cache, fileobj)
+        finally:
+            fileobj.close()
+    except (IOError, OSError), e:
+        log.warning('Could not save analysis cache %s: %s', cache_filepath, e)
+    return analysis.date, analysis.analysis_dict
+
+def _analyse_dump_in_pool(args):
+    # multiprocessing.Pool can only call a module-level function
+    dump_filepath, options, cache_dir = args
+    return analyse_dump(dump_filepath, DumpAnalysisOptions(**options),
+                        cache_dir)
+
+def analyse_dumps(dump_filepaths, options, processes=None, cache_dir=None):
+    '''Analyses the dumps, spread over a pool of processes (by default one
+    per CPU).
+
+    @return list of (dump_filepath, date, analysis_dict)
+    '''
+    # DumpAnalysisOptions cannot be pickled, so pass a plain dict
+    options_dict = dict(options) if isinstance(options, dict) \
+                   else dict(vars(options))
+    jobs = [(dump_filepath, options_dict, cache_dir) \
+            for dump_filepath in dump_filepaths]
+    if processes == 1 or len(jobs) < 2:
+        results = map(_analyse_dump_in_pool, jobs)
+    else:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_analyse_dump_in_pool, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return [(dump_filepath, date, analysis_dict) for dump_filepath, \
+            (date, analysis_dict) in zip(dump_filepaths, results)]
 
 class Command(command.Command):
     usage = 'usage: %prog [options] dumpfile.json.zip'
@@ -324,19 +764,34 @@ class Command(command.Command):
         self.parser.add_option('--txt', dest='txt_filepath',
                                help='add analysis to textual report FILENAME',
                                metavar='FILENAME')
+        self.parser.add_option('--history', dest='history_filepath',
+                               help='add analysis to history FILENAME, and append it to the CSV and textual reports (which are written in full from the history if the analysis has new columns)',
+                               metavar='FILENAME')
+        self.parser.add_option('--rewrite-reports', dest='rewrite_reports',
+                               action='store_true', default=False,
+                               help='with --history, write the CSV and textual reports in full from the history')
         self.parser.add_option('--examples', dest='examples',
                                default='1',
                                help='show NUMBER of examples for each category',
                                metavar='NUMBER')
-        self.parser.add_option('--analyse-by-source', dest='analyse_by_source',
-                               action="store_true")
-        self.parser.add_option('--analyse-ons-by-published-by', dest='analyse_ons_by_published_by',
-                               action="store_true")
+        self.parser.add_option('--processes', dest='processes', type='int',
+                               help='analyse dumps in NUMBER processes (default is one per CPU)',
+                               metavar='NUMBER')
+        self.parser.add_option('--cache-dir', dest='cache_dir',
+                               help='cache the analysis of each dump in DIRECTORY (not the dumps directory), to use if the dump is analysed again',
+                               metavar='DIRECTORY')
+        for analysis_class in analysis_classes:
+            option = analysis_class.option
+            self.parser.add_option('--%s' % option.replace('_', '-'),
+                                   dest=option, action="store_true")
 
     def parse_args(self):
         super(Command, self).parse_args()
-        if not (self.options.analyse_by_source or \
-                self.options.analyse_ons_by_published_by):
+        if not self.args and self.options.history_filepath:
+            # just writing the reports from the history
+            return
+        if not [analysis_class for analysis_class in analysis_classes \
+                if getattr(self.options, analysis_class.option)]:
             self.parser.error('Need to specify one or more analysese.')
     
     def command(self):
@@ -344,32 +799,64 @@ class Command(command.Command):
         input_filepaths = []
         for input_file_descriptor in input_file_descriptors:
             input_filepaths.extend(glob.glob(os.path.expanduser(input_file_descriptor)))
+        # analysis caches left amongst the dumps (by earlier versions)
+        input_filepaths = [input_filepath for input_filepath in input_filepaths \
+                           if not input_filepath.endswith(analysis_cache_suffix)]
 
-        # Open output files
         output_types = (
             # (output_filepath, analysis_file_class)
             (self.options.txt_filepath, TxtAnalysisFile),
             (self.options.csv_filepath, CsvAnalysisFile),
             )
-        analysis_files = {} # analysis_file_class, analysis_file
+        output_types = [(output_filepath, analysis_file_class) \
+                        for output_filepath, analysis_file_class in output_types \
+                        if output_filepath]
         run_info = get_run_info()
-        for output_filepath, analysis_file_class in output_types:
-            if output_filepath:
-                analysis_files[analysis_file_class] = analysis_file_class(output_filepath, run_info)
 
-        for input_filepath in input_filepaths:
-            # Run analysis
-            analysis = DumpAnalysis(input_filepath, self.options)
-
-            if analysis_files:
-                assert analysis.date, 'The results are requested to be saved to '
+        # Run analyses
+        results = analyse_dumps(input_filepaths, self.options,
+                                processes=self.options.processes,
+                                cache_dir=self.options.cache_dir)
+        for input_filepath, date, analysis_dict in results:
+            if output_types or self.options.history_filepath:
+                assert date, 'The results are requested to be saved to '
                 'an analysis file which is sorted by date, but could not find '
                 'a date in the input filename: %s' % input_filepath
+        results.sort(key=lambda result: result[1])
 
-            for analysis_file_class, analysis_file in analysis_files.items():
-                analysis_file.add_analysis(analysis.date, analysis.analysis_dict)
-                # Save
+        if not self.options.history_filepath:
+            for output_filepath, analysis_file_class in output_types:
+                analysis_file = analysis_file_class(output_filepath, run_info)
+                for input_filepath, date, analysis_dict in results:
+                    analysis_file.add_analysis(date, analysis_dict)
                 analysis_file.save()
+            log.info('Finished')
+            return
+
+        # The reports are only read if the history is new (to start it)
+        analysis_files = []
+        if not os.path.exists(self.options.history_filepath):
+            analysis_files = [analysis_file_class(output_filepath, run_info) \
+                              for output_filepath, analysis_file_class in output_types \
+                              if os.path.exists(output_filepath)]
+        history = open_history(self.options.history_filepath, analysis_files)
+        for input_filepath, date, analysis_dict in results:
+            history.add_analysis(date, analysis_dict)
+        for output_filepath, analysis_file_class in output_types:
+            appended = results and not self.options.rewrite_reports
+            for input_filepath, date, analysis_dict in results:
+                if not appended:
+                    break
+                appended = analysis_file_class.append_analysis(
+                    output_filepath, run_info, date, analysis_dict)
+            if appended:
+                log.info('Added analysis to: %s', output_filepath)
+            else:
+                # e.g. there are new columns, so the whole file is rewritten
+                log.info('Writing analysis from history: %s', output_filepath)
+                history.materialise(analysis_file_class(output_filepath, run_info,
+                                                        load=False))
+        history.close()
         log.info('Finished')
 
 def command():
@@ -0,0 +1,239 @@
+'''
+Writes the package dumps for end-users (JSON and CSV, each zipped) in a
+single pass through the packages, straight into the zip files. The
+output is the same as ckan.lib.dumper.SimpleDumper's.
+'''
+import csv
+import time
+import tempfile
+import zlib
+import struct
+import zipfile
+import logging
+from StringIO import StringIO
+
+from ckan.lib.helpers import json
+
+log = logging.getLogger(__name__)
+
+class ZipEntryWriter(object):
+    '''File-like object that deflates what is written to it into a new
+    entry in a ZipFile (open for writing), so the entry's content need not
+    be in memory or in a temporary file. Nothing else can be written to the
+    ZipFile until close() is called.'''
+    def __init__(self, zip_file, arcname):
+        self.zip_file = zip_file
+        self.zinfo = zipfile.ZipInfo(arcname,
+                                     date_time=time.localtime(time.time())[:6])
+        self.zinfo.compress_type = zipfile.ZIP_DEFLATED
+        self.zinfo.external_attr = 0644 << 16L
+        self.zinfo.header_offset = zip_file.fp.tell()
+        self.zinfo.CRC = self.zinfo.compress_size = self.zinfo.file_size = 0
+        # the CRC and sizes in the header are filled in by close()
+        zip_file.fp.write(self.zinfo.FileHeader())
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                            zlib.DEFLATED, -15)
+        self._crc = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf8')
+        self._crc = zlib.crc32(data, self._crc)
+        self.zinfo.file_size += len(data)
+        self._write_compressed(self._compressor.compress(data))
+
+    def _write_compressed(self, data):
+        self.zinfo.compress_size += len(data)
+        self.zip_file.fp.write(data)
+
+    def close(self):
+        self._write_compressed(self._compressor.flush())
+        zinfo = self.zinfo
+        if zinfo.file_size > zipfile.ZIP64_LIMIT or \
+               zinfo.compress_size > zipfile.ZIP64_LIMIT:
+            raise zipfile.LargeZipFile('Zip entry too large: %s' % zinfo.filename)
+        zinfo.CRC = self._crc & 0xffffffff
+        fp = self.zip_file.fp
+        position = fp.tell()
+        fp.seek(zinfo.header_offset + 14)
+        fp.write(struct.pack('<LLL', zinfo.CRC, zinfo.compress_size,
+                             zinfo.file_size))
+        fp.seek(position)
+        self.zip_file.filelist.append(zinfo)
+        self.zip_file.NameToInfo[zinfo.filename] = zinfo
+        self.zip_file._didModify = True
+
+class JsonDumpWriter(object):
+    '''Writes package dicts as a JSON list, one at a time, laid out as
+    json.dump(pkgs, indent=4) would.'''
+    # what json puts after each item but the last (e.g. ', ' or ',')
+    item_separator = json.dumps([0, 0], indent=4).split('0')[1].split('\n')[0]
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.num_packages = 0
+
+    def add(self, pkg_dict):
+        # each item is on a new line, indented
+        item_json = json.dumps([pkg_dict], indent=4)[1:-2]
+        self.fileobj.write(('[' if not self.num_packages else \
+                            self.item_separator) + item_json)
+        self.num_packages += 1
+
+    def close(self):
+        self.fileobj.write('\n]' if self.num_packages else '[]')
+
+class CsvDumpWriter(object):
+    '''Writes package dicts as CSV rows, flattened in the same way as
+    SimpleDumper.dump_csv. The column titles are only known once all the
+    packages have been seen, so until close() the rows are kept in a
+    temporary file, not in memory. Each row there is preceded by its length
+    in bytes and its number of columns, so that close() can pad it to the
+    full number of columns.'''
+    # row prefix in the temporary file: byte length, number of columns
+    row_prefix_format = '%010d %06d '
+    row_prefix_length = len(row_prefix_format % (0, 0))
+    quoted_none = '""' # how csv.QUOTE_NONNUMERIC writes None
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._col_titles = []
+        self._col_indexes = {}
+        self._rows_file = tempfile.TemporaryFile()
+        self._row_buffer = StringIO()
+        self._row_writer = self._csv_writer(self._row_buffer)
+
+    @staticmethod
+    def _csv_writer(fileobj):
+        return csv.writer(fileobj, quotechar='"',
+                          quoting=csv.QUOTE_NONNUMERIC)
+
+    def add(self, pkg_dict):
+        row_dict = self.flatten(pkg_dict)
+        row = [None] * len(self._col_titles)
+        for title, value in row_dict.items():
+            if title not in self._col_indexes:
+                self._col_indexes[title] = len(self._col_titles)
+                self._col_titles.append(title)
+                row.append(None)
+            if isinstance(value, unicode):
+                value = value.encode('utf8')
+            row[self._col_indexes[title]] = value
+        self._row_buffer.seek(0)
+        self._row_buffer.truncate()
+        self._row_writer.writerow(row)
+        row_csv = self._row_buffer.getvalue()
+        self._rows_file.write(self.row_prefix_format % (len(row_csv), len(row)))
+        self._rows_file.write(row_csv)
+
+    @staticmethod
+    def flatten(pkg_dict):
+        for name, value in pkg_dict.items()[:]:
+            if isinstance(value, (list, tuple)):
+                if value and isinstance(value[0], dict) and name == 'resources':
+                    for i, res in enumerate(value):
+                        prefix = 'resource-%i' % i
+                        pkg_dict[prefix + '-url'] = res['url']
+                        pkg_dict[prefix + '-format'] = res['format']
+                        pkg_dict[prefix + '-description'] = res['description']
+                else:
+                    pkg_dict[name] = ' '.join(value)
+            if isinstance(value, dict):
+                for name_, value_ in value.items():
+                    pkg_dict[name_] = value_
+                del pkg_dict[name]
+        return pkg_dict
+
+    def close(self):
+        self._csv_writer(self.fileobj).writerow(self._col_titles)
+        num_cols = len(self._col_titles)
+        rows_file = self._rows_file
+        rows_file.seek(0)
+        while True:
+            prefix = rows_file.read(self.row_prefix_length)
+            if not prefix:
+                break
+            row_length, row_num_cols = [int(x) for x in prefix.split()]
+            # without its line terminator
+            row_csv = rows_file.read(row_length)[:-len('\r\n')]
+            padding = [self.quoted_none] * (num_cols - row_num_cols)
+            if padding:
+                row_csv = ','.join(([row_csv] if row_num_cols else []) + padding)
+            self.fileobj.write(row_csv + '\r\n')
+        rows_file.close()
+
+# Collections loaded with each package, so that as_dict() does not query
+# for them one package at a time. Those that are not in the installed
+# version of the model are left to load lazily.
+eager_load_paths = ('_extras', 'package_tags.tag',
+                    'resource_groups_all.resources_all')
+
+def eager_load_options(model_class, paths=eager_load_paths):
+    from sqlalchemy.orm import class_mapper, eagerload_all
+    options = []
+    for path in paths:
+        mapper = class_mapper(model_class)
+        for name in path.split('.'):
+            if not mapper.has_property(name):
+                log.warning('Not eager loading %s: %s has no %s',
+                            path, mapper.class_.__name__, name)
+                break
+            mapper = mapper.get_property(name).mapper
+        else:
+            options.append(eagerload_all(path))
+    return options
+
+def iter_package_dicts(batch_size=100):
+    '''Yields the as_dict() of every package in the database (including
+    deleted ones), in order of id. They are loaded in batches with their
+    extras, resources and tags, keeping only one batch in the session at a
+    time.'''
+    import ckan.model as model
+    options = eager_load_options(model.Package)
+    # Eager loading collections does not work with Query.yield_per, so
+    # each batch of packages is got by the ids that follow the last batch.
+    last_id = None
+    while True:
+        query = model.Session.query(model.Package.id)
+        if last_id is not None:
+            query = query.filter(model.Package.id > last_id)
+        batch_ids = [pkg_id for (pkg_id,) in \
+                     query.order_by(model.Package.id).limit(batch_size)]
+        if not batch_ids:
+            break
+        query = model.Session.query(model.Package) \
+                .filter(model.Package.id.in_(batch_ids)) \
+                .order_by(model.Package.id) \
+                .options(*options)
+        for pkg in query:
+            yield pkg.as_dict()
+        model.Session.expunge_all()
+        last_id = batch_ids[-1]
+
+def dump_packages(pkg_dicts, json_zip_filepath, csv_zip_filepath,
+                  json_arcname, csv_arcname):
+    '''Writes the package dicts into the JSON and CSV zip files.
+    @return number of packages written'''
+    zip_files = []
+    writers = []
+    try:
+        for writer_class, filepath, arcname in (
+            (JsonDumpWriter, json_zip_filepath, json_arcname),
+            (CsvDumpWriter, csv_zip_filepath, csv_arcname)):
+            log.info('Creating dump file: %s', filepath)
+            zip_file = zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED)
+            zip_files.append(zip_file)
+            writers.append(writer_class(ZipEntryWriter(zip_file, arcname)))
+        num_packages = 0
+        for pkg_dict in pkg_dicts:
+            # the JSON is written before CsvDumpWriter flattens the dict
+            for writer in writers:
+                writer.add(pkg_dict)
+            num_packages += 1
+        for writer in writers:
+            writer.close()
+            writer.fileobj.close()
+    finally:
+        for zip_file in zip_files:
+            zip_file.close()
+    return num_packages
@@ -4,7 +4,6 @@ Daily script for gov server
 import os
 import logging
 import sys
-import zipfile
 import traceback
 import datetime
 import re
@@ -12,7 +11,8 @@ import re
 # Import ckan as it changes the dependent packages imported
 import ckan
 
-from dump_analysis import get_run_info, TxtAnalysisFile, CsvAnalysisFile, DumpAnalysisOptions, DumpAnalysis
+from dump_analysis import get_run_info, TxtAnalysisFile, CsvAnalysisFile, DumpAnalysisOptions, DumpAnalysis, open_history
+from dump_writer import dump_packages, iter_package_dicts
 
 def load_config(path):
     import paste.deploy
@@ -75,7 +75,6 @@ def command():
                                  ckan_instance_name + '.%Y-%m-%d.pg_dump')
     log_filepath = os.path.join(log_dir, 'gov-daily.log')
     print 'Logging to: %s' % log_filepath
-    tmp_filepath = config.get('ckan.temp_filepath', '/tmp/dump.tmp')
     logging.basicConfig(filename=log_filepath, level=logging.INFO)
     logging.info('----------------------------')
     logging.info('Starting daily script')
@@ -83,7 +82,6 @@ def command():
     logging.info(start_time.strftime('%H:%M %d-%m-%Y'))
 
     import ckan.model as model
-    import ckan.lib.dumper as dumper
 
     # Check database looks right
     num_packages_before = model.Session.query(model.Package).count()
@@ -99,21 +97,16 @@ def command():
     if not os.path.exists(dump_dir):
         logging.info('Creating dump dir: %s' % dump_dir)
         os.makedirs(dump_dir)
-    query = model.Session.query(model.Package)
     dump_file_base = start_time.strftime(dump_filebase)
     logging.getLogger("MARKDOWN").setLevel(logging.WARN)
-    for file_type, dumper_ in (('csv', dumper.SimpleDumper().dump_csv),
-                              ('json', dumper.SimpleDumper().dump_json),
-                             ):
-        dump_filename = '%s.%s' % (dump_file_base, file_type)
-        dump_filepath = os.path.join(dump_dir, dump_filename + '.zip')
-        tmp_file = open(tmp_filepath, 'w')
-        logging.info('Creating %s file: %s' % (file_type, dump_filepath))
-        dumper_(tmp_file, query)
-        tmp_file.close()
-        dump_file = zipfile.ZipFile(dump_filepath, 'w', zipfile.ZIP_DEFLATED)
-        dump_file.write(tmp_filepath, dump_filename)
-        dump_file.close()
+    # Both dumps are written in one pass through the packages
+    num_packages = dump_packages(
+        iter_package_dicts(),
+        json_zip_filepath=os.path.join(dump_dir, '%s.json.zip' % dump_file_base),
+        csv_zip_filepath=os.path.join(dump_dir, '%s.csv.zip' % dump_file_base),
+        json_arcname='%s.json' % dump_file_base,
+        csv_arcname='%s.csv' % dump_file_base)
+    logging.info('Packages dumped: %i' % num_packages)
     report_time_taken()
 
     # Dump analysis
@@ -121,21 +114,36 @@ def command():
     json_dump_filepath = os.path.join(dump_dir, '%s.json.zip' % dump_file_base)
     txt_filepath = os.path.join(dump_dir, dump_analysis_filebase + '.txt')
     csv_filepath = os.path.join(dump_dir, dump_analysis_filebase + '.csv')
+    history_filepath = os.path.join(dump_dir, dump_analysis_filebase + '.history.db')
     run_info = get_run_info()
     options = DumpAnalysisOptions(analyse_by_source=True)
     analysis = DumpAnalysis(json_dump_filepath, options)
-    logging.info('Saving dump analysis')
+    logging.info('Saving dump analysis to history: %s' % history_filepath)
     output_types = (
         # (output_filepath, analysis_file_class)
         (txt_filepath, TxtAnalysisFile),
         (csv_filepath, CsvAnalysisFile),
         )
-    analysis_files = {} # analysis_file_class, analysis_file
+    analysis_files = []
+    if not os.path.exists(history_filepath):
+        # start the history from the existing reports
+        analysis_files = [analysis_file_class(output_filepath, run_info) \
+                          for output_filepath, analysis_file_class in output_types \
+                          if os.path.exists(output_filepath)]
+    history = open_history(history_filepath, analysis_files)
+    history.add_analysis(analysis.date, analysis.analysis_dict)
     for output_filepath, analysis_file_class in output_types:
-        logging.info('Saving dump analysis to: %s' % output_filepath)
-        analysis_file = analysis_file_class(output_filepath, run_info)
-        analysis_file.add_analysis(analysis.date, analysis.analysis_dict)
-        analysis_file.save()
+        if analysis_file_class.append_analysis(output_filepath, run_info,
+                                               analysis.date,
+                                               analysis.analysis_dict):
+            logging.info('Added dump analysis to: %s' % output_filepath)
+        else:
+            # e.g. there are new columns, so the whole file is rewritten
+            logging.info('Saving dump analysis to: %s' % output_filepath)
+            analysis_file = analysis_file_class(output_filepath, run_info,
+                                                load=False)
+            history.materialise(analysis_file)
+    history.close()
     report_time_taken()
 
     # Create complete backup
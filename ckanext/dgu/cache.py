@@ -0,0 +1,209 @@
+'''
+Small key/value caches with a time-to-live and a size bound, used to
+avoid repeating slow lookups (e.g. Drupal XML-RPC calls).
+
+MemoryCache lives in the process. SqliteCache is stored in a file, so
+it is shared by all the worker processes on a machine.
+'''
+import os
+import time
+import threading
+import logging
+import cPickle as pickle
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# returned by get() when the key is not cached (or has expired), so that
+# a cached None (i.e. a negative result) can be told apart
+CACHE_MISS = object()
+
+class MemoryCache(object):
+    '''In-process cache. Thread-safe. When full, the least recently used
+    item is evicted.'''
+    def __init__(self, ttl=300, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict() # {key: (expires, value)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires, value = self._items.pop(key)
+            except KeyError:
+                return CACHE_MISS
+            if expires < time.time():
+                return CACHE_MISS
+            # re-insert to mark it as the most recently used
+            self._items[key] = (expires, value)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (expires, value)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+class SqliteCache(object):
+    '''Cache stored in an SQLite file, shared between processes. Values
+    are pickled. When full, the least recently used items are evicted.
+
+    To save writing to the file (which locks it for all the processes) on
+    every get, an item's last access time is only updated when it is older
+    than access_interval, and the eviction only runs every evict_interval
+    sets, so the number of items can be a little over max_size.'''
+    # seconds
+    access_interval = 60
+
+    def __init__(self, filepath, ttl=300, max_size=1000):
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        self.ttl = ttl
+        self.max_size = max_size
+        self.evict_interval = max(max_size // 10, 1)
+        self._sets_since_eviction = 0
+        # sqlite connections cannot be shared between threads
+        self._local = threading.local()
+        dirpath = os.path.dirname(self.filepath)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                     '(key TEXT PRIMARY KEY, value BLOB, '
+                     'expires REAL, accessed REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed '
+                     'ON cache (accessed)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.filepath, timeout=10)
+            conn.text_factory = str
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute('SELECT value, expires, accessed FROM cache '
+                           'WHERE key=?', (key,)).fetchone()
+        if row is None:
+            return CACHE_MISS
+        value, expires, accessed = row
+        if expires < now:
+            conn.execute('DELETE FROM cache WHERE key=?', (key,))
+            conn.commit()
+            return CACHE_MISS
+        if accessed < now - self.access_interval:
+            conn.execute('UPDATE cache SET accessed=? WHERE key=?', (now, key))
+            conn.commit()
+        return pickle.loads(str(value))
+
+    def set(self, key, value, ttl=None):
+        conn = self._connection()
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        import sqlite3
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                     (key, sqlite3.Binary(pickle.dumps(value, 2)),
+                      expires, now))
+        self._sets_since_eviction += 1
+        if self._sets_since_eviction >= self.evict_interval:
+            self._sets_since_eviction = 0
+            # evict the least recently used items
+            conn.execute('DELETE FROM cache WHERE key IN '
+                         '(SELECT key FROM cache ORDER BY accessed DESC '
+                         'LIMIT -1 OFFSET ?)', (self.max_size,))
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache WHERE key=?', (key,))
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute('DELETE FROM cache')
+        conn.commit()
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM cache').fetchone()[0]
+
+def memoize(max_size=10000):
+    '''Decorator that remembers the results of a function of one
+    (hashable) argument. It is cheap enough for functions that only take
+    a few microseconds, so instead of a strict least-recently-used order
+    the results are kept in two generations: when the newer one is full,
+    the older one is dropped and results still being used are moved up
+    as they are asked for. At most max_size results are kept.'''
+    generation_size = max(max_size // 2, 1)
+    def decorator(func):
+        generations = [{}, {}] # [newer, older]
+        def memoized(arg):
+            # the type is part of the key, so that e.g. a str argument
+            # does not get the result cached for the equal unicode one
+            key = (type(arg), arg)
+            newer = generations[0]
+            try:
+                return newer[key]
+            except KeyError:
+                pass
+            result = generations[1].get(key, CACHE_MISS)
+            if result is CACHE_MISS:
+                result = func(arg)
+            if len(newer) >= generation_size:
+                generations[:] = [{}, newer]
+                newer = generations[0]
+            newer[key] = result
+            return result
+        memoized.__name__ = func.__name__
+        memoized.__doc__ = func.__doc__
+        memoized.uncached = func
+        return memoized
+    return decorator
+
+def cache_from_config(config, prefix, default_ttl=300, default_max_size=1000):
+    '''Creates a cache from options in a config dict, e.g. for
+    prefix "dgu.session_cache":
+
+        dgu.session_cache.backend = sqlite     (memory|sqlite|none)
+        dgu.session_cache.path = /var/lib/ckan/dgu/session_cache.db
+        dgu.session_cache.ttl = 300            (seconds)
+        dgu.session_cache.max_size = 1000      (items)
+
+    Returns None if the backend is "none".
+    '''
+    config = config or {}
+    backend = config.get(prefix + '.backend', 'memory')
+    ttl = int(config.get(prefix + '.ttl', default_ttl))
+    max_size = int(config.get(prefix + '.max_size', default_max_size))
+    if backend == 'none':
+        return None
+    elif backend == 'memory':
+        return MemoryCache(ttl=ttl, max_size=max_size)
+    elif backend == 'sqlite':
+        filepath = config.get(prefix + '.path')
+        if not filepath:
+            raise ValueError('Config option %s.path must be set for the '
+                             'sqlite cache' % prefix)
+        log.info('Cache %s stored in: %s', prefix, filepath)
+        return SqliteCache(filepath, ttl=ttl, max_size=max_size)
+    else:
+        raise ValueError('Config option %s.backend not recognised: %r' % \
+                         (prefix, backend))
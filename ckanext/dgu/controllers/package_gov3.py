@@ -13,6 +13,7 @@ from ckan.lib.field_types import DateType, DateConvertError
 from ckan.authz import Authorizer
 from ckan.lib.navl.dictization_functions import Invalid
 from ckanext.dgu.forms.package_gov_fields import GeoCoverageType
+from ckanext.dgu.forms.package_gov3 import get_license_options
 from ckan.lib.navl.dictization_functions import validate, missing
 from ckan.lib.navl.validators import (ignore_missing,
                                       not_empty,
@@ -58,7 +59,7 @@ class PackageGov3Controller(PackageController):
     package_form = 'package_gov3.html'
 
     def _setup_template_variables(self, context, data_dict=None):
-        c.licences = [('', '')] + model.Package.get_license_options()
+        c.licences = [('', '')] + get_license_options()
         c.geographic_granularity = geographic_granularity
         c.update_frequency = update_frequency
         c.temporal_granularity = temporal_granularity 
@@ -171,19 +172,31 @@ def date_to_form(value, context):
 
 def convert_to_extras(key, data, errors, context):
 
-    extras = data.get(('extras',), [])
+    extras = data.get(('extras',))
     if not extras:
-        data[('extras',)] = extras
+        extras = data[('extras',)] = []
 
     extras.append({'key': key[-1], 'value': data[key]})
 
+def _extras_index(data, context):
+    '''Returns {extra key: data key of its value} for the flattened data.
+    It is worked out once per validation pass and kept in the context,
+    rather than scanning the data for each extras field.'''
+    index_data, index = context.get('_extras_index', (None, None))
+    if index_data is not data:
+        index = {}
+        for data_key, data_value in data.iteritems():
+            if (data_key[0] == 'extras'
+                and data_key[-1] == 'key'):
+                index[data_value] = ('extras', data_key[1], 'value')
+        context['_extras_index'] = (data, index)
+    return index
+
 def convert_from_extras(key, data, errors, context):
 
-    for data_key, data_value in data.iteritems():
-        if (data_key[0] == 'extras' 
-            and data_key[-1] == 'key'
-            and data_value == key[-1]):
-            data[key] = data[('extras', data_key[1], 'value')]
+    value_key = _extras_index(data, context).get(key[-1])
+    if value_key is not None:
+        data[key] = data[value_key]
 
 def use_other(key, data, errors, context):
 
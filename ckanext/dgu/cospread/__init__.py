@@ -2,6 +2,7 @@ from ckanext.importlib.api_command import ApiCommand
 from ckanext.dgu.bin.xmlrpc_command import XmlRpcCommand
 from ckanext.dgu.cospread.cospread import CospreadImporter
 from ckanext.dgu.cospread.loader import CospreadLoader
+from ckanext.dgu.schema import ORGANISATION_CACHE_DEFAULT_PATH
 from ckanclient import CkanClient
 
 class CospreadCommand(ApiCommand, XmlRpcCommand):
@@ -19,6 +20,15 @@ class CospreadCommand(ApiCommand, XmlRpcCommand):
                                action="store_true",
                                default=False,
                                help="Generate names from title. Also key multiple resources off the package title.")
+        self.parser.add_option("--org-cache",
+                               dest="org_cache_filepath",
+                               default=ORGANISATION_CACHE_DEFAULT_PATH,
+                               help="File to keep organisation lookups in between runs (default: %default)")
+        self.parser.add_option("--refresh-org-cache",
+                               dest="refresh_org_cache",
+                               action="store_true",
+                               default=False,
+                               help="Look up all organisations in Drupal again, rather than using the cached ones")
 
     def command(self):
         super(CospreadCommand, self).command()
@@ -32,6 +42,8 @@ class CospreadCommand(ApiCommand, XmlRpcCommand):
             xmlrpc_settings=self.xmlrpc_settings,
             include_given_tags=self.options.include_given_tags,
             generate_names=self.options.generate_names,
+            organisation_cache_filepath=self.options.org_cache_filepath,
+            refresh_organisation_cache=self.options.refresh_org_cache,
             )
         
         loader = CospreadLoader(self.client)
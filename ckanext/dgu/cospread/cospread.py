@@ -232,11 +232,33 @@ class CospreadImporter(SpreadsheetPackageImporter):
     
     def __init__(self, include_given_tags=False, xmlrpc_settings=None,
                  generate_names=False,
+                 organisation_cache_filepath=None,
+                 refresh_organisation_cache=False,
                  **kwargs):
         self.include_given_tags = include_given_tags
-        self._drupal_helper = schema.DrupalHelper(xmlrpc_settings)
+        self._drupal_helper = schema.DrupalHelper(
+            xmlrpc_settings,
+            organisation_cache_filepath=organisation_cache_filepath,
+            refresh_organisation_cache=refresh_organisation_cache)
         super(CospreadImporter, self).__init__(record_params=[generate_names], record_class=CospreadDataRecords, **kwargs)
 
+    def pkg_dict(self):
+        self._warm_organisation_cache()
+        return super(CospreadImporter, self).pkg_dict()
+
+    def _warm_organisation_cache(self):
+        '''Looks up in Drupal all the organisations the records refer to,
+        in one go, rather than one by one as each record is imported.'''
+        org_names = set()
+        for row_dict in self._package_data_records.records:
+            for column in ('Published by', 'Published via',
+                           'Department', 'Agency responsible'):
+                org_name = row_dict.get(column)
+                if org_name and isinstance(org_name, basestring):
+                    org_names.add(org_name)
+                    org_names.add(schema.canonise_organisation_name(org_name.strip()))
+        self._drupal_helper.warm_organisation_cache(org_names)
+
     @classmethod
     def log(self, msg):
         super(CospreadImporter, self).log(msg)
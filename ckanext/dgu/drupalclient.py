@@ -1,6 +1,10 @@
 import logging
 import socket
-from xmlrpclib import ServerProxy, Fault, ProtocolError
+import time
+import threading
+import httplib
+from multiprocessing.pool import ThreadPool
+from xmlrpclib import ServerProxy, Transport, MultiCall, Fault, ProtocolError
 
 log = logging.getLogger(__name__)
 
@@ -8,12 +12,147 @@ class DrupalXmlRpcSetupError(Exception): pass
 class DrupalRequestError(Exception): pass
 class DrupalKeyError(Exception): pass
 
+class TimeoutHTTPConnection(httplib.HTTPConnection):
+    '''HTTPConnection with separate timeouts for connecting and for
+    reading the response.'''
+    def __init__(self, host, connect_timeout=None, read_timeout=None):
+        httplib.HTTPConnection.__init__(self, host, timeout=connect_timeout)
+        self.read_timeout = read_timeout
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.settimeout(self.read_timeout)
+
+class PooledTransport(Transport):
+    '''XML-RPC transport that keeps HTTP/1.1 connections open between
+    calls, in a pool per host, so that each call does not have to set up
+    a new TCP connection. It is thread-safe, so can be shared.
+
+    Calls that fail due to a connection problem are retried (up to
+    'retries' times), with the wait doubling each time.
+    '''
+    verbose = 0 # read by parse_response
+
+    def __init__(self, connect_timeout=5, read_timeout=60, retries=2,
+                 backoff=0.5, max_pool_size=10, use_datetime=0):
+        Transport.__init__(self, use_datetime)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pool_size = max_pool_size
+        self._pool = {} # {host: [connection, ...]}
+        self._pool_lock = threading.Lock()
+
+    def request(self, host, handler, request_body, verbose=0):
+        for attempt in range(self.retries + 1):
+            try:
+                return self.single_request(host, handler, request_body, verbose)
+            except (socket.error, httplib.HTTPException), e:
+                if attempt >= self.retries:
+                    raise
+                # retry straight away the first time, since it is often
+                # just that the server closed an idle kept-alive connection
+                wait = self.backoff * 2 ** (attempt - 1) if attempt else 0
+                log.warn('XMLRPC request to %s failed (%r) - retrying in %ss',
+                         handler, e, wait)
+                time.sleep(wait)
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        chost, extra_headers, x509 = self.get_host_info(host)
+        connection = self._get_connection(chost)
+        if verbose:
+            connection.set_debuglevel(1)
+        try:
+            self.send_request(connection, handler, request_body)
+            for key, value in extra_headers or []:
+                connection.putheader(key, value)
+            self.send_user_agent(connection)
+            self.send_content(connection, request_body)
+            response = connection.getresponse(buffering=True)
+            if response.status == 200:
+                result = self.parse_response(response)
+                self._release_connection(chost, connection)
+                return result
+        except Fault:
+            # the response has been read, so the connection can be reused
+            self._release_connection(chost, connection)
+            raise
+        except Exception:
+            connection.close()
+            raise
+
+        response.read()
+        self._release_connection(chost, connection)
+        raise ProtocolError(host + handler,
+                            response.status, response.reason,
+                            response.msg)
+
+    def _get_connection(self, host):
+        with self._pool_lock:
+            connections = self._pool.get(host)
+            if connections:
+                return connections.pop()
+        return TimeoutHTTPConnection(host,
+                                     connect_timeout=self.connect_timeout,
+                                     read_timeout=self.read_timeout)
+
+    def _release_connection(self, host, connection):
+        with self._pool_lock:
+            connections = self._pool.setdefault(host, [])
+            if len(connections) < self.max_pool_size:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._pool_lock:
+            pool = self._pool
+            self._pool = {}
+        for connections in pool.values():
+            for connection in connections:
+                connection.close()
+
 class DrupalClient(object):
-    def __init__(self, xmlrpc_settings=None):
+    _shared_transport = None
+    _shared_transport_lock = threading.Lock()
+
+    # maximum number of calls sent in one system.multicall request
+    multicall_batch_size = 100
+    # number of calls made at once when Drupal does not support multicall
+    max_concurrent_calls = 4
+
+    def __init__(self, xmlrpc_settings=None, transport=None):
         '''If you do not supply xmlrpc settings then it looks them
-        up in the pylons config.'''
+        up in the pylons config.
+
+        By default, all DrupalClients share a pool of keep-alive
+        connections - see get_shared_transport.'''
         self.xmlrpc_url = DrupalClient.get_xmlrpc_url(xmlrpc_settings)
-        self.drupal = ServerProxy(self.xmlrpc_url)
+        if transport is None and self.xmlrpc_url.startswith('http://'):
+            transport = DrupalClient.get_shared_transport()
+        self.transport = transport
+        self.drupal = ServerProxy(self.xmlrpc_url, transport=transport)
+        self._multicall_supported = None # i.e. not tried yet
+
+    @classmethod
+    def get_shared_transport(cls):
+        '''Returns the PooledTransport shared by all DrupalClients.
+        Its timeouts (seconds) and retries can be set in the pylons
+        config: dgu.xmlrpc_connect_timeout, dgu.xmlrpc_read_timeout
+        and dgu.xmlrpc_retries.'''
+        with cls._shared_transport_lock:
+            if cls._shared_transport is None:
+                try:
+                    from pylons import config
+                except ImportError:
+                    config = {}
+                cls._shared_transport = PooledTransport(
+                    connect_timeout=float(config.get('dgu.xmlrpc_connect_timeout', 5)),
+                    read_timeout=float(config.get('dgu.xmlrpc_read_timeout', 60)),
+                    retries=int(config.get('dgu.xmlrpc_retries', 2)),
+                    )
+            return cls._shared_transport
 
     @staticmethod
     def get_xmlrpc_url(xmlrpc_settings=None):
@@ -72,7 +211,10 @@ class DrupalClient(object):
         except socket.error, e:
             raise DrupalRequestError('Socket error with url \'%s\': %r' % (self.xmlrpc_url, e))
         except Fault, e:
-            raise DrupalRequestError('Drupal returned error for session_id %r: %r' % (session_id, e))
+            if e.faultCode == 404:
+                raise DrupalKeyError(session_id)
+            else:
+                raise DrupalRequestError('Drupal returned error for session_id %r: %r' % (session_id, e))
         except ProtocolError, e:
             raise DrupalRequestError('Drupal returned protocol error for session_id %r: %r' % (session_id, e))
         log.info('Obtained Drupal session for session ID %r: %r', session_id, session)
@@ -135,3 +277,82 @@ class DrupalClient(object):
                 raise DrupalRequestError('Drupal returned protocol error for organisation_name %r: %r' % (organisation_name, e))
         log.info('Obtained organisation id %r from name %r', organisation_id, organisation_name)
         return organisation_id
+
+    def match_organisations(self, organisation_names):
+        '''Batch version of match_organisation, making as few requests
+        as possible.
+        @return dict {organisation_name: organisation_id}, with the id
+                being None if there is no match.'''
+        organisation_names = list(set(organisation_names))
+        organisation_ids = self._batch_call(
+            'organisation.match', organisation_names,
+            lambda name: (name or u'',), self.match_organisation)
+        return dict(zip(organisation_names, organisation_ids))
+
+    def get_organisation_names(self, ids):
+        '''Batch version of get_organisation_name, making as few requests
+        as possible.
+        @return dict {id: organisation_name}, with the name being None if
+                there is no such organisation.'''
+        ids = list(set(ids))
+        organisation_names = self._batch_call(
+            'organisation.one', ids,
+            lambda id: (str(id),), self.get_organisation_name)
+        return dict(zip(ids, organisation_names))
+
+    def _batch_call(self, method_name, items, item_to_params, single_call):
+        '''Calls the XMLRPC method for each of the items, using
+        system.multicall if Drupal supports it, otherwise by calling
+        single_call for the items concurrently. Results for items that
+        Drupal cannot find (404) are None.'''
+        if not items:
+            return []
+        if self._multicall_supported is not False:
+            try:
+                results = []
+                for i in range(0, len(items), self.multicall_batch_size):
+                    batch = items[i:i + self.multicall_batch_size]
+                    results.extend(self._multicall(method_name,
+                                                   [item_to_params(item) for item in batch]))
+            except (Fault, ProtocolError), e:
+                log.info('Drupal does not support system.multicall (%r) - '
+                         'making the calls individually', e)
+                self._multicall_supported = False
+            except socket.error, e:
+                raise DrupalRequestError('Socket error with url \'%s\': %r' % (self.xmlrpc_url, e))
+            else:
+                self._multicall_supported = True
+                log.info('Obtained %i results for %s with multicall',
+                         len(results), method_name)
+                return results
+
+        def call(item):
+            try:
+                return single_call(item)
+            except DrupalKeyError:
+                return None
+        if not isinstance(self.transport, PooledTransport):
+            # other transports cannot be shared between threads
+            return [call(item) for item in items]
+        pool = ThreadPool(min(self.max_concurrent_calls, len(items)))
+        try:
+            return pool.map(call, items)
+        finally:
+            pool.close()
+
+    def _multicall(self, method_name, params_list):
+        multicall = MultiCall(self.drupal)
+        for params in params_list:
+            getattr(multicall, method_name)(*params)
+        results = []
+        for params, result in zip(params_list, multicall().results):
+            # each result is either a list containing the value, or a
+            # fault dict
+            if isinstance(result, dict):
+                if result.get('faultCode') == 404:
+                    results.append(None)
+                else:
+                    raise DrupalRequestError('Drupal returned error for %s%r: %r' % (method_name, params, result))
+            else:
+                results.append(result[0])
+        return results
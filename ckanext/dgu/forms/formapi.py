@@ -1,8 +1,12 @@
 import logging
 import sys
 import traceback
+import hashlib
+import datetime
 
 from pylons import config
+from sqlalchemy import func, and_
+from sqlalchemy.orm import class_mapper
 
 from ckan.lib.base import *
 from ckan.lib.helpers import json
@@ -14,8 +18,10 @@ from ckan.controllers.api import ApiController, CONTENT_TYPES
 from ckanext.dgu.forms import harvest_source as harvest_source_form
 from ckanext.dgu.drupalclient import DrupalClient, DrupalXmlRpcSetupError, \
      DrupalRequestError
+from ckanext.dgu.cache import cache_from_config, CACHE_MISS
+from ckanext.dgu.harvest_queue import queue_from_config
 
-from ckanext.harvest.model import HarvestSource
+from ckanext.harvest.model import HarvestSource, HarvestJob
 from ckanext.harvest.lib import get_harvest_sources, get_harvest_source, \
                                 create_harvest_source, edit_harvest_source, \
                                 remove_harvest_source,create_harvest_job
@@ -27,12 +33,36 @@ from genshi.filters import Transformer
 log = logging.getLogger(__name__)
 
 
+def domain_object_as_dict(obj):
+    '''Returns the columns of a mapped object as a dict, with dates in
+    ISO format, for serializing as JSON.'''
+    obj_dict = {}
+    for column in class_mapper(obj.__class__).mapped_table.c:
+        value = getattr(obj, column.name)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        obj_dict[column.name] = value
+    return obj_dict
+
 class ApiError(Exception):
     def __init__(self, status_int, msg):
         super(ApiError, self).__init__(msg)
         self.msg = msg
         self.status_int = status_int
 
+def etag_matches(etag, if_none_match):
+    '''Returns whether an If-None-Match header value matches the (unquoted)
+    etag.'''
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag.strip('"') == etag:
+            return True
+    return False
+
 class FormController(ApiController):
     """Implements the CKAN Forms API."""
 
@@ -40,6 +70,13 @@ class FormController(ApiController):
     _ref_package = "name"
     error_content_type = 'json'
     authorizer = ckan.authz.Authorizer()
+    # maximum number of packages in a package_batch request
+    max_batch_size = 100
+    # harvest_source_list is paged if any of these params are given
+    harvest_source_list_params = ('limit', 'offset', 'publisher_id',
+                                  'active', 'embed')
+    harvest_source_list_limit = 100
+    max_harvest_source_list_limit = 1000
 
     @classmethod
     def _abort_bad_request(cls, msg=None):
@@ -78,14 +115,40 @@ class FormController(ApiController):
         return cls._drupal_client_cache
 
     @classmethod
-    def _get_package_fieldset(cls):
+    def _user_properties_cache(cls):
+        # Drupal calls the form API to render a form and then again to
+        # save it, so the user's properties are cached for a short time.
+        # Configured with dgu.user_properties_cache.* options - see
+        # cache_from_config
+        if not hasattr(cls, '_user_properties_cache_'):
+            cls._user_properties_cache_ = cache_from_config(
+                config, 'dgu.user_properties_cache', default_ttl=60)
+        return cls._user_properties_cache_
+
+    @classmethod
+    def _get_user_properties(cls, user_id):
+        '''Returns the Drupal user's name and publishers.'''
+        cache = cls._user_properties_cache()
+        user = CACHE_MISS
+        if cache is not None:
+            user = cache.get(str(user_id))
+        if user is CACHE_MISS:
+            res = cls._drupal_client().get_user_properties(user_id)
+            user = {'name': res['name'],
+                    'publishers': res['publishers']}
+            if cache is not None:
+                cache.set(str(user_id), user)
+        return user
+
+    @classmethod
+    def _get_package_fieldset_params(cls):
         # Get user properties for the fieldset creation
         try:
             user_id = request.params['user_id']
         except KeyError, e:
             cls._abort_bad_request('Please supply a user_id parameter in the request parameters.')
         try:
-            user = cls._drupal_client().get_user_properties(user_id)
+            user = cls._get_user_properties(user_id)
         except DrupalRequestError, e:
             raise DrupalRequestError('Cannot get user properties (for publishers in the form): %s' % e)
         else:
@@ -95,8 +158,86 @@ class FormController(ApiController):
                 # restrict national_statistic field - only for edit on ckan
                 'restrict': True,
                 }
+        return fieldset_params
+
+    @classmethod
+    def _get_package_fieldset(cls, fieldset_params=None):
+        if fieldset_params is None:
+            fieldset_params = cls._get_package_fieldset_params()
         return super(ApiController, cls)._get_package_fieldset(**fieldset_params)
 
+    @classmethod
+    def _fieldset_html_cache(cls):
+        # Rendered forms are the same for all users with the same
+        # publishers, so are cached. Configured with
+        # dgu.fieldset_html_cache.* options - see cache_from_config
+        if not hasattr(cls, '_fieldset_html_cache_'):
+            cls._fieldset_html_cache_ = cache_from_config(
+                config, 'dgu.fieldset_html_cache', default_ttl=3600,
+                default_max_size=500)
+        return cls._fieldset_html_cache_
+
+    @classmethod
+    def _package_form_cache_key(cls, fieldset_params, pkg=None):
+        '''Returns a key for a rendered package form, made from everything
+        the form depends on.'''
+        # The base controller adds the request params and the groups the
+        # API user can edit to the fieldset params.
+        params = sorted((key, value) for key, value in request.params.items()
+                        if key != 'user_id')
+        groups = sorted(group.id for group in cls._get_user_editable_groups())
+        key = ['package', fieldset_params['restrict'], params, groups,
+               sorted((fieldset_params['publishers'] or {}).items()),
+               model.Package.get_license_options()]
+        if pkg is not None:
+            key += [pkg.id, pkg.metadata_modified,
+                    sorted(group.id for group in pkg.groups)]
+        return hashlib.md5(repr(key)).hexdigest()
+
+    def _finish_fieldset_html(self, cache_key, render):
+        '''Returns the rendered form for a GET request. The HTML is cached,
+        and if the client already has it (If-None-Match matches the ETag)
+        then 304 Not Modified is returned instead.
+
+        @param render - function that renders the form HTML
+        '''
+        cache = self._fieldset_html_cache()
+        cached = CACHE_MISS
+        if cache is not None:
+            cached = cache.get(cache_key)
+        if cached is CACHE_MISS:
+            fieldset_html = render()
+            etag = hashlib.md5(unicode(fieldset_html).encode('utf8')).hexdigest()
+            cached = (etag, unicode(fieldset_html))
+            if cache is not None:
+                cache.set(cache_key, cached)
+        etag, fieldset_html = cached
+        response.headers['ETag'] = '"%s"' % etag
+        if etag_matches(etag, request.headers.get('If-None-Match')):
+            return self._finish(304)
+        return self._finish_ok(fieldset_html, content_type='html')
+
+    @classmethod
+    def _harvest_job_queue(cls):
+        # If configured, harvest jobs are created by a worker process,
+        # rather than during the request - see ckanext.dgu.harvest_queue
+        if not hasattr(cls, '_harvest_job_queue_'):
+            cls._harvest_job_queue_ = queue_from_config(config)
+        return cls._harvest_job_queue_
+
+    @classmethod
+    def _make_harvesting_job_location(cls, request_id):
+        return '/api/2/rest/harvestingjob/%s' % request_id
+
+    @classmethod
+    def _queue_harvest_job(cls, queue, source_id):
+        '''Queues a request for the worker to create a harvest job.
+        @return the request id, its status and the location to poll it at'''
+        request_id = queue.put(source_id)
+        return {'id': request_id,
+                'status': 'queued',
+                'location': cls._make_harvesting_job_location(request_id)}
+
     @classmethod
     def _ref_harvest_source(cls, harvest_source):
         return harvest_source['id']
@@ -111,12 +252,14 @@ class FormController(ApiController):
             if not am_authz:
                 self._abort_not_authorized('User %r not authorized to create packages' % user.name)
 
-            # Get the fieldset.
-            fieldset = self._get_package_fieldset()
+            fieldset_params = self._get_package_fieldset_params()
             if request.method == 'GET':
                 # Render the fields.
-                fieldset_html = fieldset.render()
-                return self._finish_ok(fieldset_html, content_type='html')
+                cache_key = self._package_form_cache_key(fieldset_params)
+                return self._finish_fieldset_html(cache_key,
+                    lambda: self._get_package_fieldset(fieldset_params).render())
+            # Get the fieldset.
+            fieldset = self._get_package_fieldset(fieldset_params)
             if request.method == 'POST':
                 # Read request.
                 try:
@@ -218,14 +361,14 @@ class FormController(ApiController):
             if not am_authz:
                 self._abort_not_authorized('User %r not authorized to edit %r' % (user.name, pkg.name))
 
-            # Get the fieldset.
-            fieldset = self._get_package_fieldset()
+            fieldset_params = self._get_package_fieldset_params()
             if request.method == 'GET':
-                # Bind entity to fieldset.
-                bound_fieldset = fieldset.bind(pkg)
-                # Render the fields.
-                fieldset_html = bound_fieldset.render()
-                return self._finish_ok(fieldset_html, content_type='html')
+                # Bind entity to fieldset and render the fields.
+                cache_key = self._package_form_cache_key(fieldset_params, pkg)
+                return self._finish_fieldset_html(cache_key,
+                    lambda: self._get_package_fieldset(fieldset_params).bind(pkg).render())
+            # Get the fieldset.
+            fieldset = self._get_package_fieldset(fieldset_params)
             if request.method == 'POST':
                 # Read request.
                 try:
@@ -283,6 +426,161 @@ class FormController(ApiController):
             log.error('Package edit - unhandled exception: exception=%r', traceback.format_exc())
             raise
 
+    def package_batch(self):
+        '''Creates and edits several packages in one request. The request
+        data is like that for package_create, but with a list of 'items'
+        instead of 'form_data'. An item with a package 'id' edits that
+        package, otherwise a package is created:
+
+            {'items': [{'form_data': {...}},
+                       {'id': 'pkg-name', 'form_data': {...}}],
+             'log_message': '...', 'author': '...'}
+
+        Nothing is saved unless all the items are valid. Then they are
+        all saved in one revision. The response has a result for each item,
+        in order, with the status code it would have had on its own, or 424
+        if it was valid but not saved because of the other items.
+        '''
+        try:
+            # Check user authorization.
+            user = self._get_required_authorization_credentials()
+            # Read request.
+            try:
+                request_data = self._get_request_data()
+            except ValueError, error:
+                self._abort_bad_request('Extracting request data: %r' % error.args)
+            items = request_data.get('items')
+            if not isinstance(items, list) or not items:
+                self._abort_bad_request('Missing \'items\' in request data.')
+            if len(items) > self.max_batch_size:
+                self._abort_bad_request('Too many items - the maximum is %i' % self.max_batch_size)
+            log_message = request_data.get('log_message', 'Form API')
+            author = request_data.get('author', '') or user.name
+
+            # Get the fieldset, once for all the items.
+            fieldset = self._get_package_fieldset()
+            can_create = None
+            results = []
+            bound_fieldsets = []
+            for item in items:
+                result, bound_fieldset = self._bind_batch_item(item, fieldset, user)
+                if bound_fieldset is not None and result['status'] == 201:
+                    if can_create is None:
+                        can_create = self.authorizer.is_authorized(user.name, model.Action.PACKAGE_CREATE, model.System())
+                    if not can_create:
+                        result = {'status': 403, 'error': 'User %r not authorized to create packages' % user.name}
+                        bound_fieldset = None
+                if bound_fieldset is not None and not bound_fieldset.validate():
+                    result = {'status': 400, 'errors': self._fieldset_errors(bound_fieldset)}
+                    bound_fieldset = None
+                results.append(result)
+                bound_fieldsets.append(bound_fieldset)
+            self._check_batch_duplicates(results, bound_fieldsets)
+            if None in bound_fieldsets:
+                model.Session.rollback()
+                for result, bound_fieldset in zip(results, bound_fieldsets):
+                    if bound_fieldset is not None:
+                        result.update(status=424, error='Not saved because other items failed')
+                log.info('Package batch - not all items are valid. user=%r author=%r results=%r', user.name, author, results)
+                return self._finish(400, {'results': results}, content_type='json')
+
+            # Save them all in one revision.
+            try:
+                rev = model.repo.new_revision()
+                rev.author = author
+                rev.message = log_message
+                for bound_fieldset in bound_fieldsets:
+                    bound_fieldset.sync()
+                model.Session.commit()
+            except Exception:
+                model.Session.rollback()
+                raise
+            for result, bound_fieldset in zip(results, bound_fieldsets):
+                package = bound_fieldset.model
+                if result['status'] == 201:
+                    result['location'] = self._make_package_201_location(package)
+                result['id'] = package.id
+                result['name'] = package.name
+            for result in results:
+                if result['status'] == 201:
+                    # the session is removed after each package's roles
+                    # are set up, so get it again
+                    self._create_permissions(model.Package.get(result['id']), user)
+            log.info('Package batch successful. user=%r author=%r results=%r', user.name, author, results)
+            return self._finish_ok({'results': results})
+        except DrupalRequestError, e:
+            log.error('Package batch - DrupalRequestError: exception=%r', traceback.format_exc())
+            raise
+        except ApiError, api_error:
+            log.info('Package batch - ApiError. user=%r error=%r',
+                     user.name if 'user' in dir() else None, api_error)
+            return self._finish(api_error.status_int, str(api_error.msg),
+                                content_type=self.error_content_type)
+        except Exception:
+            # Log error.
+            log.error('Package batch - unhandled exception: exception=%r', traceback.format_exc())
+            raise
+
+    def _bind_batch_item(self, item, fieldset, user):
+        '''Binds the form data of a package_batch item to the fieldset.
+        @return (result, bound_fieldset) - bound_fieldset is None if the
+                item cannot be saved, and result says why
+        '''
+        if not isinstance(item, dict) or not isinstance(item.get('form_data'), (dict, list)):
+            return {'status': 400, 'error': 'Missing \'form_data\' in item.'}, None
+        form_data = item['form_data']
+        package_ref = item.get('id')
+        try:
+            if package_ref:
+                pkg = self._get_pkg(package_ref)
+                if pkg is None:
+                    return {'status': 404, 'error': 'Not found'}, None
+                if not self.authorizer.is_authorized(user.name, model.Action.EDIT, pkg):
+                    return {'status': 403, 'error': 'User %r not authorized to edit %r' % (user.name, pkg.name)}, None
+                return {'status': 200}, fieldset.bind(pkg, data=form_data)
+            return {'status': 201}, fieldset.bind(model.Package, data=form_data, session=model.Session)
+        except Exception, error:
+            log.error('Package batch - problem binding data. data=%r error=%r', form_data, error)
+            return {'status': 400, 'error': 'Form data incomplete'}, None
+
+    @classmethod
+    def _check_batch_duplicates(cls, results, bound_fieldsets):
+        '''The validators only check against the database, so this fails the
+        valid items of a package_batch that edit the same package (the later
+        one would overwrite the earlier) or that would give packages the same
+        name.'''
+        checks = (
+            # (error field, value to compare, error message)
+            ('id',
+             lambda index: bound_fieldsets[index].model.id \
+                 if results[index]['status'] == 200 else None,
+             u'Package %s is edited by more than one item in the batch'),
+            ('name',
+             lambda index: bound_fieldsets[index].name.value,
+             u'Package name %s is given to more than one item in the batch'),
+            )
+        for field, get_value, message in checks:
+            items_by_value = {}
+            for index, bound_fieldset in enumerate(bound_fieldsets):
+                if bound_fieldset is not None:
+                    value = get_value(index)
+                    if value is not None:
+                        items_by_value.setdefault(value, []).append(index)
+            for value, indexes in items_by_value.items():
+                if len(indexes) > 1:
+                    for index in indexes:
+                        results[index] = {'status': 400, 'errors': {field: [message % value]}}
+                        bound_fieldsets[index] = None
+
+    @classmethod
+    def _fieldset_errors(cls, bound_fieldset):
+        '''Returns the validation errors of a fieldset as a dict
+        {field name: [error, ...]}.'''
+        errors = {}
+        for field, field_errors in bound_fieldset.errors.items():
+            errors[getattr(field, 'name', None) or ''] = [unicode(error) for error in field_errors]
+        return errors
+
     @classmethod
     def _create_harvest_source_entity(cls, bound_fieldset, user_id=None, publisher_id=None):
         bound_fieldset.validate()
@@ -315,12 +613,44 @@ class FormController(ApiController):
             am_authz = self.authorizer.is_sysadmin(user.name) # simple for now
             if not am_authz:
                 self._abort_not_authorized('User %r not authorized for harvesting' % user.name)
-            if id == None: 
-                objects = get_harvest_sources()
+            if not set(request.params) & set(self.harvest_source_list_params):
+                # Original listing of all the ids
+                if id == None: 
+                    objects = get_harvest_sources()
+                else:
+                    objects = get_harvest_sources(publisher_id=id, active=True)
+                response_data = [o['id'] for o in objects]
+                return self._finish_ok(response_data)
+
+            # Paged listing
+            try:
+                limit = int(request.params.get('limit', self.harvest_source_list_limit))
+                offset = int(request.params.get('offset', 0))
+            except ValueError:
+                self._abort_bad_request('limit and offset must be integers')
+            if limit < 0 or offset < 0:
+                self._abort_bad_request('limit and offset must not be negative')
+            limit = min(limit, self.max_harvest_source_list_limit)
+            publisher_id = request.params.get('publisher_id', id)
+            active = request.params.get('active', 'true' if id else None)
+            if active is not None:
+                active = active.lower() not in ('0', 'no', 'false')
+            embed = request.params.get('embed', '').lower() in ('1', 'yes', 'true')
+            count, sources = self._query_harvest_sources(publisher_id, active, limit, offset)
+            if embed:
+                last_jobs = self._last_harvest_jobs([source.id for source in sources])
+                results = []
+                for source in sources:
+                    # built from the rows already loaded, rather than with
+                    # get_harvest_source, which queries each source's jobs
+                    source_dict = domain_object_as_dict(source)
+                    last_job = last_jobs.get(source.id)
+                    source_dict['last_job'] = domain_object_as_dict(last_job) if last_job else None
+                    results.append(source_dict)
             else:
-                objects = get_harvest_sources(publisher_id=id, active=True)
-            response_data = [o['id'] for o in objects]
-            return self._finish_ok(response_data)
+                results = [source.id for source in sources]
+            return self._finish_ok({'count': count, 'limit': limit,
+                                    'offset': offset, 'results': results})
         except ApiError, api_error:
             return self._finish(api_error.status_int, str(api_error.msg))
         except Exception:
@@ -328,6 +658,36 @@ class FormController(ApiController):
             log.error("Couldn't run list harvest source form method: %s" % traceback.format_exc())
             raise
 
+    @classmethod
+    def _query_harvest_sources(cls, publisher_id=None, active=None,
+                               limit=100, offset=0):
+        '''Returns the number of harvest sources matching the filters and
+        a page of them, oldest first.'''
+        query = model.Session.query(HarvestSource)
+        if publisher_id is not None:
+            query = query.filter(HarvestSource.publisher_id==publisher_id)
+        if active is not None:
+            query = query.filter(HarvestSource.active==active)
+        count = query.count()
+        sources = query.order_by(HarvestSource.created, HarvestSource.id) \
+                       .offset(offset).limit(limit).all()
+        return count, sources
+
+    @classmethod
+    def _last_harvest_jobs(cls, source_ids):
+        '''Returns the latest job for each of the harvest sources, in one
+        query, as a dict {source_id: job}.'''
+        if not source_ids:
+            return {}
+        latest = model.Session.query(HarvestJob.source_id,
+                                     func.max(HarvestJob.created).label('created')) \
+                 .filter(HarvestJob.source_id.in_(source_ids)) \
+                 .group_by(HarvestJob.source_id).subquery()
+        jobs = model.Session.query(HarvestJob) \
+               .join((latest, and_(HarvestJob.source_id==latest.c.source_id,
+                                   HarvestJob.created==latest.c.created)))
+        return dict((job.source_id, job) for job in jobs)
+
     def harvest_source_view(self, id):
         try:
             # Check user authorization.
@@ -362,8 +722,8 @@ class FormController(ApiController):
             fieldset = harvest_source_form.get_harvest_source_fieldset()
             if request.method == 'GET':
                 # Render the fields.
-                fieldset_html = fieldset.render()
-                return self._finish_ok(fieldset_html, content_type='html')
+                return self._finish_fieldset_html('harvest_source',
+                                                  fieldset.render)
             if request.method == 'POST':
                 # Read request.
                 try:
@@ -405,11 +765,18 @@ class FormController(ApiController):
                     return self._finish(400, str(e)) 
                 else:
                     # Also create a job
-                    job = create_harvest_job(source['id'])
+                    response_data = None
+                    queue = self._harvest_job_queue()
+                    if queue is not None:
+                        # Say where to poll for the job being created
+                        response_data = {'harvesting_job': \
+                            self._queue_harvest_job(queue, source['id'])}
+                    else:
+                        job = create_harvest_job(source['id'])
 
                     # Set the response's Location header.
                     location = self._make_harvest_source_201_location(source)
-                    return self._finish_ok(\
+                    return self._finish_ok(response_data,
                         resource_location=location)
         except ApiError, api_error:
             return self._finish(api_error.status_int, str(api_error.msg))
@@ -436,6 +803,18 @@ class FormController(ApiController):
             except KeyError, error:
                 self._abort_bad_request()
 
+            queue = self._harvest_job_queue()
+            if queue is not None:
+                # The job is created by the worker, so check the source
+                # exists now, as create_harvest_job would
+                if self._get_harvest_source(source_id) is None:
+                    response.status_int = 400
+                    response.headers['Content-Type'] = CONTENT_TYPES['json']
+                    return json.dumps('Harvest source %s does not exist' % source_id)
+                job_request = self._queue_harvest_job(queue, source_id)
+                response.headers['Location'] = job_request['location']
+                return self._finish(202, job_request, content_type='json')
+
             err_msg = None
             try:
                 job = create_harvest_job(source_id)
@@ -456,6 +835,27 @@ class FormController(ApiController):
             log.error("Couldn't run create harvesting job form method: %s" % traceback.format_exc())
             raise
 
+    def harvesting_job_view(self, id):
+        '''Returns the status of a queued request to create a harvest job:
+        queued, running, done (with the job_id) or error.'''
+        try:
+            # Check user authorization.
+            user = self._get_required_authorization_credentials()
+            am_authz = self.authorizer.is_sysadmin(user.name) # simple for now
+            if not am_authz:
+                self._abort_not_authorized('User %r not authorized for harvesting' % user.name)
+
+            queue = self._harvest_job_queue()
+            job_request = queue.get(id) if queue is not None else None
+            self._assert_is_found(job_request)
+            return self._finish_ok(job_request)
+        except ApiError, api_error:
+            return self._finish(api_error.status_int, str(api_error.msg))
+        except Exception:
+            # Log error.
+            log.error("Couldn't run view harvesting job method: %s" % traceback.format_exc())
+            raise
+
     def harvest_source_delete(self, id):
         try:
             model.repo.new_revision()
@@ -15,6 +15,15 @@ from ckan.lib.helpers import literal
 
 from ckanext.dgu import schema as schema
 from ckanext.dgu.forms import package_gov_fields
+from ckanext.dgu.cache import MemoryCache, CACHE_MISS
+
+# Built fieldsets and option lists are cached in the process, because
+# building the form is slow and it is the same for all users with the
+# same publishers. Publishers are part of the cache keys, and a change in
+# the licences clears the caches (see _check_license_options).
+fieldset_cache = MemoryCache(ttl=3600, max_size=100)
+publisher_options_cache = MemoryCache(ttl=3600, max_size=100)
+_license_options = []
 
 # Setup the fieldset
 def build_package_gov_form_v3(is_admin=False, user_editable_groups=None,
@@ -48,9 +57,7 @@ def build_package_gov_form_v3(is_admin=False, user_editable_groups=None,
     builder.add_field(common.TextExtraField('mandate'))
     #builder.add_field(common.SuggestedTextExtraField('department', options=schema.government_depts))
     #builder.add_field(common.TextExtraField('agency'))
-    # options are iterators of: (label, value)
-    publisher_options = [(str(label), "%s [%s]" % (label, value)) for value, label in (publishers or {}).items()]
-    publisher_options.sort()
+    publisher_options = get_publisher_options(publishers)
     builder.add_field(package_gov_fields.PublisherField('published_by', options=publisher_options))
     builder.add_field(package_gov_fields.PublisherField('published_via', options=publisher_options))
     builder.add_field(common.CoreField('license_id', value='uk-ogl'))
@@ -84,7 +91,7 @@ def build_package_gov_form_v3(is_admin=False, user_editable_groups=None,
     builder.set_field_text('tags', instructions='Tags can be thought of as the way that the packages are categorised, so are of primary importance.', further_instructions=literal('One or more tags should be added to give the government department and geographic location the data covers, as well as general descriptive words. The <a href="http://www.esd.org.uk/standards/ipsv_abridged/" target="_blank">Integrated Public Sector Vocabulary</a> may be helpful in forming these.'), hints='Format: Two or more lowercase alphanumeric or dash (-) characters; different tags separated by spaces. As tags cannot contain spaces, use dashes instead. e.g. for a dataset containing statistics on burns to the arms in the UK in 2009: nhs uk arm burns medical-statistics')
     # Options/settings
     builder.set_field_option('name', 'validate', package_name_validator)
-    builder.set_field_option('license_id', 'dropdown', {'options':[('', None)] + model.Package.get_license_options()})
+    builder.set_field_option('license_id', 'dropdown', {'options':[('', None)] + get_license_options()})
     builder.set_field_option('state', 'dropdown', {'options':model.State.all})
     builder.set_field_option('notes', 'textarea', {'size':'60x15'})
     builder.set_field_option('title', 'required')
@@ -124,11 +131,70 @@ def build_package_gov_form_v3(is_admin=False, user_editable_groups=None,
 
 def get_gov3_fieldset(is_admin=False, user_editable_groups=None,
                       publishers=None, **kwargs):
-    '''Returns the standard fieldset
+    '''Returns the standard fieldset. It is unbound and shared, so bind
+    it before changing it.
     '''
-    return build_package_gov_form_v3( \
-        is_admin=is_admin, user_editable_groups=user_editable_groups,
-        publishers=publishers, **kwargs).get_fieldset()
+    if user_editable_groups:
+        # the fieldset holds the user's Group objects, so is not shared
+        return build_package_gov_form_v3( \
+            is_admin=is_admin, user_editable_groups=user_editable_groups,
+            publishers=publishers, **kwargs).get_fieldset()
+    _check_license_options()
+    restrict = str(kwargs.get('restrict', False)).lower() not in \
+               ('0', 'no', 'false', 0, False)
+    other_kwargs = tuple(sorted( \
+        (name, repr(value)) for name, value in kwargs.items() \
+        if name not in _fieldset_unaffected_by and name != 'restrict'))
+    key = (_publishers_key(publishers), restrict, bool(is_admin), other_kwargs)
+    fieldset = fieldset_cache.get(key)
+    if fieldset is CACHE_MISS:
+        kwargs['restrict'] = restrict
+        fieldset = build_package_gov_form_v3( \
+            is_admin=is_admin, user_editable_groups=user_editable_groups,
+            publishers=publishers, **kwargs).get_fieldset()
+        fieldset_cache.set(key, fieldset)
+    return fieldset
+
+# keyword arguments that the fieldset does not depend on, so are left out
+# of the cache key
+_fieldset_unaffected_by = ('user_name',)
+
+def get_publisher_options(publishers):
+    '''Returns the options for the publisher fields, sorted by label.
+    @param publishers - dictionary of publishers from Drupal: {ID: label}
+    '''
+    key = _publishers_key(publishers)
+    publisher_options = publisher_options_cache.get(key)
+    if publisher_options is CACHE_MISS:
+        # options are iterators of: (label, value)
+        publisher_options = [(str(label), "%s [%s]" % (label, value)) for value, label in (publishers or {}).items()]
+        publisher_options.sort()
+        publisher_options_cache.set(key, publisher_options)
+    return publisher_options
+
+def get_license_options():
+    '''Returns the licence options (title, id), as
+    model.Package.get_license_options() does.'''
+    _check_license_options()
+    return _license_options
+
+def clear_form_cache():
+    '''Clears the cached fieldsets and option lists, e.g. after the
+    licences or publishers have been changed.'''
+    fieldset_cache.clear()
+    publisher_options_cache.clear()
+    del _license_options[:]
+
+def _publishers_key(publishers):
+    return frozenset((publishers or {}).items())
+
+def _check_license_options():
+    # The licence register is loaded once, so listing the options is
+    # quick, but a new list means the cached fieldsets are out of date.
+    license_options = model.Package.get_license_options()
+    if license_options != _license_options:
+        fieldset_cache.clear()
+        _license_options[:] = license_options
 
 # ResourcesField copied into here from ckan/forms/common.py so that
 # the rendered fields (c.columns) can be fixed, to avoid issues with
@@ -0,0 +1,115 @@
+'''
+Geographic coverage of a package, as stored in the geographic_coverage
+extra, e.g. "101000: England, Wales". The digits say which of the
+region_options are covered.
+
+There are only 2^6 combinations of regions, so the db values and
+printable names for all of them are worked out once, and conversions are
+then table lookups.
+'''
+from ckanext.dgu.cache import memoize
+
+region_options = ('England', 'Scotland', 'Wales', 'Northern Ireland', 'Overseas', 'Global')
+
+region_groupings = {'United Kingdom':['England', 'Scotland', 'Wales', 'Northern Ireland'], 'Great Britain':['England', 'Scotland', 'Wales']}
+
+region_abbreviations = {'UK':'United Kingdom', 'N. Ireland':'Northern Ireland', 'GB':'Great Britain'}
+
+class GeoCoverageType(object):
+    @staticmethod
+    def get_instance():
+        if not hasattr(GeoCoverageType, 'instance'):
+            GeoCoverageType.instance = GeoCoverageType.Singleton()
+        return GeoCoverageType.instance
+
+    class Singleton(object):
+        def __init__(self):
+            regions_str = region_options
+            self.groupings = region_groupings
+            self.regions = [(region_str, GeoCoverageType.munge(region_str)) for region_str in regions_str]
+            self.regions_munged = [GeoCoverageType.munge(region_str) for region_str in regions_str]
+            # a region's bit in a mask is 1 << its index in region_options
+            self._region_bits = dict((region_munged, 1 << i) \
+                                     for i, region_munged in enumerate(self.regions_munged))
+            self._printable_names = [] # by mask
+            self._db_values = [] # by mask
+            self._form_regions = {} # by coded regions e.g. '101000'
+            for mask in range(1 << len(self.regions)):
+                form_regions = tuple(region_munged for region_munged in self.regions_munged \
+                                     if mask & self._region_bits[region_munged])
+                coded_regions = u''.join('1' if region_munged in form_regions else '0' \
+                                         for region_munged in self.regions_munged)
+                printable_names = self._group_region_names(form_regions)
+                self._printable_names.append(printable_names)
+                self._db_values.append('%s: %s' % (coded_regions, printable_names))
+                self._form_regions[coded_regions] = form_regions
+
+        def _group_region_names(self, munged_regions):
+            incl_regions = []
+            for region_str, region_munged in self.regions:
+                if region_munged in munged_regions:
+                    incl_regions.append(region_str)
+            for grouping_str, regions_str in self.groupings.items():
+                all_regions_in = True
+                for region_str in regions_str:
+                    if region_str not in incl_regions:
+                        all_regions_in = False
+                        break
+                if all_regions_in:
+                    for region_str in regions_str:
+                        incl_regions.remove(region_str)
+                    incl_regions.append('%s (%s)' % (grouping_str, ', '.join(regions_str)))
+            return ', '.join(incl_regions)
+
+        def _mask(self, munged_regions):
+            mask = 0
+            for region_munged in munged_regions:
+                mask |= self._region_bits.get(region_munged, 0)
+            return mask
+
+        def munged_regions_to_printable_region_names(self, munged_regions):
+            return self._printable_names[self._mask(munged_regions)]
+
+        def str_to_db(self, regions_str):
+            return self._db_values[_str_to_mask(regions_str)]
+
+        def form_to_db(self, form_regions):
+            assert isinstance(form_regions, list)
+            return self._db_values[self._mask(form_regions)]
+
+        def db_to_form(self, form_regions):
+            '''
+            @param form_regions e.g. 110000: England, Scotland
+            @return e.g. ["england", "scotland"]
+            '''
+            if len(form_regions) <= len(self.regions):
+                return []
+            regions = None
+            if isinstance(form_regions, basestring):
+                regions = self._form_regions.get(form_regions[:len(self.regions)])
+            if regions is None:
+                # not just 0s and 1s
+                regions = [region_munged for i, region_munged in enumerate(self.regions_munged) \
+                           if form_regions[i] == '1']
+            return list(regions)
+
+    @staticmethod
+    def munge(region):
+        return region.lower().replace(' ', '_')
+
+    def __getattr__(self, name):
+        return getattr(self.instance, name)
+
+@memoize(max_size=1000)
+def _str_to_mask(regions_str):
+    '''Returns the mask of the regions named in a string
+    e.g. "England and Wales" gives 0b101'''
+    for abbrev, region in region_abbreviations.items():
+        regions_str = regions_str.replace(abbrev, region)
+    for grouping, regions in region_groupings.items():
+        regions_str = regions_str.replace(grouping, ' '.join(regions))
+    mask = 0
+    for i, region in enumerate(region_options):
+        if region in regions_str:
+            mask |= 1 << i
+    return mask
@@ -0,0 +1,223 @@
+'''
+Queue of requests to create harvest jobs, so that the Form API can
+return straight away (202 Accepted) rather than creating the job, which
+validates the source, during the HTTP request.
+
+The queue is an SQLite file, shared by the web processes that add
+requests and a worker process that creates the jobs:
+
+    paster --plugin=ckanext-dgu harvest_queue run --config=ckan.ini
+
+The queue is used when it is configured in the CKAN config:
+
+    dgu.harvest_queue.path = /var/lib/ckan/dgu/harvest_queue.db
+
+Each request is given an id, which can be used to poll its status:
+queued, running, done (with the id of the harvest job created) or error.
+'''
+import os
+import time
+import uuid
+import threading
+import logging
+
+import paste.script
+from ckan.lib.cli import CkanCommand
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+
+class HarvestJobQueue(object):
+    '''Queue of harvest job requests, stored in an SQLite file.'''
+    # finished requests are kept this long (seconds) for polling
+    keep_finished = 7 * 24 * 60 * 60
+    # running requests older than this (seconds) are assumed to have been
+    # abandoned by a worker that died, and are queued again
+    running_timeout = 60 * 60
+
+    def __init__(self, filepath):
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        # sqlite connections cannot be shared between threads
+        self._local = threading.local()
+        dirpath = os.path.dirname(self.filepath)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        conn = self._connection()
+        conn.execute('CREATE TABLE IF NOT EXISTS queue '
+                     '(id TEXT PRIMARY KEY, source_id TEXT, status TEXT, '
+                     'job_id TEXT, error TEXT, created REAL, updated REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS queue_status '
+                     'ON queue (status, created)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.filepath, timeout=10,
+                                   isolation_level='IMMEDIATE')
+            self._local.conn = conn
+        return conn
+
+    def put(self, source_id):
+        '''Queues a request to create a job for the harvest source.
+        If there is already a queued request for the source, it is not
+        queued again.
+        @return the request id'''
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('INSERT INTO queue SELECT ?, ?, ?, ?, ?, ?, ? '
+                         'WHERE NOT EXISTS (SELECT 1 FROM queue '
+                         'WHERE source_id=? AND status=?)',
+                         (unicode(uuid.uuid4()), source_id, QUEUED, None, None,
+                          now, now, source_id, QUEUED))
+            request_id = conn.execute('SELECT id FROM queue WHERE source_id=? '
+                                      'AND status=?',
+                                      (source_id, QUEUED)).fetchone()[0]
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        return request_id
+
+    def get(self, request_id):
+        '''Returns the request as a dict, or None if there is no such
+        request.'''
+        row = self._connection().execute(
+            'SELECT id, source_id, status, job_id, error, created, updated '
+            'FROM queue WHERE id=?', (request_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('id', 'source_id', 'status', 'job_id', 'error',
+                         'created', 'updated'), row))
+
+    def claim(self):
+        '''Marks the oldest queued request as running and returns it
+        (as a dict), or returns None if the queue is empty.'''
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('UPDATE queue SET status=?, updated=? '
+                         'WHERE status=? AND updated<?',
+                         (QUEUED, now, RUNNING, now - self.running_timeout))
+            row = conn.execute('SELECT id FROM queue WHERE status=? '
+                               'ORDER BY created LIMIT 1',
+                               (QUEUED,)).fetchone()
+            if row:
+                conn.execute('UPDATE queue SET status=?, updated=? WHERE id=?',
+                             (RUNNING, now, row[0]))
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        return self.get(row[0]) if row else None
+
+    def done(self, request_id, job_id):
+        self._finish(request_id, DONE, job_id=job_id)
+
+    def failed(self, request_id, error):
+        self._finish(request_id, ERROR, error=error)
+
+    def _finish(self, request_id, status, job_id=None, error=None):
+        conn = self._connection()
+        now = time.time()
+        try:
+            conn.execute('UPDATE queue SET status=?, job_id=?, error=?, '
+                         'updated=? WHERE id=?',
+                         (status, job_id, error, now, request_id))
+            conn.execute('DELETE FROM queue WHERE status IN (?, ?) '
+                         'AND updated<?',
+                         (DONE, ERROR, now - self.keep_finished))
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+    def __len__(self):
+        '''Returns the number of queued requests.'''
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM queue WHERE status=?',
+            (QUEUED,)).fetchone()[0]
+
+def queue_from_config(config):
+    '''Returns the HarvestJobQueue configured with dgu.harvest_queue.path,
+    or None if it is not configured, in which case jobs should be created
+    straight away.'''
+    filepath = (config or {}).get('dgu.harvest_queue.path')
+    if not filepath:
+        return None
+    return HarvestJobQueue(filepath)
+
+def process_queue(queue, create_job, poll_interval=2.0, run_forever=True):
+    '''Creates the harvest jobs requested in the queue.
+    @param create_job - function that creates a job for a source id and
+                        returns the job dict
+    @param run_forever - if False, returns when the queue is empty
+    @return number of requests processed
+    '''
+    processed = 0
+    while True:
+        request = queue.claim()
+        if request is None:
+            if not run_forever:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        try:
+            job = create_job(request['source_id'])
+        except Exception, e:
+            log.info('Harvest job not created for source %s: %s',
+                     request['source_id'], e)
+            queue.failed(request['id'], str(e))
+        else:
+            log.info('Harvest job %s created for source %s',
+                     job['id'], request['source_id'])
+            queue.done(request['id'], job['id'])
+        processed += 1
+
+class Command(CkanCommand):
+    '''Creates the harvest jobs requested through the Form API
+
+    harvest_queue run --config=ckan.ini   - keep processing the queue
+    harvest_queue process --config=ckan.ini   - process until it is empty
+    '''
+    parser = paste.script.command.Command.standard_parser(verbose=True)
+    parser.add_option('-c', '--config', dest='config',
+                      default='development.ini', help='Config file to use.')
+    parser.add_option('-i', '--interval', dest='interval', type='float',
+                      default=2.0,
+                      help='Seconds to wait between polls of an empty queue.')
+    default_verbosity = 1
+    group_name = 'ckanext-dgu'
+    summary = __doc__.split('\n')[0]
+    usage = __doc__
+    min_args = 1
+    max_args = 1
+
+    def command(self):
+        cmd = self.args[0]
+        if cmd not in ('run', 'process'):
+            raise self.BadCommand('Command not recognised: %r' % cmd)
+        self._load_config()
+        from pylons import config
+        from ckan import model
+        from ckanext.harvest.lib import create_harvest_job
+        queue = queue_from_config(config)
+        if queue is None:
+            raise self.BadCommand('Config option dgu.harvest_queue.path is '
+                                  'not set')
+        def create_job(source_id):
+            try:
+                return create_harvest_job(source_id)
+            finally:
+                model.Session.remove()
+        processed = process_queue(queue, create_job,
+                                  poll_interval=self.options.interval,
+                                  run_forever=(cmd == 'run'))
+        if self.verbose:
+            print 'Processed %i harvest job requests' % processed
@@ -2,55 +2,105 @@
 # Drupal integration code
 #
 
-import Cookie
+import logging
 from ckanext.dgu.drupalclient import DrupalClient, DrupalXmlRpcSetupError, \
-     DrupalRequestError
+     DrupalRequestError, DrupalKeyError
+from ckanext.dgu.cache import cache_from_config, CACHE_MISS
 from xmlrpclib import ServerProxy
 
+log = logging.getLogger(__name__)
+
+# Requests for these files are passed straight through, without looking
+# at the cookies.
+STATIC_FILE_EXTENSIONS = frozenset(('css', 'js', 'png', 'gif', 'jpg', 'jpeg',
+                                    'ico', 'svg', 'woff', 'ttf', 'eot'))
+
+def scan_cookies(cookie_string):
+    '''Finds the Drupal session ID and whether there is a CKAN auth_tkt
+    cookie in a single pass over the Cookie header, without parsing
+    all the other cookies (e.g. analytics ones).
+
+    @return (drupal_session_id or None, ckan_signed_in)
+    '''
+    drupal_session_id = None
+    ckan_signed_in = False
+    for cookie in cookie_string.split(';'):
+        cookie = cookie.strip()
+        if drupal_session_id is None and cookie.startswith('SESS'):
+            name, sep, value = cookie.partition('=')
+            if sep:
+                if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+                    value = value[1:-1]
+                drupal_session_id = value
+        elif cookie.startswith('auth_tkt='):
+            ckan_signed_in = True
+    return drupal_session_id, ckan_signed_in
+
 def drupal_extract_cookie(cookie_string):
-    cookies = Cookie.SimpleCookie()
-    cookies.load(str(cookie_string))
-    for cookie in cookies:
-        if cookie.startswith('SESS'):
-            return cookies[cookie].value
-    return None
+    return scan_cookies(cookie_string)[0]
 
 def is_ckan_signed_in(cookie_string):
-    cookies = Cookie.SimpleCookie()
-    cookies.load(str(cookie_string))
-    if not 'auth_tkt' in cookies:
-        return False
-    return True
+    return scan_cookies(cookie_string)[1]
+
+def is_static_file_request(path):
+    return path.rpartition('.')[2].lower() in STATIC_FILE_EXTENSIONS
 
 class AuthAPIMiddleware(object):
 
     def __init__(self, app, app_conf):
         self.app = app
         self.drupal_client = None
+        # Caches the Drupal user for each session ID, to save the two
+        # XML-RPC calls on every request.
+        # Configured with dgu.session_cache.* options - see cache_from_config
+        app_conf = app_conf or {}
+        self.session_cache = cache_from_config(app_conf, 'dgu.session_cache')
+        self.session_cache_negative_ttl = int(app_conf.get('dgu.session_cache.negative_ttl', 60))
+
+    def _get_drupal_user(self, session_id):
+        '''Returns the Drupal user properties for a session ID,
+        or None if Drupal does not recognise the session.'''
+        user = CACHE_MISS
+        if self.session_cache is not None:
+            user = self.session_cache.get(session_id)
+        if user is not CACHE_MISS:
+            return user
+        try:
+            user_id = self.drupal_client.get_user_id_from_session_id(session_id)
+        except DrupalKeyError:
+            log.info('Drupal does not recognise session ID %r', session_id)
+            if self.session_cache is not None:
+                self.session_cache.set(session_id, None,
+                                       ttl=self.session_cache_negative_ttl)
+            return None
+        res = self.drupal_client.get_user_properties(user_id)
+        user = {'uid': res['uid'],
+                'publishers': res['publishers'],
+                'name': res['name']}
+        if self.session_cache is not None:
+            self.session_cache.set(session_id, user)
+        return user
 
     def __call__(self, environ, start_response):
+        if is_static_file_request(environ.get('PATH_INFO', '')):
+            return self.app(environ, start_response)
+
         if self.drupal_client is None:
             self.drupal_client = DrupalClient()
 
         # establish from the cookie whether ckan and drupal are signed in
-        ckan_signed_in = [False]
-        drupal_signed_in = [False]
-        for k, v in environ.items():
-            key = k.lower()
-            if key  == 'http_cookie':
-                ckan_signed_in[0] = is_ckan_signed_in(v)
-                drupal_signed_in[0] = drupal_extract_cookie(v)
-        ckan_signed_in = ckan_signed_in[0]
-        drupal_signed_in = drupal_signed_in[0]
+        drupal_signed_in, ckan_signed_in = \
+                          scan_cookies(environ.get('HTTP_COOKIE', ''))
 
         environ['drupal.uid'] = None
         environ['drupal.publishers'] = None
         new_start_response = start_response
+        res = None
         if drupal_signed_in and not ckan_signed_in:
-            # get info about the user from drupal and store in environ for
-            # use by main CKAN app
-            user_id = self.drupal_client.get_user_id_from_session_id(drupal_signed_in)
-            res = self.drupal_client.get_user_properties(user_id)
+            # get info about the user from drupal (or the cache)
+            res = self._get_drupal_user(drupal_signed_in)
+        if res:
+            # store in environ for use by main CKAN app
             environ['drupal.uid'] = res['uid']
             environ['drupal.publishers'] = res['publishers']
             environ['drupal.name'] = res['name']
@@ -1,10 +1,13 @@
+import os
 import datetime
 
 from ckanext.importlib.api_command import ApiCommand
 from ckanext.dgu.bin.xmlrpc_command import XmlRpcCommand
 from ckanext.dgu.ons.downloader import OnsData, ONS_DEFAULT_CACHE_PATH
 from ckanext.dgu.ons.importer import OnsImporter
-from ckanext.dgu.ons.loader import OnsLoader
+from ckanext.dgu.ons.loader import OnsLoader, OnsPackageIndex
+from ckanext.dgu.ons.journal import OnsImportJournal, default_journal_filepath
+from ckanext.dgu.schema import ORGANISATION_CACHE_DEFAULT_PATH
 from ckanclient import CkanClient
 
 class OnsLoaderCmd(ApiCommand, XmlRpcCommand):
@@ -28,6 +31,31 @@ class OnsLoaderCmd(ApiCommand, XmlRpcCommand):
         self.parser.add_option("-c", "--cache-dir",
                                dest="ons_cache_dir",
                                help="Path to store downloads from ONS Pub Hub")
+        self.parser.add_option("--org-cache",
+                               dest="org_cache_filepath",
+                               default=ORGANISATION_CACHE_DEFAULT_PATH,
+                               help="File to keep organisation lookups in between runs (default: %default)")
+        self.parser.add_option("--refresh-org-cache",
+                               dest="refresh_org_cache",
+                               action="store_true",
+                               default=False,
+                               help="Look up all organisations in Drupal again, rather than using the cached ones")
+        self.parser.add_option("--journal",
+                               dest="journal_filepath",
+                               help="File recording the items already imported, so that unchanged ones are skipped (default: import_journal.<CKAN API URL>.db in the cache dir). Use a separate one for each CKAN instance.")
+        self.parser.add_option("--reimport",
+                               dest="reimport",
+                               action="store_true",
+                               default=False,
+                               help="Import all the items, even those the journal says are unchanged")
+        self.parser.add_option("--packages-dump",
+                               dest="packages_dump",
+                               help="JSON dump of the CKAN packages (as written by gov_daily) to find the existing ONS packages in, instead of listing them with the API")
+        self.parser.add_option("--no-package-index",
+                               dest="package_index",
+                               action="store_false",
+                               default=True,
+                               help="Search CKAN for each record's package, rather than listing all the ONS packages first")
         
     def parse_date(self, date_str):
         return datetime.date(*[int(date_chunk) for date_chunk in date_str.split('-')])
@@ -55,15 +83,35 @@ class OnsLoaderCmd(ApiCommand, XmlRpcCommand):
                 ons_cache_dir=self.options.ons_cache_dir)
 
         elif self.options.all_time:
-            data_filepaths = OnsData.download_all()
+            data_filepaths = OnsData.download_all(ons_cache_dir=self.options.ons_cache_dir)
         else:
             self.parser.error('Please specify a time period')
 
+        # the journal is for one CKAN instance, but the cache dir can be
+        # shared by imports into several
+        journal = OnsImportJournal(self.options.journal_filepath or \
+                                   default_journal_filepath(
+                                       self.options.ons_cache_dir,
+                                       self.options.api_url))
         importer = OnsImporter(filepaths=data_filepaths,
-                               xmlrpc_settings=self.xmlrpc_settings)
-        loader = OnsLoader(self.client)
+                               xmlrpc_settings=self.xmlrpc_settings,
+                               organisation_cache_filepath=self.options.org_cache_filepath,
+                               refresh_organisation_cache=self.options.refresh_org_cache,
+                               journal=journal,
+                               skip_unchanged=not self.options.reimport)
+        if self.options.packages_dump:
+            package_index = OnsPackageIndex.from_dump(self.options.packages_dump)
+        elif self.options.package_index:
+            package_index = OnsPackageIndex.from_api(self.client)
+        else:
+            package_index = None
+        loader = OnsLoader(self.client, journal=journal,
+                           package_index=package_index)
 
-        loader.load_packages(importer.pkg_dict())
+        try:
+            loader.load_packages(importer.pkg_dict())
+        finally:
+            journal.close()
 
 def load():
     OnsLoaderCmd().command()
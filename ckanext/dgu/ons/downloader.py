@@ -1,8 +1,12 @@
 import os
-import urllib
+import urllib2
 import datetime
 import logging
 import datetime
+import gzip
+import json
+import tempfile
+from multiprocessing.pool import ThreadPool
 
 ONS_DEFAULT_CACHE_PATH = os.path.abspath(os.path.expanduser('~/ons_data'))
 ONS_URL_BASE = 'http://www.statistics.gov.uk/hub/release-calendar/rss.xml?lday=%(lday)s&lmonth=%(lmonth)s&lyear=%(lyear)s&uday=%(uday)s&umonth=%(umonth)s&uyear=%(uyear)s'
@@ -11,7 +15,15 @@ MONTHS_PER_YEAR = 12
 YEAR_ONS_DATA_STARTS = 1998
 
 class OnsData(object):
-    '''Manages download and parse of ONS data.'''
+    '''Manages download and parse of ONS data.
+
+    Downloads are cached (gzipped) in the local cache dir. A cached
+    download is not downloaded again, unless force_download is
+    specified, in which case it is revalidated with the server using the
+    ETag / Last-Modified headers stored alongside it.'''
+    max_concurrent_downloads = 4
+    download_timeout = 120 # seconds
+
     @classmethod
     def download_recent(cls, ons_cache_dir=ONS_DEFAULT_CACHE_PATH, log=False, days=7):
         ons = cls(ons_cache_dir, log)
@@ -43,20 +55,68 @@ class OnsData(object):
             os.makedirs(self._local_cache_dir)
         
     def download_multiple(self, url_tuples):
-        filepaths = []
-        for url_tuple in url_tuples:
-            filepaths.append(self.download(*url_tuple))
-        return filepaths
+        if len(url_tuples) < 2:
+            return [self.download(*url_tuple) for url_tuple in url_tuples]
+        pool = ThreadPool(min(self.max_concurrent_downloads, len(url_tuples)))
+        try:
+            return pool.map(lambda url_tuple: self.download(*url_tuple),
+                            url_tuples)
+        finally:
+            pool.close()
 
     def download(self, url, url_name, force_download=False):
-        local_filepath = os.path.join(self._local_cache_dir, 'ons_data_%s' % url_name)
-        if force_download and os.path.exists(local_filepath):
-            os.remove(local_filepath)
-        if not os.path.exists(local_filepath):
-            self.log(logging.info, 'Downloading: %s - %s' % (url_name, url))
-            urllib.urlretrieve(url, local_filepath)
-        else:
-            self.log(logging.info, 'ONS Data already downloaded: %s' % url_name)
+        local_filepath = os.path.join(self._local_cache_dir, 'ons_data_%s.gz' % url_name)
+        headers_filepath = local_filepath + '.headers'
+        if not force_download:
+            # uncompressed files are from before the cache was gzipped
+            for filepath in (local_filepath, local_filepath[:-len('.gz')]):
+                if os.path.exists(filepath):
+                    self.log(logging.info, 'ONS Data already downloaded: %s' % url_name)
+                    return filepath
+
+        request = urllib2.Request(url)
+        if os.path.exists(local_filepath) and os.path.exists(headers_filepath):
+            # only download it if it has changed
+            with open(headers_filepath) as f:
+                cached_headers = json.load(f)
+            if cached_headers.get('etag'):
+                request.add_header('If-None-Match', cached_headers['etag'])
+            if cached_headers.get('last-modified'):
+                request.add_header('If-Modified-Since', cached_headers['last-modified'])
+        self.log(logging.info, 'Downloading: %s - %s' % (url_name, url))
+        try:
+            response = urllib2.urlopen(request, timeout=self.download_timeout)
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                self.log(logging.info, 'ONS Data not changed: %s' % url_name)
+                return local_filepath
+            raise
+        try:
+            # write to a temporary file and rename it when complete, so that
+            # an interrupted download does not leave a partial file
+            fd, tmp_filepath = tempfile.mkstemp(dir=self._local_cache_dir,
+                                                prefix='.download_')
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    gzip_file = gzip.GzipFile(fileobj=tmp_file, mode='wb')
+                    while True:
+                        chunk = response.read(64 * 1024)
+                        if not chunk:
+                            break
+                        gzip_file.write(chunk)
+                    gzip_file.close()
+                if os.path.exists(headers_filepath):
+                    os.remove(headers_filepath)
+                os.rename(tmp_filepath, local_filepath)
+            except:
+                os.remove(tmp_filepath)
+                raise
+            cached_headers = dict((header, response.info().getheader(header)) \
+                                  for header in ('etag', 'last-modified'))
+        finally:
+            response.close()
+        with open(headers_filepath, 'w') as f:
+            json.dump(cached_headers, f)
         return local_filepath
         
     def download_month(self, month, year):
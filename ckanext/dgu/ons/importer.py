@@ -2,6 +2,8 @@ import xml.sax
 import re
 import os
 import glob
+import gzip
+from collections import deque
 
 from ckanext.importlib.importer import PackageImporter
 from ckanext.dgu import schema
@@ -14,14 +16,32 @@ log = __import__("logging").getLogger(__name__)
 
 
 class OnsImporter(PackageImporter):
-    def __init__(self, filepaths, xmlrpc_settings=None):
+    # records are read, and their organisations looked up in Drupal, this
+    # many at a time
+    organisation_batch_size = 100
+
+    def __init__(self, filepaths, xmlrpc_settings=None,
+                 organisation_cache_filepath=None,
+                 refresh_organisation_cache=False, journal=None,
+                 skip_unchanged=True):
+        '''
+        @param journal - an OnsImportJournal. Items it says are unchanged
+                         since they were last loaded are skipped, unless
+                         skip_unchanged is False.
+        '''
         if not isinstance(filepaths, (list, tuple)):
             filepaths = [filepaths]
-        self._current_filename = os.path.basename(filepaths[0])
+        self._current_filename = self._filename(filepaths[0])
+        self._journal = journal
+        self._skip_unchanged = skip_unchanged
+        self._unchanged_count = 0
         self._item_count = 0
         self._new_package_count = 0
         self._crown_license_id = u'uk-ogl'
-        self._drupal_helper = schema.DrupalHelper(xmlrpc_settings)
+        self._drupal_helper = schema.DrupalHelper(
+            xmlrpc_settings,
+            organisation_cache_filepath=organisation_cache_filepath,
+            refresh_organisation_cache=refresh_organisation_cache)
         super(OnsImporter, self).__init__(filepath=filepaths)
 
     def import_into_package_records(self):
@@ -29,11 +49,51 @@ class OnsImporter(PackageImporter):
         pass
 
     def pkg_dict(self):
+        self._unchanged_count = 0
         for filepath in self._filepath:
             log.info('Importing from file: %s' % filepath)
-            self._current_filename = os.path.basename(filepath)
-            for item in OnsDataRecords(filepath):
-                yield self.record_2_package(item)
+            self._current_filename = self._filename(filepath)
+            for items in self._batches(self._changed_records(filepath)):
+                self._warm_organisation_cache(items)
+                for item in items:
+                    yield self.record_2_package(item)
+        if self._journal is not None:
+            log.info('Skipped %i items unchanged since the last import',
+                     self._unchanged_count)
+
+    def _changed_records(self, filepath):
+        '''Yields the records in the file, except those which the journal
+        says have not changed since they were last loaded.'''
+        for item in OnsDataRecords(filepath):
+            if self._journal is not None and item['guid'] and \
+                   item['guid'].startswith(guid_prefix):
+                hub_id = item['guid'][len(guid_prefix):]
+                content_hash = self._journal.item_hash(item)
+                if self._skip_unchanged and \
+                       self._journal.is_unchanged(hub_id, content_hash):
+                    self._unchanged_count += 1
+                    continue
+                self._journal.start(hub_id, content_hash)
+            yield item
+
+    @classmethod
+    def _batches(cls, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= cls.organisation_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _filename(filepath):
+        # downloads are cached gzipped, but the import_source is the same
+        filename = os.path.basename(filepath)
+        if filename.endswith('.gz'):
+            filename = filename[:-len('.gz')]
+        return filename
 
     def record_2_package(self, item):
         assert isinstance(item, dict)
@@ -152,6 +212,17 @@ class OnsImporter(PackageImporter):
         geographic_coverage_db = geo_coverage_type.str_to_db(coverage_str)
         return geographic_coverage_db
 
+    def _warm_organisation_cache(self, items):
+        '''Looks up in Drupal all the organisations the records refer to,
+        in one go, rather than one by one as each record is imported.
+        Organisations already in the cache are not looked up again.'''
+        sources = set(schema.canonise_organisation_name(item['hub:source-agency']) \
+                      for item in items)
+        # departments assigned in _source_to_organisations
+        sources.update((u'Northern Ireland Executive',
+                        u'Department for Education'))
+        self._drupal_helper.warm_organisation_cache(sources)
+
     def _cached_source_to_organisations(self, source):
         return self._source_to_organisations(source, drupal_helper=self._drupal_helper)
     
@@ -207,21 +278,44 @@ class OnsImporter(PackageImporter):
         return [x for x in match.groups() if x]
 
 class OnsDataRecords(object):
+    '''Iterates over the items in an ONS Hub RSS file. The file is parsed
+    incrementally and each item is yielded as soon as it has been read,
+    so memory use does not depend on the size of the file.'''
+    chunk_size = 64 * 1024
+
     def __init__(self, xml_filepath):
         self._xml_filepath = xml_filepath
 
     def __iter__(self):
         ons_xml = OnsXml()
-        xml.sax.parse(self._xml_filepath, ons_xml)
-        for record in ons_xml.items:
-            yield record
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(ons_xml)
+        if self._xml_filepath.endswith('.gz'):
+            f = gzip.open(self._xml_filepath, 'rb')
+        else:
+            f = open(self._xml_filepath, 'rb')
+        try:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+                while ons_xml.items:
+                    yield ons_xml.items.popleft()
+            parser.close()
+        finally:
+            f.close()
+        while ons_xml.items:
+            yield ons_xml.items.popleft()
     
 
 class OnsXml(xml.sax.handler.ContentHandler):
+    '''Parses ONS Hub RSS. Each item is put in self.items when its end
+    tag is reached, for the caller to take away.'''
     def startDocument(self):
         self._level = 0
         self._item_dict = {}
-        self.items = []
+        self.items = deque()
         
     def startElement(self, name, attrs):
         self._level += 1
@@ -248,11 +342,11 @@ class OnsXml(xml.sax.handler.ContentHandler):
                             'hub:language',
                             'hub:nscl'), name
             self._item_element = name
-            self._item_data = u''
+            self._item_data = []
 
     def characters(self, chrs):
         if self._level == 4:
-            self._item_data += chrs
+            self._item_data.append(chrs)
 
     def endElement(self, name):
         if self._level == 3:
@@ -260,6 +354,6 @@ class OnsXml(xml.sax.handler.ContentHandler):
                 self.items.append(self._item_dict)
             self._item_dict = {}
         elif self._level == 4:
-            self._item_dict[self._item_element] = self._item_data
+            self._item_dict[self._item_element] = u''.join(self._item_data)
             self._item_element = self._item_data = None
         self._level -= 1
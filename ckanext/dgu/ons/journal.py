@@ -0,0 +1,103 @@
+'''
+Journal of the ONS Hub items that have been imported, so that an import
+can skip the items that have not changed since they were last loaded
+into CKAN.
+
+Each item is identified by its hub id (the GUID without the
+'http://www.statistics.gov.uk/hub/id/' prefix) and the journal stores a
+hash of the item's content, plus the CKAN package and resource ids it
+was loaded into. An item is only recorded once it has been loaded
+successfully, so a failed load is retried on the next run.
+
+The journal describes what has been loaded into one CKAN instance, so
+use a separate journal file for each.
+'''
+import os
+import re
+import time
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+def default_journal_filepath(dirpath, api_url):
+    '''Returns the path of the journal for imports into the CKAN with this
+    API URL, e.g. import_journal.ckan.example.com_api.db'''
+    instance = re.sub(r'[^\w.-]+', '_',
+                      (api_url or '').split('://')[-1]).strip('_')
+    return os.path.join(dirpath, 'import_journal.%s.db' % (instance or 'default'))
+
+class OnsImportJournal(object):
+    # records are written to disk in batches of this size
+    commit_interval = 100
+
+    def __init__(self, filepath):
+        import sqlite3
+        self.filepath = os.path.abspath(os.path.expanduser(filepath))
+        dirpath = os.path.dirname(self.filepath)
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self._conn = sqlite3.connect(self.filepath, timeout=10)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS journal '
+                           '(hub_id TEXT PRIMARY KEY, content_hash TEXT, '
+                           'package_id TEXT, resource_id TEXT, updated REAL)')
+        self._conn.commit()
+        self._pending = {} # hub_id: content_hash of items being imported
+        self._uncommitted = 0
+
+    @staticmethod
+    def item_hash(item):
+        '''Returns a hash of the content of an ONS Hub item (a dict
+        from OnsDataRecords).'''
+        sha1 = hashlib.sha1()
+        for key in sorted(item.keys()):
+            sha1.update(key.encode('utf8'))
+            sha1.update('\0')
+            sha1.update((item[key] or u'').encode('utf8'))
+            sha1.update('\0')
+        return sha1.hexdigest()
+
+    def is_unchanged(self, hub_id, content_hash):
+        '''Returns whether the item has already been loaded with this
+        content.'''
+        row = self._conn.execute(
+            'SELECT content_hash FROM journal WHERE hub_id=?',
+            (hub_id,)).fetchone()
+        return row is not None and row[0] == content_hash
+
+    def start(self, hub_id, content_hash):
+        '''Notes that an item with this content is being imported. It is
+        not recorded in the journal until record() is called.'''
+        self._pending[hub_id] = content_hash
+
+    def record(self, hub_id, package_id, resource_id=None):
+        '''Records that the item being imported has been loaded into the
+        given package and resource.'''
+        content_hash = self._pending.pop(hub_id, None)
+        if content_hash is None:
+            return
+        self._conn.execute('INSERT OR REPLACE INTO journal '
+                           'VALUES (?, ?, ?, ?, ?)',
+                           (hub_id, content_hash, package_id, resource_id,
+                            time.time()))
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_interval:
+            self.commit()
+
+    def get(self, hub_id):
+        '''Returns (content_hash, package_id, resource_id) for an item,
+        or None if it is not in the journal.'''
+        return self._conn.execute(
+            'SELECT content_hash, package_id, resource_id FROM journal '
+            'WHERE hub_id=?', (hub_id,)).fetchone()
+
+    def commit(self):
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
@@ -1,11 +1,110 @@
 import re
+import logging
+from collections import defaultdict
 
 from datautildate import date
 
 from ckanext.importlib.loader import ResourceSeriesLoader
 
+log = logging.getLogger(__name__)
+
+class OnsPackageIndex(object):
+    '''Index of the existing ONS packages by title and publisher, so that
+    OnsLoader can find the package for a record without a search request.
+
+    Only ONS packages are indexed, so a record not found in the index is
+    still searched for in CKAN.'''
+    publisher_keys = ('published_by', 'published_via')
+
+    def __init__(self, pkg_dicts=()):
+        self._names = defaultdict(set) # (title, publisher_key, publisher): names
+        self._keys = {} # name: keys it is indexed under
+        for pkg_dict in pkg_dicts:
+            self.add(pkg_dict)
+
+    @classmethod
+    def from_dump(cls, dump_filepath):
+        '''Builds the index from a JSON dump of the packages (as written
+        by gov_daily).'''
+        from ckanext.dgu.bin.dump_analysis import iter_dump
+        log.info('Indexing ONS packages in dump: %s', dump_filepath)
+        index = cls(iter_dump(dump_filepath))
+        log.info('Indexed ONS packages: %i', len(index))
+        return index
+
+    @classmethod
+    def from_api(cls, ckanclient, page_size=1000):
+        '''Builds the index with a paged search for all the ONS packages.'''
+        log.info('Indexing ONS packages with the API')
+        index = cls()
+        offset = 0
+        while True:
+            res = ckanclient.package_search(
+                '', search_options={'external_reference': 'ONSHUB',
+                                    'all_fields': 1, 'limit': page_size,
+                                    'offset': offset})
+            for pkg_dict in res['results']:
+                index.add(pkg_dict)
+            offset += len(res['results'])
+            if not res['results'] or offset >= res['count']:
+                break
+        log.info('Indexed ONS packages: %i', len(index))
+        return index
+
+    @staticmethod
+    def is_ons_package(pkg_dict):
+        extras = pkg_dict.get('extras') or {}
+        return extras.get('external_reference') == 'ONSHUB' or \
+               (extras.get('import_source') or '').startswith('ONS')
+
+    def add(self, pkg_dict):
+        '''Adds a package to the index, or updates it if it is already
+        indexed.'''
+        name = pkg_dict['name']
+        self.remove(name)
+        if pkg_dict.get('state', 'active') != 'active' or \
+               not self.is_ons_package(pkg_dict):
+            return
+        keys = [(pkg_dict['title'], publisher_key,
+                 pkg_dict['extras'].get(publisher_key)) \
+                for publisher_key in self.publisher_keys \
+                if pkg_dict['extras'].get(publisher_key)]
+        for key in keys:
+            self._names[key].add(name)
+        self._keys[name] = keys
+
+    def remove(self, name):
+        for key in self._keys.pop(name, ()):
+            self._names[key].discard(name)
+            if not self._names[key]:
+                del self._names[key]
+
+    def lookup(self, search_options):
+        '''Returns the names of the packages matching the search options
+        (a title and a published_by or published_via), or None if the
+        options are not ones that are indexed.'''
+        if len(search_options) != 2 or not search_options.get('title'):
+            return None
+        for publisher_key in self.publisher_keys:
+            if search_options.get(publisher_key):
+                key = (search_options['title'], publisher_key,
+                       search_options[publisher_key])
+                return sorted(self._names.get(key, ()))
+        return None
+
+    def __len__(self):
+        return len(self._keys)
+
 class OnsLoader(ResourceSeriesLoader):
-    def __init__(self, ckanclient):
+    def __init__(self, ckanclient, journal=None, package_index=None):
+        '''
+        @param journal - an OnsImportJournal, in which the loaded items
+                         are recorded.
+        @param package_index - an OnsPackageIndex, to find existing
+                         packages in, instead of searching for each one.
+        '''
+        self._journal = journal
+        self._package_index = package_index
         field_keys_to_find_pkg_by = ['title', 'published_by']
         field_keys_to_expect_invariant = [
             'geographical_granularity',
@@ -18,6 +117,20 @@ class OnsLoader(ResourceSeriesLoader):
             field_keys_to_expect_invariant=field_keys_to_expect_invariant,
             )
 
+    def load_package(self, pkg_dict):
+        pkg = super(OnsLoader, self).load_package(pkg_dict)
+        if self._package_index is not None:
+            self._package_index.add(pkg)
+        if self._journal is not None:
+            resource_ids = dict((res.get('hub-id'), res.get('id')) \
+                                for res in pkg['resources'])
+            for res in pkg_dict['resources']:
+                hub_id = res.get('hub-id')
+                if hub_id:
+                    self._journal.record(hub_id, pkg['id'],
+                                         resource_ids.get(hub_id))
+        return pkg
+
     def _get_search_options(self, field_keys, pkg_dict):
         if pkg_dict['extras'].get('published_by'):
             search_options_list = super(OnsLoader, self)._get_search_options(field_keys, pkg_dict)
@@ -28,6 +141,13 @@ class OnsLoader(ResourceSeriesLoader):
             search_options_list = super(OnsLoader, self)._get_search_options(field_keys, pkg_dict)
         return search_options_list
 
+    def _package_search(self, search_options):
+        if self._package_index is not None:
+            pkg_names = self._package_index.lookup(search_options)
+            if pkg_names:
+                return {'count': len(pkg_names), 'results': pkg_names}
+        return super(OnsLoader, self)._package_search(search_options)
+
     def _get_hub_id(self, resource):
         '''For a given resource, returns its hub id
         e.g. "April 2009 data: Experimental Statistics | hub/id/119-46440"
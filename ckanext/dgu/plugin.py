@@ -71,12 +71,14 @@ class FormApiPlugin(SingletonPlugin):
         for version in ('', '1/'):
             map.connect('/api/%sform/package/create' % version, controller='ckanext.dgu.forms.formapi:FormController', action='package_create')
             map.connect('/api/%sform/package/edit/:id' % version, controller='ckanext.dgu.forms.formapi:FormController', action='package_edit')
+            map.connect('/api/%sform/package/batch' % version, controller='ckanext.dgu.forms.formapi:FormController', action='package_batch', conditions=dict(method=['POST']))
             map.connect('/api/%sform/harvestsource/create' % version, controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_create')
             map.connect('/api/%sform/harvestsource/edit/:id' % version, controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_edit')
             map.connect('/api/%sform/harvestsource/delete/:id' % version, controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_delete')
             map.connect('/api/%srest/harvestsource/:id' % version, controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_view')
         map.connect('/api/2/form/package/create', controller='ckanext.dgu.forms.formapi:Form2Controller', action='package_create')
         map.connect('/api/2/form/package/edit/:id', controller='ckanext.dgu.forms.formapi:Form2Controller', action='package_edit')
+        map.connect('/api/2/form/package/batch', controller='ckanext.dgu.forms.formapi:Form2Controller', action='package_batch', conditions=dict(method=['POST']))
         map.connect('/api/2/form/harvestsource/create', controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_create')
         map.connect('/api/2/form/harvestsource/edit/:id', controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_edit')
         map.connect('/api/2/form/harvestsource/delete/:id', controller='ckanext.dgu.forms.formapi:FormController', action='harvest_source_delete')
@@ -87,6 +89,9 @@ class FormApiPlugin(SingletonPlugin):
         map.connect('/api/2/rest/harvestingjob', controller='ckanext.dgu.forms.formapi:FormController',
                 action='harvesting_job_create',
                 conditions=dict(method=['POST']))
+        map.connect('/api/2/rest/harvestingjob/:id', controller='ckanext.dgu.forms.formapi:FormController',
+                action='harvesting_job_view',
+                conditions=dict(method=['GET']))
         """
         These routes are implemented in ckanext-csw
         map.connect('/api/2/rest/harvesteddocument/:id/xml/:id2.xml', controller='ckanext.dgu.forms.formapi:FormController',
@@ -115,14 +120,21 @@ class FormApiPlugin(SingletonPlugin):
         from pylons import request, tmpl_context as c
         routes = request.environ.get('pylons.routes_dict')
 
-        if routes and \
-               routes.get('controller') == 'package' and \
-               routes.get('action') == 'read' and c.pkg.id:
+        if not routes or \
+               routes.get('controller') != 'package' or \
+               routes.get('action') != 'read' or not c.pkg.id:
+            return stream
 
-            is_uklp = [v[1] for i,v in enumerate(c.pkg_extras) if v[0] == 'UKLP']
-            if is_uklp and is_uklp[0] == 'True':
-                stream = stream_filters.harvest_filter(stream, c.pkg)
+        return stream_filters.timed_filter('package read', stream,
+            lambda stream: self._package_read_filter(stream, c.pkg, c.pkg_extras))
 
-            # Add dataset id to the UI
-            stream = stream_filters.package_id_filter(stream, c.pkg)
+    def _package_read_filter(self, stream, pkg, pkg_extras):
+        for key, value in pkg_extras:
+            if key == 'UKLP':
+                if value == 'True':
+                    stream = stream_filters.harvest_filter(stream, pkg)
+                break
+
+        # Add dataset id to the UI
+        stream = stream_filters.package_id_filter(stream, pkg)
         return stream
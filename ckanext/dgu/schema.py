@@ -1,8 +1,17 @@
+import os
 import re
+import string
 import time
 import datetime
+import hashlib
+import logging
 
 from ckanext.dgu.drupalclient import DrupalClient, DrupalKeyError
+from ckanext.dgu.cache import SqliteCache, CACHE_MISS, memoize
+from ckanext.dgu.geo_coverage import GeoCoverageType, region_options, \
+     region_groupings, region_abbreviations
+
+log = logging.getLogger(__name__)
 
 government_depts_raw = """
 Attorney General's Office
@@ -128,51 +137,77 @@ temporal_granularity_options = ['year', 'quarter', 'month', 'week', 'day', 'hour
 
 category_options = ['Agriculture and Environment', 'Business and Energy', 'Children, Education and Skills', 'Crime and Justice', 'Economy', 'Government', 'Health and Social Care', 'Labour Market', 'People and Places', 'Population', 'Travel and Transport', 'Equality and Diversity', 'Migration']
 
-region_options = ('England', 'Scotland', 'Wales', 'Northern Ireland', 'Overseas', 'Global')
-
-region_groupings = {'United Kingdom':['England', 'Scotland', 'Wales', 'Northern Ireland'], 'Great Britain':['England', 'Scotland', 'Wales']}
-
-region_abbreviations = {'UK':'United Kingdom', 'N. Ireland':'Northern Ireland', 'GB':'Great Britain'}
-
 tag_pool = ['accident', 'road', 'traffic', 'health', 'illness', 'disease', 'population', 'school', 'accommodation', 'children', 'married', 'emissions', 'benefit', 'alcohol', 'deaths', 'mortality', 'disability', 'unemployment', 'employment', 'armed forces', 'asylum', 'cancer', 'births', 'burglary', 'child', 'tax credit', 'criminal damage', 'drug', 'earnings', 'education', 'economic', 'fire', 'fraud', 'forgery', 'fuel', 'green', 'greenhouse gas', 'homeless', 'hospital', 'waiting list', 'housing', 'care', 'income', 'census', 'mental health', 'disablement allowance', 'jobseekers allowance', 'national curriculum', 'older people', 'living environment', 'higher education', 'living environment', 'school absence', 'local authority', 'carbon dioxide', 'energy', 'teachers', 'fostering', 'tide', 'gas', 'electricity', 'transport', 'veterinary', 'fishing', 'export', 'fisheries', 'pest', 'recycling', 'waste', 'crime', 'anti-social behaviour', 'police', 'refugee', 'identity card', 'immigration', 'planning', 'communities', 'lettings', 'finance', 'ethnicity', 'trading standards', 'trade', 'business', 'child protection', 'jobs', 'weather', 'climate', 'rainfall', 'cloud', 'snow', 'humidity', 'pressure', 'precipitation', 'sunshine', 'frost', 'temperature', 'fish']
 
 tag_search_fields = ['name', 'title', 'notes', 'categories', 'agency']
 
 tag_words_to_join = ['ordnance survey', 'environmental protection', 'water conservation', 'water resources', 'water quality', 'climate and weather', 'nature conservation', 'waste management', 'waste policies and regulation', 'air quality', 'tariff codes', 'life stages', 'dry days']
 
+_name_allowed_chars = string.ascii_letters + string.digits + '-_'
+_name_str_table = string.maketrans(' /', '_-')
+_name_str_delete_chars = ''.join([chr(i) for i in range(256) \
+                                  if chr(i) not in _name_allowed_chars + ' /'])
+_name_unicode_table = {ord(u' '): u'_', ord(u':'): u'_-', ord(u'/'): u'-'}
+_name_disallowed_re = re.compile('[^a-zA-Z0-9-_]')
+
+@memoize(max_size=10000)
 def name_munge(name):
-    # convert spaces to underscores
-    name = re.sub(' ', '_', name).lower()        
-    # convert symbols to dashes
-    name = re.sub('[:]', '_-', name)
-    name = re.sub('[/]', '-', name)
-    # take out not-allowed characters
-    name = re.sub('[^a-zA-Z0-9-_]', '', name)
-    # remove double underscores
-    name = re.sub('__', '_', name)
-    # fix up things like "_-_"
-    name = re.sub("_-_", "-", name)
+    name = name.lower()
+    # convert spaces to underscores, symbols to dashes and take out
+    # not-allowed characters
+    if isinstance(name, str):
+        name = name.replace(':', '_-').translate(_name_str_table,
+                                                 _name_str_delete_chars)
+    else:
+        name = _name_disallowed_re.sub(u'', name.translate(_name_unicode_table))
+    # remove double underscores and fix up things like "_-_"
+    name = name.replace('__', '_').replace('_-_', '-')
     return name[:100]
 
+@memoize(max_size=10000)
 def tag_munge(name):
     '''munges a name to be suitable for a tag'''
     return name_munge(name).replace('_', '-').replace('--', '-').replace("_-_", "-")
 
 class TagSuggester(object):
+    '''Suggests tags for a package from the keywords in tag_pool that
+    appear in its text fields.'''
+    _keyword_tags = None # [(keyword, munged tag)], worked out once
+
+    @classmethod
+    def _get_keyword_tags(cls):
+        if cls._keyword_tags is None:
+            keyword_tags = []
+            for keyword in tag_pool:
+                if keyword not in [k for k, tag in keyword_tags]:
+                    keyword_tags.append((keyword, tag_munge(keyword)))
+            cls._keyword_tags = keyword_tags
+        return cls._keyword_tags
+
     @classmethod
     def suggest_tags(cls, pkg_dict):
-        tags = set()
+        texts = []
         for field_name in tag_search_fields:
             if pkg_dict.has_key(field_name):
                 text = pkg_dict[field_name]
             else:
-                if pkg_dict.has_key('extras'):
-                    text = pkg_dict['extras'].get(field_name)
+                text = (pkg_dict.get('extras') or {}).get(field_name)
             if text and isinstance(text, (str, unicode)):
-                text_lower = text.lower()
-                for keyword in tag_pool:
-                    if keyword in text_lower:
-                        tags.add(tag_munge(keyword))
+                texts.append(text.lower())
+        if not texts:
+            return set()
+        # Search all the fields in one go. Keywords do not contain the
+        # separator, so cannot match across fields.
+        try:
+            texts = [u'\0'.join(texts)]
+        except UnicodeDecodeError:
+            # a non-ascii str field cannot be joined to unicode ones
+            pass
+        tags = set()
+        for text in texts:
+            for keyword, tag in cls._get_keyword_tags():
+                if keyword in text:
+                    tags.add(tag)
         return tags
 
 suggest_tags = TagSuggester.suggest_tags
@@ -188,76 +223,6 @@ def tags_parse(tags_str):
     return [tag_munge(tag_name) for tag_name in tag_list]
 
     
-class GeoCoverageType(object):
-    @staticmethod
-    def get_instance():
-        if not hasattr(GeoCoverageType, 'instance'):
-            GeoCoverageType.instance = GeoCoverageType.Singleton()
-        return GeoCoverageType.instance
-
-    class Singleton(object):
-        def __init__(self):
-            regions_str = region_options
-            self.groupings = region_groupings
-            self.regions = [(region_str, GeoCoverageType.munge(region_str)) for region_str in regions_str]
-            self.regions_munged = [GeoCoverageType.munge(region_str) for region_str in regions_str]
-
-        def munged_regions_to_printable_region_names(self, munged_regions):
-            incl_regions = []
-            for region_str, region_munged in self.regions:
-                if region_munged in munged_regions:
-                    incl_regions.append(region_str)
-            for grouping_str, regions_str in self.groupings.items():
-                all_regions_in = True
-                for region_str in regions_str:
-                    if region_str not in incl_regions:
-                        all_regions_in = False
-                        break
-                if all_regions_in:
-                    for region_str in regions_str:
-                        incl_regions.remove(region_str)
-                    incl_regions.append('%s (%s)' % (grouping_str, ', '.join(regions_str)))
-            return ', '.join(incl_regions)
-
-        def str_to_db(self, regions_str):
-            for abbrev, region in region_abbreviations.items():
-                regions_str = regions_str.replace(abbrev, region)
-            for grouping, regions in region_groupings.items():
-                regions_str = regions_str.replace(grouping, ' '.join(regions))
-            regions_munged = []
-            for region, region_munged in self.regions:
-                if region in regions_str:
-                    regions_munged.append(region_munged)
-            return self.form_to_db(regions_munged)
-
-        def form_to_db(self, form_regions):
-            assert isinstance(form_regions, list)
-            coded_regions = u''
-            for region_str, region_munged in self.regions:
-                coded_regions += '1' if region_munged in form_regions else '0'
-            regions_str = self.munged_regions_to_printable_region_names(form_regions)
-            return '%s: %s' % (coded_regions, regions_str)
-
-        def db_to_form(self, form_regions):
-            '''
-            @param form_regions e.g. 110000: England, Scotland
-            @return e.g. ["england", "scotland"]
-            '''
-            regions = []
-            if len(form_regions)>len(self.regions):
-                for i, region in enumerate(self.regions):
-                    region_str, region_munged = region
-                    if form_regions[i] == '1':
-                        regions.append(region_munged)
-            return regions
-
-    @staticmethod
-    def munge(region):
-        return region.lower().replace(' ', '_')
-
-    def __getattr__(self, name):
-        return getattr(self.instance, name)
-
 def canonise_organisation_name(org_name):
     '''Takes a variant on an organisation name and returns the canonical
     name, which should match what is on DGU.'''
@@ -267,14 +232,74 @@ def canonise_organisation_name(org_name):
     return canonised_name
 
 
+ORGANISATION_CACHE_DEFAULT_PATH = os.path.abspath(os.path.expanduser('~/dgu_organisation_cache.db'))
+
+class OrganisationCache(object):
+    '''Organisation lookups {dept_or_agency:('name', 'id')} (or None
+    if not found), saved to an SQLite file so that they persist between
+    importer runs. Lookups expire after a time, so they are revalidated
+    against Drupal (sooner for ones not found).
+
+    The ids are only valid for the Drupal they came from, so the lookups
+    in the file are kept separately for each drupal_url (e.g. the XML-RPC
+    URL).'''
+    def __init__(self, filepath=ORGANISATION_CACHE_DEFAULT_PATH,
+                 drupal_url=None,
+                 ttl=7*24*60*60, negative_ttl=24*60*60, refresh=False):
+        self._store = SqliteCache(filepath, ttl=ttl, max_size=100000)
+        # the URL may contain a password, so only a hash of it is stored
+        self._key_prefix = '%s:' % \
+                           hashlib.md5(drupal_url or '').hexdigest()[:16]
+        self._negative_ttl = negative_ttl
+        self._cache = {}
+        if refresh:
+            log.info('Clearing organisation cache: %s', filepath)
+            self._store.clear()
+
+    def _store_key(self, dept_or_agency):
+        if isinstance(dept_or_agency, unicode):
+            dept_or_agency = dept_or_agency.encode('utf8')
+        return self._key_prefix + dept_or_agency
+
+    def __contains__(self, dept_or_agency):
+        if dept_or_agency in self._cache:
+            return True
+        if dept_or_agency:
+            organisation = self._store.get(self._store_key(dept_or_agency))
+            if organisation is not CACHE_MISS:
+                self._cache[dept_or_agency] = organisation
+                return True
+        return False
+
+    def __getitem__(self, dept_or_agency):
+        if dept_or_agency not in self:
+            raise KeyError(dept_or_agency)
+        return self._cache[dept_or_agency]
+
+    def __setitem__(self, dept_or_agency, organisation):
+        self._cache[dept_or_agency] = organisation
+        if dept_or_agency:
+            ttl = None if organisation else self._negative_ttl
+            self._store.set(self._store_key(dept_or_agency), organisation,
+                            ttl=ttl)
+
 class DrupalHelper(object):
     '''A wrapper around the DrupalClient, providing organisation lookup caching
     and handy utility functions related to the schema.
     Note: for test purposes, the functions must be classmethods.
-          But if you run __init__ then you can use the cached versions.'''
-    def __init__(self, xmlrpc_settings=None):
+          But if you run __init__ then you can use the cached versions.
+    If you supply an organisation_cache_filepath then lookups are kept in
+    that file between runs (see OrganisationCache).'''
+    def __init__(self, xmlrpc_settings=None, organisation_cache_filepath=None,
+                 refresh_organisation_cache=False):
         self._drupal_client_cache = DrupalClient(xmlrpc_settings)
-        self._organisation_cache = {} # {dept_or_agency:('name', 'id')}
+        if organisation_cache_filepath:
+            self._organisation_cache = OrganisationCache(
+                organisation_cache_filepath,
+                drupal_url=self._drupal_client_cache.xmlrpc_url,
+                refresh=refresh_organisation_cache)
+        else:
+            self._organisation_cache = {} # {dept_or_agency:('name', 'id')}
 
     def cached_department_or_agency_to_organisation(self, dept_or_agency, include_id=True):
         return self.department_or_agency_to_organisation(
@@ -284,6 +309,41 @@ class DrupalHelper(object):
             drupal_client_cache=self._drupal_client_cache,
             )
         
+    def warm_organisation_cache(self, depts_or_agencies):
+        '''Looks up all the given department/agency names that are not
+        already cached, in as few Drupal requests as possible, so that
+        cached_department_or_agency_to_organisation does not need to call
+        Drupal for them.'''
+        organisation_cache = self._organisation_cache
+        drupal_client = self._drupal_client_cache
+        names = [name for name in set(depts_or_agencies) \
+                 if name not in organisation_cache]
+        if not names:
+            return
+        log.info('Looking up %i organisations in Drupal', len(names))
+        organisation_ids = drupal_client.match_organisations(names)
+        # try again with the canonical version of names not matched
+        unmatched_names = [name for name, id in organisation_ids.items() \
+                           if not id]
+        canonised_names = dict((name, canonise_organisation_name(name)) \
+                               for name in unmatched_names)
+        canonised_ids = drupal_client.match_organisations(canonised_names.values())
+        for name in unmatched_names:
+            organisation_ids[name] = canonised_ids[canonised_names[name]]
+        organisation_names = drupal_client.get_organisation_names(
+            set(id for id in organisation_ids.values() if id))
+        for name, organisation_id in organisation_ids.items():
+            organisation_name = organisation_names.get(organisation_id)
+            if organisation_id and organisation_name:
+                organisation_cache[name] = (organisation_name, organisation_id)
+                # importers look up the organisation's own name next, and
+                # Drupal matches that name to the same organisation
+                if organisation_name not in organisation_cache:
+                    organisation_cache[organisation_name] = \
+                        (organisation_name, organisation_id)
+            else:
+                organisation_cache[name] = None
+
     @classmethod
     def department_or_agency_to_organisation(cls, dept_or_agency,
                                              include_id=True,
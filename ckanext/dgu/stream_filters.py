@@ -1,35 +1,88 @@
 import re
+import time
+import logging
 
+from genshi.core import Stream
 from genshi.filters.transform import Transformer
 from genshi.input import HTML
 
 from ckan.model import Session
 from ckanext.harvest.model import HarvestObject
 import ckanext.dgu.forms.html as html
+from ckanext.dgu.cache import memoize
+
+log = logging.getLogger(__name__)
+
+# The XPaths are parsed once. Each filter appends to a copy.
+resources_table = Transformer('body//div[@class="resources subsection"]/table')
+property_list = Transformer('body//ul[@class="property-list"]')
 
 def harvest_filter(stream, pkg):
 
     harvest_object_id = pkg.extras.get('harvest_object_id')
     if harvest_object_id:
+        stream = stream | resources_table.append(
+            _gemini_fragment((harvest_object_id, len(pkg.resources) > 0)))
 
-        data = {'id': harvest_object_id}
-        html_code = html.GEMINI_CODE
-        if len(pkg.resources) == 0:
-            # If no resources, the table has only two columns
-            html_code = html_code.replace('<td></td>','')
+    return stream
 
-        stream = stream | Transformer('body//div[@class="resources subsection"]/table')\
-            .append(HTML(html_code % data))
+def package_id_filter(stream, pkg):
+
+    stream = stream | property_list.append(_dataset_id_fragment(pkg.id))
 
     return stream
 
-def package_id_filter(stream, pkg):
+# The HTML fragments are parsed once for each package and the events
+# kept, since a Stream of a list can be iterated again for each render.
+@memoize(max_size=1000)
+def _gemini_fragment(key):
+    harvest_object_id, has_resources = key
+    data = {'id': harvest_object_id}
+    html_code = html.GEMINI_CODE
+    if not has_resources:
+        # If no resources, the table has only two columns
+        html_code = html_code.replace('<td></td>','')
+    return Stream(list(HTML(html_code % data)))
 
-    data = {'id': pkg.id}
-    html_code = html.DATASET_ID_CODE
+@memoize(max_size=1000)
+def _dataset_id_fragment(pkg_id):
+    data = {'id': pkg_id}
+    return Stream(list(HTML(html.DATASET_ID_CODE % data)))
 
-    stream = stream | Transformer('body//ul[@class="property-list"]')\
-        .append(HTML(html_code % data))
+def timed_filter(name, stream, filter_func):
+    '''Applies filter_func to the stream and, if debug logging is on, logs
+    the time spent in the filter once the page has been rendered.
 
-    return stream
+    Genshi filters do their work lazily, as the page is rendered, so the
+    time is measured around each event taken from the filtered stream,
+    less the time spent generating the events of the unfiltered stream
+    (i.e. the template itself).
+    '''
+    if not log.isEnabledFor(logging.DEBUG):
+        return filter_func(stream)
+    timings = {'input': 0.0, 'output': 0.0}
+    def log_timing():
+        log.debug('%s filter took %.2fms', name,
+                  (timings['output'] - timings['input']) * 1000)
+    start = time.time()
+    filtered = filter_func(Stream(_timed_events(stream, timings, 'input'),
+                                  stream.serializer))
+    timings['output'] += time.time() - start
+    return Stream(_timed_events(filtered, timings, 'output', log_timing),
+                  filtered.serializer)
 
+def _timed_events(events, timings, key, on_end=None):
+    '''Yields the events, adding the time taken to get each one to
+    timings[key].'''
+    events = iter(events)
+    while True:
+        start = time.time()
+        try:
+            event = events.next()
+        except StopIteration:
+            timings[key] += time.time() - start
+            if on_end:
+                on_end()
+            return
+        timings[key] += time.time() - start
+        yield event
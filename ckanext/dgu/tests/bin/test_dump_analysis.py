@@ -0,0 +1,242 @@
+import os
+import gzip
+import datetime
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from nose.tools import assert_equal, assert_raises
+
+from ckanext.dgu.bin.dump_analysis import iter_json_array, DumpAnalysis, \
+     DumpAnalysisOptions, PackageBins, analyse_dump, analyse_dumps, \
+     analysis_cache_filepath, AnalysisHistory, TxtAnalysisFile, open_history
+
+packages = [
+    {'name': 'ons1', 'state': 'active', 'url': None, 'license_id': 'ukcrown',
+     'resources': [{'format': 'CSV'}, {'format': ' csv'}, {'format': ''}],
+     'extras': {'import_source': 'ONS-ons_data_7_days_to_2010-06-23',
+                'published_by': 'Office for National Statistics [11]'}},
+    {'name': 'ons2', 'state': 'active', 'url': None,
+     'extras': {'import_source': 'ONS-ons_data_7_days_to_2010-06-24',
+                'published_by': None}},
+    {'name': 'uklp1', 'state': 'active', 'url': None, 'license_id': 'ukcrown',
+     'resources': [{'format': 'XLS'}],
+     'extras': {'UKLP': 'True'}},
+    {'name': 'deleted1', 'state': 'deleted', 'url': None,
+     'extras': {'import_source': 'ONS-ons_data_7_days_to_2010-06-24'}},
+    {'name': 'manual1', 'state_id': 1, 'url': 'http://site.com/',
+     'extras': {}},
+    ]
+
+class TestIterJsonArray:
+    def test_items(self):
+        json_str = json.dumps(packages, indent=2) + '\n'
+        for chunk_size in (1, 2, 7, 100, 64 * 1024):
+            items = list(iter_json_array(StringIO(json_str), chunk_size))
+            assert_equal(items, packages)
+
+    def test_numbers_split_across_chunks(self):
+        items = list(iter_json_array(StringIO('[12345, 678,9]'), 2))
+        assert_equal(items, [12345, 678, 9])
+        json_str = '[2.5, 123456.789, 1e6, -1.5E-3, 7]'
+        for chunk_size in range(1, len(json_str) + 1):
+            items = list(iter_json_array(StringIO(json_str), chunk_size))
+            assert_equal(items, [2.5, 123456.789, 1e6, -1.5E-3, 7])
+
+    def test_empty(self):
+        assert_equal(list(iter_json_array(StringIO(' [ ] '), 1)), [])
+
+    def test_invalid(self):
+        for json_str in ('', '{}', '[1, 2', '[1 2]', '[1, ]'):
+            assert_raises(ValueError, list,
+                          iter_json_array(StringIO(json_str), 3))
+
+class TestPackageBins:
+    def test_examples(self):
+        bins = PackageBins(max_examples=3)
+        for i in range(100):
+            bins.add('even' if i % 2 == 0 else 'odd', 'pkg%i' % i)
+        bins.add('one', 'pkg100')
+        items = bins.items()
+        assert_equal([(bin, count) for bin, count, examples in items],
+                     [('even', 50), ('odd', 50), ('one', 1)])
+        examples = dict((bin, examples) for bin, count, examples in items)
+        assert_equal(len(examples['even']), 3)
+        assert_equal(len(set(examples['even'])), 3)
+        for pkg_name in examples['even']:
+            assert int(pkg_name[3:]) % 2 == 0, pkg_name
+        assert_equal(examples['one'], ['pkg100'])
+
+    def test_no_examples(self):
+        bins = PackageBins(max_examples=0)
+        bins.add('a', 'pkg1')
+        bins.add('a', 'pkg2')
+        assert_equal(bins.items(), [('a', 2, [])])
+
+class TestDumpAnalysis:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.dump_filepath = self.write_dump('2011-06-01', packages)
+
+    def write_dump(self, date_str, pkgs):
+        dump_filepath = os.path.join(self.tmp_dir,
+            'data.gov.uk-ckan-meta-data-%s.json.gz' % date_str)
+        f = gzip.open(dump_filepath, 'wb')
+        try:
+            f.write(json.dumps(pkgs))
+        finally:
+            f.close()
+        return dump_filepath
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_analysis(self):
+        options = DumpAnalysisOptions(analyse_by_source=True,
+                                      analyse_ons_by_published_by=True)
+        analysis = DumpAnalysis(self.dump_filepath, options)
+        result = dict(analysis.analysis_dict)
+        assert_equal(result, {
+            'Total active and deleted packages': 5,
+            'Total active packages': 4,
+            'Packages by source: ONS feed': 2,
+            'Packages by source: UKLP': 1,
+            'Packages by source: Manual creation using web form': 1,
+            'ONS packages by published_by: Office for National Statistics': 1,
+            'ONS packages by published_by: No value': 1,
+            })
+        assert_equal(format(analysis.date), '2011-06-01')
+
+    def test_license_and_resource_format(self):
+        options = DumpAnalysisOptions(analyse_by_license=True,
+                                      analyse_by_resource_format=True)
+        analysis = DumpAnalysis(self.dump_filepath, options)
+        assert_equal(analysis.analysis_dict.items(), [
+            ('Total active and deleted packages', 5),
+            ('Total active packages', 4),
+            ('Packages by license: No value', 2),
+            ('Packages by license: ukcrown', 2),
+            ('Resources by format: CSV', 2),
+            ('Resources by format: No value', 1),
+            ('Resources by format: XLS', 1),
+            ])
+
+    def test_analyse_dump_cached(self):
+        options = DumpAnalysisOptions(analyse_by_source=True)
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        date, analysis_dict = analyse_dump(self.dump_filepath, options,
+                                           cache_dir)
+        assert os.path.exists(analysis_cache_filepath(self.dump_filepath,
+                                                      cache_dir))
+        # nothing is added amongst the dumps
+        assert_equal(sorted(os.listdir(self.tmp_dir)),
+                     sorted([os.path.basename(self.dump_filepath), 'cache']))
+        # the cached result is the same
+        assert_equal(analyse_dump(self.dump_filepath, options, cache_dir),
+                     (date, analysis_dict))
+
+        # check the cache is used, by changing the dump without changing
+        # its size or modification time
+        stat = os.stat(self.dump_filepath)
+        f = open(self.dump_filepath, 'r+b')
+        try:
+            f.write('x')
+        finally:
+            f.close()
+        os.utime(self.dump_filepath, (stat.st_atime, stat.st_mtime))
+        assert_equal(analyse_dump(self.dump_filepath, options,
+                                  cache_dir)[1].items(),
+                     analysis_dict.items())
+
+        # different analyses are not in the cache
+        options = DumpAnalysisOptions(analyse_by_license=True)
+        assert_raises(IOError, analyse_dump, self.dump_filepath, options,
+                      cache_dir)
+
+    def test_analyse_dumps(self):
+        dump_filepath_2 = self.write_dump('2011-06-02', packages[:1])
+        options = DumpAnalysisOptions(analyse_by_source=True)
+        for processes in (1, 2):
+            results = analyse_dumps([self.dump_filepath, dump_filepath_2],
+                                    options, processes=processes)
+            assert_equal([(dump_filepath, format(date),
+                           analysis_dict['Total active packages']) \
+                          for dump_filepath, date, analysis_dict in results],
+                         [(self.dump_filepath, '2011-06-01', 4),
+                          (dump_filepath_2, '2011-06-02', 1)])
+
+class TestAnalysisHistory:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'analysis.history.db')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_add_analysis(self):
+        history = AnalysisHistory(self.filepath)
+        history.add_analysis(datetime.date(2011, 6, 2), {'a': 2})
+        history.add_analysis(datetime.date(2011, 6, 1), {'a': 1})
+        # a new column
+        history.add_analysis(datetime.date(2011, 6, 3), {'a': 3, 'b': 30})
+        # replaces the existing analysis for the date
+        history.add_analysis(datetime.date(2011, 6, 2), {'b': 20})
+        history.close()
+
+        history = AnalysisHistory(self.filepath)
+        assert_equal(history.get_columns(), ['a', 'b'])
+        assert_equal(len(history), 3)
+        assert_equal([(format(date), analysis.items()) for date, analysis \
+                      in history.get_data_by_date_sorted()],
+                     [('2011-06-01', [('a', 1)]),
+                      ('2011-06-02', [('b', 20)]),
+                      ('2011-06-03', [('a', 3), ('b', 30)])])
+
+    def test_materialise(self):
+        history = AnalysisHistory(self.filepath)
+        history.add_analysis(datetime.date(2011, 6, 1), {'a': 1})
+        history.add_analysis(datetime.date(2011, 6, 2), {'a': 2, 'b': 20})
+        txt_filepath = os.path.join(self.tmp_dir, 'analysis.txt')
+        history.materialise(TxtAnalysisFile(txt_filepath, 'Run info\n'))
+        assert_equal(open(txt_filepath).read(),
+                     "Run info\n\n"
+                     "2011-06-01 : {'a': 1}\n"
+                     "2011-06-02 : {'a': 2, 'b': 20}\n")
+
+    def test_append_txt(self):
+        txt_filepath = os.path.join(self.tmp_dir, 'analysis.txt')
+        run_info = "Run info\nDate last updated: '2011-06-01'\n"
+        assert_equal(TxtAnalysisFile.append_analysis(
+            txt_filepath, run_info, datetime.date(2011, 6, 1), {'a': 1}), False)
+        history = AnalysisHistory(self.filepath)
+        history.add_analysis(datetime.date(2011, 6, 1), {'a': 1})
+        history.materialise(TxtAnalysisFile(txt_filepath, run_info))
+
+        run_info = "Run info\nDate last updated: '2011-06-02'\n"
+        assert_equal(TxtAnalysisFile.append_analysis(
+            txt_filepath, run_info, datetime.date(2011, 6, 2), {'a': 2}), True)
+        # not after the last date
+        assert_equal(TxtAnalysisFile.append_analysis(
+            txt_filepath, run_info, datetime.date(2011, 6, 2), {'a': 3}), False)
+        assert_equal(open(txt_filepath).read(),
+                     "Run info\nDate last updated: '2011-06-02'\n\n"
+                     "2011-06-01 : {'a': 1}\n"
+                     "2011-06-02 : {'a': 2}\n")
+
+    def test_open_history_from_txt(self):
+        txt_filepath = os.path.join(self.tmp_dir, 'analysis.txt')
+        f = open(txt_filepath, 'w')
+        try:
+            f.write("Run info\n\n"
+                    "2011-06-01 : {u'a': 1}\n"
+                    "2011-06-02 : {'a': 2, 'b': 20}\n")
+        finally:
+            f.close()
+        history = open_history(self.filepath,
+                               [TxtAnalysisFile(txt_filepath, 'Run info\n')])
+        assert_equal(history.get_columns(), ['a', 'b'])
+        assert_equal([(format(date), analysis.items()) for date, analysis \
+                      in history.get_data_by_date_sorted()],
+                     [('2011-06-01', [('a', 1)]),
+                      ('2011-06-02', [('a', 2), ('b', 20)])])
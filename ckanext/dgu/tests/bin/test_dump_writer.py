@@ -0,0 +1,142 @@
+import os
+import csv
+import copy
+import shutil
+import zipfile
+import tempfile
+from StringIO import StringIO
+
+from nose.tools import assert_equal
+
+import ckan.model as model
+from ckan.lib.helpers import json
+from ckan.lib.dumper import SimpleDumper
+from ckan.lib.create_test_data import CreateTestData
+from ckanext.dgu.bin.dump_writer import ZipEntryWriter, JsonDumpWriter, \
+     CsvDumpWriter, dump_packages, iter_package_dicts
+
+def get_pkg_dicts():
+    return [
+        {'name': u'pkg1', 'title': u'Caf\xe9 data', 'tags': ['a', 'b'],
+         'extras': {'published_by': u'Department [1]'},
+         'resources': [{'url': 'http://site.com/1.csv', 'format': 'CSV',
+                        'description': 'Data'}]},
+        {'name': u'pkg2', 'title': u'Second', 'tags': [], 'ratings_count': 0,
+         'extras': {}, 'resources': []},
+        ]
+
+class MockPackage(object):
+    '''Gives SimpleDumper a package dict, as a Package would.'''
+    def __init__(self, pkg_dict):
+        self.pkg_dict = pkg_dict
+
+    def as_dict(self):
+        return copy.deepcopy(self.pkg_dict)
+
+class TestZipEntryWriter:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'test.zip')
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write(self):
+        zip_file = zipfile.ZipFile(self.filepath, 'w', zipfile.ZIP_DEFLATED)
+        entry = ZipEntryWriter(zip_file, 'test.txt')
+        for i in range(1000):
+            entry.write('line %i\n' % i)
+        entry.write(u'caf\xe9')
+        entry.close()
+        zip_file.close()
+
+        zip_file = zipfile.ZipFile(self.filepath)
+        assert_equal(zip_file.testzip(), None)
+        assert_equal(zip_file.namelist(), ['test.txt'])
+        assert_equal(zip_file.read('test.txt'),
+                     ''.join(['line %i\n' % i for i in range(1000)]) + \
+                     'caf\xc3\xa9')
+
+class TestDumpWriters:
+    def test_json(self):
+        for num_packages in (0, 1, 2):
+            pkg_dicts = get_pkg_dicts()[:num_packages]
+            out = StringIO()
+            writer = JsonDumpWriter(out)
+            for pkg_dict in pkg_dicts:
+                writer.add(pkg_dict)
+            writer.close()
+            # the same as json.dump(pkgs, indent=4) in SimpleDumper
+            assert_equal(out.getvalue(), json.dumps(pkg_dicts, indent=4))
+
+    def test_csv(self):
+        out = StringIO()
+        writer = CsvDumpWriter(out)
+        for pkg_dict in get_pkg_dicts():
+            writer.add(pkg_dict)
+        writer.close()
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        assert_equal(len(rows), 3)
+        rows = [dict(zip(rows[0], row)) for row in rows[1:]]
+        assert_equal(rows[0]['title'], 'Caf\xc3\xa9 data')
+        assert_equal(rows[0]['tags'], 'a b')
+        assert_equal(rows[0]['published_by'], 'Department [1]')
+        assert_equal(rows[0]['resource-0-format'], 'CSV')
+        assert_equal(rows[0]['ratings_count'], '')
+        assert_equal(rows[1]['resource-0-format'], '')
+        assert_equal(rows[1]['ratings_count'], '0')
+
+    def test_csv_same_as_simple_dumper(self):
+        pkg_dicts = get_pkg_dicts() + [
+            {'name': u'pkg3', 'notes': u'Line 1\nLine "2"', 'tags': ['c'],
+             'extras': {'new_column': u'x'}, 'ratings_average': 2.5,
+             'resources': [{'url': 'http://site.com/3', 'format': '',
+                            'description': 'a, b'}] * 2},
+            get_pkg_dicts()[1]]
+        for num_packages in range(len(pkg_dicts) + 1):
+            out = StringIO()
+            writer = CsvDumpWriter(out)
+            for pkg_dict in copy.deepcopy(pkg_dicts[:num_packages]):
+                writer.add(pkg_dict)
+            writer.close()
+            expected_out = StringIO()
+            SimpleDumper().dump_csv(expected_out, [MockPackage(pkg_dict) \
+                for pkg_dict in pkg_dicts[:num_packages]])
+            assert_equal(out.getvalue(), expected_out.getvalue())
+
+class TestIterPackageDicts:
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def test_iter_package_dicts(self):
+        expected_pkg_dicts = [pkg.as_dict() for pkg in \
+            model.Session.query(model.Package).order_by(model.Package.id)]
+        model.Session.remove()
+        assert expected_pkg_dicts
+        for batch_size in (1, 2, 100):
+            pkg_dicts = list(iter_package_dicts(batch_size=batch_size))
+            assert_equal(pkg_dicts, expected_pkg_dicts)
+
+class TestDumpPackages:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dump_packages(self):
+        json_filepath = os.path.join(self.tmp_dir, 'dump.json.zip')
+        csv_filepath = os.path.join(self.tmp_dir, 'dump.csv.zip')
+        num_packages = dump_packages(iter(get_pkg_dicts()),
+                                     json_filepath, csv_filepath,
+                                     'dump.json', 'dump.csv')
+        assert_equal(num_packages, 2)
+        json_str = zipfile.ZipFile(json_filepath).read('dump.json')
+        assert_equal(json.loads(json_str), get_pkg_dicts())
+        csv_str = zipfile.ZipFile(csv_filepath).read('dump.csv')
+        assert_equal(len(list(csv.reader(StringIO(csv_str)))), 3)
@@ -1,4 +1,7 @@
+import os
 import re
+import shutil
+import tempfile
 
 from pylons import config
 import webhelpers
@@ -15,11 +18,14 @@ from ckan.tests.functional.api.base import (ApiTestCase,
 import ckan.model as model
 import ckan.authz as authz
 from ckan.lib.helpers import url_for
-from ckan.lib.helpers import json
+from ckan.lib.helpers import json, url_escape
 from ckan.lib.create_test_data import CreateTestData
 
-from ckanext.dgu.forms.formapi import FormController
+from ckanext.dgu.forms.formapi import FormController, etag_matches
+from ckanext.dgu.harvest_queue import HarvestJobQueue
 from ckanext.dgu.tests import WsgiAppCase, MockDrupalCase, strip_organisation_id
+from ckanext.harvest.model import HarvestSource, HarvestJob
+from ckanext.harvest.model import setup as harvest_setup
 from ckanext.dgu.testtools import test_publishers
 
 
@@ -131,6 +137,34 @@ class BaseFormsApiCase(ApiTestCase, WsgiAppCase, CommonFixtureMethods, CheckMeth
         offset = self.offset_package_edit_form(package_ref, **offset_kwargs)
         return self.post(offset, data, status=status)
         
+    def offset_package_batch(self, **kwargs):
+        self.set_drupal_user(kwargs)
+        return self.offset(url_for('/form/package/batch', **kwargs))
+
+    def package_batch_item(self, package_ref=None, **field_args):
+        '''Returns an item for a package batch request, with the form data
+        of the create (or edit) form with the fields set.'''
+        if package_ref:
+            form, return_status = self.get_package_edit_form(package_ref)
+            prefix = 'Package-%s-' % self.package_id_from_ref(package_ref)
+        else:
+            form, return_status = self.get_package_create_form()
+            prefix = 'Package--'
+        for key, field_value in field_args.items():
+            self.set_formfield(form, prefix + key, field_value)
+        item = {'form_data': form.submit_fields()}
+        if package_ref:
+            item['id'] = package_ref
+        return item
+
+    def post_package_batch(self, items, status=[200]):
+        data = {
+            'items': items,
+            'log_message': 'Unit-testing the Forms API...',
+            'author': 'automated test suite',
+        }
+        return self.post(self.offset_package_batch(), data, status=status)
+
     def set_formfield(self, form, field_name, field_value):
         form[field_name] = field_value
 
@@ -223,6 +257,250 @@ class FormsApiTestCase(BaseFormsApiCase):
         field_name = 'Package-%s-name' % (package.id)
         self.assert_formfield(form, field_name, package.name)
 
+    def test_get_package_create_form_not_modified(self):
+        offset = self.offset_package_create_form()
+        res = self.app.get(offset, status=200, extra_environ=self.extra_environ)
+        etag = self.get_headers(res)['ETag']
+        res = self.app.get(offset, status=304, headers={'If-None-Match': etag},
+                           extra_environ=self.extra_environ)
+        assert not res.body
+        res = self.app.get(offset, status=200, headers={'If-None-Match': '"other"'},
+                           extra_environ=self.extra_environ)
+        self.assert_header(res, 'ETag', etag)
+
+    def test_get_package_edit_form_etag_changes(self):
+        package = self.get_package_by_name(self.package_name)
+        offset = self.offset_package_edit_form(package.id)
+        res = self.app.get(offset, status=200, extra_environ=self.extra_environ)
+        etag = self.get_headers(res)['ETag']
+        self.post_package_edit_form(package.id, notes=u'New notes')
+        res = self.app.get(offset, status=200, headers={'If-None-Match': etag},
+                           extra_environ=self.extra_environ)
+        assert etag != self.get_headers(res)['ETag']
+        assert 'New notes' in res.body, res.body
+
+    def test_package_batch(self):
+        items = [self.package_batch_item(name=self.package_name_alt, title=u'Alt'),
+                 self.package_batch_item(name=self.package_name_alt2, title=u'Alt2'),
+                 self.package_batch_item(self.package_ref_from_name(self.package_name),
+                                         title=u'Batch edited')]
+        res = self.post_package_batch(items)
+        results = json.loads(res.body)['results']
+        assert_equal([result['status'] for result in results], [201, 201, 200])
+        assert_equal(results[0]['name'], self.package_name_alt)
+        assert results[0]['location'].endswith(self.package_ref_from_name(self.package_name_alt))
+
+        alt = self.get_package_by_name(self.package_name_alt)
+        alt2 = self.get_package_by_name(self.package_name_alt2)
+        package = self.get_package_by_name(self.package_name)
+        assert_equal(package.title, u'Batch edited')
+        # all saved in one revision
+        assert_equal(alt.revision, package.revision)
+        assert_equal(alt2.revision, package.revision)
+
+    def test_package_batch_invalid(self):
+        items = [self.package_batch_item(name=self.package_name_alt),
+                 self.package_batch_item(name=u'invalid name!'),
+                 {'id': u'nonexistent', 'form_data': {}}]
+        res = self.post_package_batch(items, status=[400])
+        results = json.loads(res.body)['results']
+        assert_equal([result['status'] for result in results], [424, 400, 404])
+        assert 'name' in results[1]['errors'], results[1]
+        # nothing is saved
+        assert not self.get_package_by_name(self.package_name_alt)
+
+    def test_package_batch_duplicate_names(self):
+        items = [self.package_batch_item(name=self.package_name_alt),
+                 self.package_batch_item(name=self.package_name_alt2),
+                 self.package_batch_item(name=self.package_name_alt)]
+        res = self.post_package_batch(items, status=[400])
+        results = json.loads(res.body)['results']
+        assert_equal([result['status'] for result in results], [400, 424, 400])
+        assert 'name' in results[0]['errors'], results[0]
+        assert not self.get_package_by_name(self.package_name_alt)
+        assert not self.get_package_by_name(self.package_name_alt2)
+
+    def test_package_batch_duplicate_ids(self):
+        package_ref = self.package_ref_from_name(self.package_name)
+        items = [self.package_batch_item(package_ref, title=u'First'),
+                 self.package_batch_item(name=self.package_name_alt),
+                 self.package_batch_item(package_ref, name=self.package_name_alt2,
+                                         title=u'Second')]
+        res = self.post_package_batch(items, status=[400])
+        results = json.loads(res.body)['results']
+        assert_equal([result['status'] for result in results], [400, 424, 400])
+        assert 'id' in results[0]['errors'], results[0]
+        assert 'id' in results[2]['errors'], results[2]
+        package = self.get_package_by_name(self.package_name)
+        assert package.title not in (u'First', u'Second'), package.title
+        assert not self.get_package_by_name(self.package_name_alt)
+        assert not self.get_package_by_name(self.package_name_alt2)
+
+
+class TestUserPropertiesCache(MockDrupalCase):
+    def teardown(self):
+        FormController._user_properties_cache().clear()
+        if hasattr(FormController, '_drupal_client_cache'):
+            del FormController._drupal_client_cache
+
+    def test_user_properties_cached(self):
+        FormController._user_properties_cache().clear()
+        user = FormController._get_user_properties('62')
+        assert_equal(user['name'], 'testname')
+        assert user['publishers']
+
+        # second time it comes from the cache, not Drupal
+        FormController._drupal_client_cache = None
+        assert_equal(FormController._get_user_properties(62), user)
+
+class TestHarvestSourceList(WsgiAppCase):
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+        harvest_setup()
+        for i in range(5):
+            source = HarvestSource(url=u'http://example.com/csw%i' % i,
+                                   type=u'CSW', description=u'',
+                                   publisher_id=u'pub%i' % (i % 2),
+                                   active=(i != 3))
+            source.save()
+            model.repo.commit_and_remove()
+        cls.source_ids = [source.id for source in \
+                          model.Session.query(HarvestSource).order_by(HarvestSource.created)]
+        for i in range(2):
+            job = HarvestJob(source_id=cls.source_ids[0])
+            job.save()
+            model.repo.commit_and_remove()
+        cls.last_job_id = model.Session.query(HarvestJob) \
+                          .order_by(HarvestJob.created.desc()).first().id
+        sysadmin = model.User.by_name(u'testsysadmin')
+        cls.extra_environ = {'Authorization': str(sysadmin.apikey)}
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def list_sources(self, url='/api/2/rest/harvestsource', **params):
+        res = self.app.get(url, params=params, status=200,
+                           extra_environ=self.extra_environ)
+        return json.loads(res.body)
+
+    def test_list_all_ids(self):
+        assert_equal(sorted(self.list_sources()), sorted(self.source_ids))
+
+    def test_paged(self):
+        res = self.list_sources(limit=2, offset=1)
+        assert_equal(res['count'], 5)
+        assert_equal((res['limit'], res['offset']), (2, 1))
+        assert_equal(res['results'], self.source_ids[1:3])
+        res = self.list_sources(limit=2, offset=2)
+        assert_equal(res['results'], self.source_ids[2:4])
+        res = self.list_sources(limit=2, offset=4)
+        assert_equal(res['results'], self.source_ids[4:])
+
+    def test_filtered(self):
+        res = self.list_sources(publisher_id=u'pub1', active=u'true')
+        assert_equal(res['count'], 1)
+        assert_equal(res['results'], [self.source_ids[1]])
+        res = self.list_sources(url='/api/2/rest/harvestsource/publisher/pub1', limit=10)
+        assert_equal(res['results'], [self.source_ids[1]])
+
+    def test_embedded(self):
+        res = self.list_sources(limit=2, embed=u'true')
+        sources = res['results']
+        assert_equal([source['id'] for source in sources], self.source_ids[:2])
+        assert_equal(sources[0]['url'], u'http://example.com/csw0')
+        assert_equal(sources[0]['last_job']['id'], self.last_job_id)
+        assert_equal(sources[1]['last_job'], None)
+        source = self.list_sources(url='/api/2/rest/harvestsource/%s' % self.source_ids[0])
+        for key in ('id', 'url', 'type', 'description', 'publisher_id', 'active'):
+            assert_equal(sources[0][key], source[key])
+
+    def test_bad_params(self):
+        self.app.get('/api/2/rest/harvestsource', params={'limit': 'x'},
+                     status=400, extra_environ=self.extra_environ)
+
+class TestHarvestingJobQueue(WsgiAppCase):
+    @classmethod
+    def setup_class(cls):
+        CreateTestData.create()
+        harvest_setup()
+        source = HarvestSource(url=u'http://example.com/csw',
+                               type=u'CSW', description=u'')
+        source.save()
+        model.repo.commit_and_remove()
+        cls.source_id = model.Session.query(HarvestSource).one().id
+        sysadmin = model.User.by_name(u'testsysadmin')
+        cls.extra_environ = {'Authorization': str(sysadmin.apikey)}
+
+    @classmethod
+    def teardown_class(cls):
+        model.repo.rebuild_db()
+
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        FormController._harvest_job_queue_ = HarvestJobQueue(
+            os.path.join(self.tmp_dir, 'harvest_queue.db'))
+
+    def teardown(self):
+        del FormController._harvest_job_queue_
+        shutil.rmtree(self.tmp_dir)
+
+    def post(self, offset, data, status):
+        return self.app.post(offset, params='%s=1' % url_escape(json.dumps(data)),
+                             status=status, extra_environ=self.extra_environ)
+
+    def test_create_job_queued(self):
+        res = self.post('/api/2/rest/harvestingjob',
+                        {'source_id': self.source_id}, status=202)
+        job_request = json.loads(res.body)
+        assert_equal(job_request['status'], 'queued')
+        assert_equal(res.header('Location'), job_request['location'])
+        assert_equal(job_request['location'],
+                     '/api/2/rest/harvestingjob/%s' % job_request['id'])
+        # no job is created during the request
+        assert_equal(model.Session.query(HarvestJob).count(), 0)
+
+        res = self.app.get(job_request['location'], status=200,
+                           extra_environ=self.extra_environ)
+        job_request_status = json.loads(res.body)
+        assert_equal(job_request_status['id'], job_request['id'])
+        assert_equal(job_request_status['source_id'], self.source_id)
+        assert_equal(job_request_status['status'], 'queued')
+
+    def test_create_job_unknown_source(self):
+        self.post('/api/2/rest/harvestingjob', {'source_id': u'unknown'},
+                  status=400)
+        assert_equal(FormController._harvest_job_queue().claim(), None)
+
+    def test_view_unknown_job(self):
+        self.app.get('/api/2/rest/harvestingjob/unknown', status=404,
+                     extra_environ=self.extra_environ)
+
+    def test_create_source_queues_job(self):
+        form_data = {'HarvestSource--url': u'http://example.com/waf',
+                     'HarvestSource--type': u'Web Accessible Folder (WAF)',
+                     'HarvestSource--description': u''}
+        res = self.post('/api/2/form/harvestsource/create',
+                        {'form_data': form_data, 'user_id': u'62',
+                         'publisher_id': u'pub1'},
+                        status=201)
+        source = model.Session.query(HarvestSource) \
+                 .filter_by(url=u'http://example.com/waf').one()
+        assert_equal(res.header('Location'),
+                     '/api/2/rest/harvestsource/%s' % source.id)
+        job_request = json.loads(res.body)['harvesting_job']
+        assert_equal(job_request['status'], 'queued')
+        assert_equal(FormController._harvest_job_queue().get(job_request['id'])['source_id'],
+                     source.id)
+
+class TestEtagMatches:
+    def test_etag_matches(self):
+        assert etag_matches('abc', '"abc"')
+        assert etag_matches('abc', '"xyz", W/"abc"')
+        assert etag_matches('abc', '*')
+        assert not etag_matches('abc', '"xyz"')
+        assert not etag_matches('abc', None)
 
 class TestFormsApi1(Api1TestCase, FormsApiTestCase): pass
 
@@ -10,7 +10,8 @@ from ckan.tests import *
 from ckan.tests.pylons_controller import PylonsTestCase
 from ckan.tests.html_check import HtmlCheckMethods
 
-from ckanext.dgu.forms.package_gov3 import get_gov3_fieldset
+from ckanext.dgu.forms.package_gov3 import get_gov3_fieldset, \
+     get_publisher_options, clear_form_cache, publisher_options_cache
 from ckanext.dgu.tests import *
 from ckanext.dgu.testtools import test_publishers
 
@@ -511,3 +512,70 @@ class TestFieldset(PylonsTestCase, WsgiAppCase, HtmlCheckMethods):
         outpkg = model.Package.by_name(pkg_name)
         assert_equal(outpkg.extras['geographic_coverage'], '111001: Global, Great Britain (England, Scotland, Wales)')
 
+    def test_9_fieldset_cache(self):
+        clear_form_cache()
+        fs = get_fieldset()
+        assert get_fieldset() is fs
+        assert get_fieldset(restrict=1) is not fs
+        assert get_fieldset(is_admin=True) is not fs
+        assert get_fieldset(statistics=True) is not fs
+        assert get_fieldset(user_name=u'someone') is fs
+        other_publishers = dict(test_publishers, **{'6': 'Cabinet Office'})
+        fs_other = get_fieldset(publishers=other_publishers)
+        assert fs_other is not fs
+        assert 'Cabinet Office' in fs_other.published_by.render()
+        assert 'Cabinet Office' not in fs.published_by.render()
+
+        # binding does not change the cached fieldset
+        pkg = model.Package.by_name(u'private-fostering-england-2009')
+        assert fs.bind(pkg).title.value
+        assert not get_fieldset().title.value
+
+        clear_form_cache()
+        assert get_fieldset() is not fs
+
+    def test_9_publisher_options(self):
+        clear_form_cache()
+        options = get_publisher_options(test_publishers)
+        assert_equal(options[:2], [('Department for Business, Innovation and Skills', 'Department for Business, Innovation and Skills [5]'),
+                                   ('Department for Education', 'Department for Education [3]')])
+        assert get_publisher_options(dict(test_publishers)) is options
+        assert_equal(get_publisher_options(None), [])
+        # the key is the publishers, not a hash of them
+        assert_equal(publisher_options_cache.get(
+            frozenset(test_publishers.items())), options)
+
+
+class TestExtrasConverters:
+    def test_convert_from_extras(self):
+        from ckanext.dgu.controllers.package_gov3 import convert_from_extras
+        data = {('extras', 0, 'key'): 'published_by',
+                ('extras', 0, 'value'): 'Ordnance Survey [1234]',
+                ('extras', 1, 'key'): 'precision',
+                ('extras', 1, 'value'): 'to 1 decimal place',
+                ('published_by',): None,
+                ('precision',): None,
+                ('mandate',): None}
+        context = {}
+        for key in [('published_by',), ('precision',), ('mandate',)]:
+            convert_from_extras(key, data, {}, context)
+        assert_equal(data[('published_by',)], 'Ordnance Survey [1234]')
+        assert_equal(data[('precision',)], 'to 1 decimal place')
+        assert_equal(data[('mandate',)], None)
+
+        # the context is reused for the next package
+        data = {('extras', 0, 'key'): 'precision',
+                ('extras', 0, 'value'): 'to the nearest 100',
+                ('precision',): None}
+        convert_from_extras(('precision',), data, {}, context)
+        assert_equal(data[('precision',)], 'to the nearest 100')
+
+    def test_convert_to_extras(self):
+        from ckanext.dgu.controllers.package_gov3 import convert_to_extras
+        data = {('published_by',): 'Ordnance Survey [1234]',
+                ('precision',): 'to 1 decimal place'}
+        for key in [('published_by',), ('precision',)]:
+            convert_to_extras(key, data, {}, {})
+        assert_equal(data[('extras',)],
+                     [{'key': 'published_by', 'value': 'Ordnance Survey [1234]'},
+                      {'key': 'precision', 'value': 'to 1 decimal place'}])
@@ -1,5 +1,10 @@
 import os
 import datetime
+import gzip
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
 
 from nose.tools import assert_equal
 
@@ -8,7 +13,7 @@ from ckanext.dgu.ons import downloader
 
 class TestOnsData:
     def __init__(self):
-        self.ons_cache_path = os.path.expanduser(downloader.ONS_CACHE_PATH)
+        self.ons_cache_path = os.path.expanduser(downloader.ONS_DEFAULT_CACHE_PATH)
         self.ons_url_base = downloader.ONS_URL_BASE[:downloader.ONS_URL_BASE.find('?')]
         
     def test_get_url(self):
@@ -77,3 +82,76 @@ class TestOnsData:
     def _test_import_recent(self):
         res = OnsDataTester.import_recent(days=7)
         assert res == 5, res
+
+
+class EtagHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    body = '<rss>%s</rss>'
+    etag = '"v1"'
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.getheader('If-None-Match')))
+        if self.headers.getheader('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(self.body % self.path)
+
+    def log_message(self, *args):
+        pass
+
+class TestOnsDataDownload:
+    @classmethod
+    def setup_class(cls):
+        cls.server = BaseHTTPServer.HTTPServer(('localhost', 0), EtagHandler)
+        cls.url_base = 'http://localhost:%i' % cls.server.server_port
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp()
+        EtagHandler.requests = []
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_download(self):
+        ons_data = downloader.OnsData(self.cache_dir)
+        res = ons_data.download(self.url_base + '/2009-12', '2009-12')
+        assert_equal(res, os.path.join(self.cache_dir, 'ons_data_2009-12.gz'))
+        assert_equal(gzip.open(res).read(), '<rss>/2009-12</rss>')
+        # no partial or temporary files are left
+        assert_equal(sorted(os.listdir(self.cache_dir)),
+                     ['ons_data_2009-12.gz', 'ons_data_2009-12.gz.headers'])
+
+        # already downloaded
+        ons_data.download(self.url_base + '/2009-12', '2009-12')
+        assert_equal(len(EtagHandler.requests), 1)
+
+    def test_revalidate(self):
+        ons_data = downloader.OnsData(self.cache_dir)
+        url = self.url_base + '/2010-01'
+        ons_data.download(url, '2010-01_incomplete', force_download=True)
+        res = ons_data.download(url, '2010-01_incomplete', force_download=True)
+        assert_equal(EtagHandler.requests,
+                     [('/2010-01', None), ('/2010-01', '"v1"')])
+        assert_equal(gzip.open(res).read(), '<rss>/2010-01</rss>')
+
+    def test_download_multiple(self):
+        ons_data = downloader.OnsData(self.cache_dir)
+        url_tuples = [[self.url_base + '/%i' % i, str(i), False] \
+                      for i in range(10)]
+        res = ons_data.download_multiple(url_tuples)
+        assert_equal(res, [os.path.join(self.cache_dir, 'ons_data_%i.gz' % i) \
+                           for i in range(10)])
+        for i, filepath in enumerate(res):
+            assert_equal(gzip.open(filepath).read(), '<rss>/%i</rss>' % i)
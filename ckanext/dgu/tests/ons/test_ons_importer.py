@@ -1,4 +1,6 @@
 import os
+import shutil
+import tempfile
 
 from pylons import config
 from sqlalchemy.util import OrderedDict
@@ -6,6 +8,7 @@ from nose.tools import assert_equal
 
 from ckan.tests import *
 from ckanext.dgu.ons import importer
+from ckanext.dgu.ons.journal import OnsImportJournal
 from ckanext.dgu.ons.producers import get_ons_producers
 from ckanext.dgu.schema import DrupalHelper
 from ckanext.dgu.tests import MockDrupalCase, strip_organisation_id, PackageDictUtil
@@ -20,6 +23,11 @@ class TestOnsData1:
         records_obj = importer.OnsDataRecords(SAMPLE_FILEPATH_1)
         self.records = [record for record in records_obj]
  
+    def test_records_in_small_chunks(self):
+        records_obj = importer.OnsDataRecords(SAMPLE_FILEPATH_1)
+        records_obj.chunk_size = 100
+        assert_equal([record for record in records_obj], self.records)
+
     def test_records(self):
         assert len(self.records) == 8
         record1 = self.records[0]
@@ -108,6 +116,28 @@ class TestOnsImporter(MockDrupalCase):
             assert_equal(published_by, expected_published_by or u'')
             assert_equal(published_via, expected_published_via or u'')
         
+    def test_skip_unchanged(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            journal = OnsImportJournal(os.path.join(tmp_dir, 'journal.db'))
+            importer_ = importer.OnsImporter(SAMPLE_FILEPATH_1, journal=journal)
+            pkg_dicts = [pkg_dict for pkg_dict in importer_.pkg_dict()]
+            assert_equal(len(pkg_dicts), 8)
+            # record them as loaded, except the first
+            for pkg_dict in pkg_dicts[1:]:
+                journal.record(pkg_dict['resources'][0]['hub-id'], 'pkg-id')
+
+            importer_ = importer.OnsImporter(SAMPLE_FILEPATH_1, journal=journal)
+            pkg_dicts_2 = [pkg_dict for pkg_dict in importer_.pkg_dict()]
+            assert_equal(pkg_dicts_2, pkg_dicts[:1])
+            assert_equal(importer_._unchanged_count, 7)
+
+            importer_ = importer.OnsImporter(SAMPLE_FILEPATH_1, journal=journal,
+                                             skip_unchanged=False)
+            assert_equal(len(list(importer_.pkg_dict())), 8)
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_record_2_package(self):
         record = OrderedDict([
             (u'title', u'UK Official Holdings of International Reserves - December 2009'),
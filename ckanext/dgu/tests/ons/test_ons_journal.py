@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ckanext.dgu.ons.journal import OnsImportJournal, default_journal_filepath
+
+class TestOnsImportJournal:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'journal.db')
+        self.item = {u'title': u'UK Official Holdings - December 2009',
+                     u'guid': u'http://www.statistics.gov.uk/hub/id/119-36345',
+                     u'hub:designation': u''}
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_item_hash(self):
+        item_hash = OnsImportJournal.item_hash(self.item)
+        assert_equal(item_hash, OnsImportJournal.item_hash(dict(self.item)))
+        changed_item = dict(self.item, title=u'UK Official Holdings - January 2010')
+        assert item_hash != OnsImportJournal.item_hash(changed_item)
+
+    def test_record(self):
+        item_hash = OnsImportJournal.item_hash(self.item)
+        journal = OnsImportJournal(self.filepath)
+        assert not journal.is_unchanged('119-36345', item_hash)
+        journal.start('119-36345', item_hash)
+        # not recorded until loaded
+        assert not journal.is_unchanged('119-36345', item_hash)
+        journal.record('119-36345', 'pkg-id', 'res-id')
+        journal.close()
+
+        journal = OnsImportJournal(self.filepath)
+        assert journal.is_unchanged('119-36345', item_hash)
+        assert not journal.is_unchanged('119-36345', 'other hash')
+        assert_equal(journal.get('119-36345'), (item_hash, 'pkg-id', 'res-id'))
+        assert_equal(len(journal), 1)
+
+    def test_record_without_start(self):
+        journal = OnsImportJournal(self.filepath)
+        journal.record('119-36345', 'pkg-id', 'res-id')
+        assert_equal(journal.get('119-36345'), None)
+
+    def test_default_journal_filepath(self):
+        assert_equal(default_journal_filepath('/cache', 'http://ckan.example.com/api'),
+                     '/cache/import_journal.ckan.example.com_api.db')
+        # each CKAN has its own journal
+        assert default_journal_filepath('/cache', 'http://test.example.com/api') != \
+               default_journal_filepath('/cache', 'http://live.example.com/api')
+        assert_equal(default_journal_filepath('/cache', None),
+                     '/cache/import_journal.default.db')
@@ -0,0 +1,87 @@
+import os
+import json
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ckanext.dgu.ons.loader import OnsLoader, OnsPackageIndex
+
+def ons_pkg(name, title, published_by, published_via=u'', **kwargs):
+    pkg = {'name': name, 'title': title,
+           'extras': {'published_by': published_by,
+                      'published_via': published_via,
+                      'external_reference': u'ONSHUB'}}
+    pkg.update(kwargs)
+    return pkg
+
+class TestOnsPackageIndex:
+    def setup(self):
+        self.pkgs = [
+            ons_pkg(u'reserves', u'UK Reserves', u'HM Treasury [11]'),
+            ons_pkg(u'reserves_ni', u'UK Reserves', u'Northern Ireland Executive [12]',
+                    u'Department of the Environment [13]'),
+            ons_pkg(u'deleted', u'Deaths', u'ONS [14]', state=u'deleted'),
+            {'name': u'not_ons', 'title': u'UK Reserves',
+             'extras': {'published_by': u'HM Treasury [11]'}},
+            ]
+        self.index = OnsPackageIndex(self.pkgs)
+
+    def test_lookup(self):
+        assert_equal(len(self.index), 2)
+        assert_equal(self.index.lookup({'title': u'UK Reserves', 'published_by': u'HM Treasury [11]'}),
+                     [u'reserves'])
+        assert_equal(self.index.lookup({'title': u'UK Reserves', 'published_via': u'Department of the Environment [13]'}),
+                     [u'reserves_ni'])
+        assert_equal(self.index.lookup({'title': u'Deaths', 'published_by': u'ONS [14]'}),
+                     [])
+        # not indexed
+        assert_equal(self.index.lookup({'title': u'UK Reserves'}), None)
+        assert_equal(self.index.lookup({'name': u'reserves', 'published_by': u'HM Treasury [11]'}), None)
+
+    def test_update(self):
+        self.index.add(ons_pkg(u'reserves', u'UK Official Reserves', u'HM Treasury [11]'))
+        assert_equal(self.index.lookup({'title': u'UK Reserves', 'published_by': u'HM Treasury [11]'}),
+                     [])
+        assert_equal(self.index.lookup({'title': u'UK Official Reserves', 'published_by': u'HM Treasury [11]'}),
+                     [u'reserves'])
+        assert_equal(len(self.index), 2)
+
+    def test_from_dump(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            dump_filepath = os.path.join(tmp_dir, 'data.gov.uk-ckan-meta-data-2011-01-26.json')
+            with open(dump_filepath, 'w') as f:
+                json.dump(self.pkgs, f)
+            index = OnsPackageIndex.from_dump(dump_filepath)
+        finally:
+            shutil.rmtree(tmp_dir)
+        assert_equal(len(index), 2)
+        assert_equal(index.lookup({'title': u'UK Reserves', 'published_by': u'HM Treasury [11]'}),
+                     [u'reserves'])
+
+    def test_from_api(self):
+        class MockClient:
+            def __init__(self, pkgs):
+                self.pkgs = pkgs
+                self.searches = []
+            def package_search(self, q, search_options):
+                self.searches.append(search_options)
+                offset = search_options['offset']
+                limit = search_options['limit']
+                return {'count': len(self.pkgs),
+                        'results': self.pkgs[offset:offset + limit]}
+        pkgs = [ons_pkg(u'pkg%i' % i, u'Title %i' % i, u'ONS [14]') \
+                for i in range(5)]
+        client = MockClient(pkgs)
+        index = OnsPackageIndex.from_api(client, page_size=2)
+        assert_equal([search['offset'] for search in client.searches],
+                     [0, 2, 4])
+        assert_equal(len(index), 5)
+        assert_equal(index.lookup({'title': u'Title 4', 'published_by': u'ONS [14]'}),
+                     [u'pkg4'])
+
+    def test_loader_search(self):
+        loader = OnsLoader(None, package_index=self.index)
+        res = loader._package_search({'title': u'UK Reserves', 'published_by': u'HM Treasury [11]'})
+        assert_equal(res, {'count': 1, 'results': [u'reserves']})
@@ -0,0 +1,152 @@
+import os
+import time
+import tempfile
+import shutil
+
+from nose.tools import assert_equal, assert_raises
+
+from ckanext.dgu.cache import MemoryCache, SqliteCache, CACHE_MISS, \
+     cache_from_config, memoize
+
+class CacheTests(object):
+    def make_cache(self, ttl=300, max_size=1000):
+        raise NotImplementedError
+
+    def test_get_set(self):
+        cache = self.make_cache()
+        assert cache.get('a') is CACHE_MISS
+        cache.set('a', {'uid': '62'})
+        assert_equal(cache.get('a'), {'uid': '62'})
+
+    def test_negative_result(self):
+        cache = self.make_cache()
+        cache.set('a', None)
+        assert_equal(cache.get('a'), None)
+
+    def test_expiry(self):
+        cache = self.make_cache(ttl=300)
+        cache.set('a', 1, ttl=-1)
+        cache.set('b', 2)
+        assert cache.get('a') is CACHE_MISS
+        assert_equal(cache.get('b'), 2)
+
+    def test_lru_eviction(self):
+        cache = self.make_cache(max_size=2)
+        cache.set('a', 1)
+        time.sleep(0.01)
+        cache.set('b', 2)
+        time.sleep(0.01)
+        cache.get('a') # 'a' is now more recently used than 'b'
+        time.sleep(0.01)
+        cache.set('c', 3)
+        assert_equal(len(cache), 2)
+        assert_equal(cache.get('a'), 1)
+        assert cache.get('b') is CACHE_MISS
+        assert_equal(cache.get('c'), 3)
+
+    def test_delete_and_clear(self):
+        cache = self.make_cache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        assert cache.get('a') is CACHE_MISS
+        cache.clear()
+        assert_equal(len(cache), 0)
+
+class TestMemoryCache(CacheTests):
+    def make_cache(self, ttl=300, max_size=1000):
+        return MemoryCache(ttl=ttl, max_size=max_size)
+
+class TestSqliteCache(CacheTests):
+    @classmethod
+    def setup_class(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.tmp_dir)
+
+    def make_cache(self, ttl=300, max_size=1000):
+        filepath = tempfile.mktemp(dir=self.tmp_dir, suffix='.db')
+        cache = SqliteCache(filepath, ttl=ttl, max_size=max_size)
+        # so that the LRU order can be tested without waiting
+        cache.access_interval = 0
+        return cache
+
+    def get_accessed(self, cache, key):
+        return cache._connection().execute(
+            'SELECT accessed FROM cache WHERE key=?', (key,)).fetchone()[0]
+
+    def test_accessed_not_written_on_every_get(self):
+        cache = self.make_cache()
+        cache.access_interval = 60
+        cache.set('a', 1)
+        accessed = self.get_accessed(cache, 'a')
+        time.sleep(0.01)
+        assert_equal(cache.get('a'), 1)
+        assert_equal(self.get_accessed(cache, 'a'), accessed)
+        cache.access_interval = 0
+        assert_equal(cache.get('a'), 1)
+        assert self.get_accessed(cache, 'a') > accessed
+
+    def test_eviction_interval(self):
+        cache = self.make_cache(max_size=20)
+        assert_equal(cache.evict_interval, 2)
+        for i in range(21):
+            cache.set(i, i)
+        # evicted on the next set
+        assert_equal(len(cache), 21)
+        cache.set(21, 21)
+        assert_equal(len(cache), 20)
+
+    def test_shared_between_instances(self):
+        filepath = os.path.join(self.tmp_dir, 'shared.db')
+        SqliteCache(filepath).set('a', {'publishers': {'1': 'NHS'}})
+        assert_equal(SqliteCache(filepath).get('a'),
+                     {'publishers': {'1': 'NHS'}})
+
+class TestCacheFromConfig:
+    def test_default(self):
+        cache = cache_from_config({}, 'dgu.test_cache')
+        assert isinstance(cache, MemoryCache)
+
+    def test_options(self):
+        cache = cache_from_config({'dgu.test_cache.ttl': '10',
+                                   'dgu.test_cache.max_size': '5'},
+                                  'dgu.test_cache')
+        assert_equal(cache.ttl, 10)
+        assert_equal(cache.max_size, 5)
+
+    def test_none(self):
+        assert_equal(cache_from_config({'dgu.test_cache.backend': 'none'},
+                                       'dgu.test_cache'), None)
+
+    def test_sqlite_needs_path(self):
+        assert_raises(ValueError, cache_from_config,
+                      {'dgu.test_cache.backend': 'sqlite'}, 'dgu.test_cache')
+
+class TestMemoize:
+    def test_memoize(self):
+        calls = []
+        @memoize(max_size=4)
+        def upper(name):
+            calls.append(name)
+            return name.upper()
+        assert_equal(upper('a'), 'A')
+        assert_equal(upper('a'), 'A')
+        assert_equal(calls, ['a'])
+        # str and unicode are cached separately
+        assert_equal(type(upper(u'a')), unicode)
+        assert_equal(calls, ['a', u'a'])
+
+    def test_bounded(self):
+        calls = []
+        @memoize(max_size=4)
+        def upper(name):
+            calls.append(name)
+            return name.upper()
+        for name in 'abcdefgh':
+            upper(name)
+        upper('h')
+        upper('a')
+        assert_equal(calls, list('abcdefgh') + ['a'])
@@ -1,9 +1,12 @@
+import socket
+
 from pylons import config
 from nose.tools import assert_equal, assert_raises
 
 from ckanext.dgu.tests import MockDrupalCase
 from ckanext.dgu.testtools.mock_drupal import get_mock_drupal_config, MOCK_DRUPAL_URL
-from ckanext.dgu.drupalclient import DrupalClient, DrupalKeyError
+from ckanext.dgu.drupalclient import DrupalClient, DrupalKeyError, \
+     DrupalRequestError, PooledTransport
 
 class TestDrupalConnection(MockDrupalCase):
     def test_get_url(self):
@@ -23,6 +26,13 @@ class TestDrupalConnection(MockDrupalCase):
         expected_publishers = expected_user['publishers']
         assert_equal(user['publishers'], expected_publishers)
 
+    def test_get_user_id_from_session_id(self):
+        client = DrupalClient()
+        user_id = client.get_user_id_from_session_id('4160a72a4d6831abec1ac57d7b5a59eb')
+        assert_equal(user_id, '62')
+
+        assert_raises(DrupalKeyError, client.get_user_id_from_session_id, 'unknownsession')
+
     def test_match_organisation(self):
         drupal_config = get_mock_drupal_config()
         client = DrupalClient()
@@ -58,3 +68,68 @@ class TestDrupalConnection(MockDrupalCase):
         assert_raises(DrupalKeyError, client.get_department_from_organisation, '')
         assert_raises(DrupalKeyError, client.get_department_from_organisation, None)
         
+
+    def test_shared_transport(self):
+        client = DrupalClient()
+        transport = DrupalClient.get_shared_transport()
+        assert isinstance(transport, PooledTransport)
+        assert DrupalClient().drupal._ServerProxy__transport is transport
+
+        org_name = client.get_organisation_name('2')
+        assert_equal(org_name, 'Ealing PCT')
+        # a Fault leaves the connection usable
+        assert_raises(DrupalKeyError, client.get_organisation_name, '999')
+        org_name = client.get_organisation_name('2')
+        assert_equal(org_name, 'Ealing PCT')
+
+    def test_match_organisations(self):
+        client = DrupalClient()
+        org_ids = client.match_organisations(['Ealing PCT', 'Department of Health', 'Unknown', ''])
+        assert_equal(org_ids, {'Ealing PCT': '2',
+                               'Department of Health': '7',
+                               'Unknown': None,
+                               '': None})
+        assert_equal(client._multicall_supported, True)
+        assert_equal(client.match_organisations([]), {})
+
+    def test_get_organisation_names(self):
+        client = DrupalClient()
+        org_names = client.get_organisation_names(['2', 7, '999'])
+        assert_equal(org_names, {'2': 'Ealing PCT',
+                                 7: 'Department of Health',
+                                 '999': None})
+
+    def test_batch_without_multicall(self):
+        client = DrupalClient()
+        client._multicall_supported = False
+        org_ids = client.match_organisations(['Ealing PCT', 'Unknown'])
+        assert_equal(org_ids, {'Ealing PCT': '2', 'Unknown': None})
+        org_names = client.get_organisation_names(['2', '999'])
+        assert_equal(org_names, {'2': 'Ealing PCT', '999': None})
+
+class FlakyTransport(PooledTransport):
+    def __init__(self, failures, **kwargs):
+        PooledTransport.__init__(self, backoff=0, **kwargs)
+        self.failures = failures
+        self.attempts = 0
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise socket.error(104, 'Connection reset by peer')
+        return PooledTransport.single_request(self, host, handler,
+                                              request_body, verbose)
+
+class TestPooledTransport(MockDrupalCase):
+    def test_retry(self):
+        transport = FlakyTransport(failures=2, retries=2)
+        client = DrupalClient(transport=transport)
+        org_name = client.get_organisation_name('2')
+        assert_equal(org_name, 'Ealing PCT')
+        assert_equal(transport.attempts, 3)
+
+    def test_retries_exhausted(self):
+        transport = FlakyTransport(failures=3, retries=2)
+        client = DrupalClient(transport=transport)
+        assert_raises(DrupalRequestError, client.get_organisation_name, '2')
+        assert_equal(transport.attempts, 3)
@@ -2,7 +2,12 @@ from genshi.input import HTML
 
 from ckan import model
 from ckan.lib.create_test_data import CreateTestData
-from ckanext.dgu.stream_filters import harvest_filter
+import logging
+
+from nose.tools import assert_equal
+
+from ckanext.dgu.stream_filters import harvest_filter, timed_filter
+import ckanext.dgu.stream_filters as stream_filters
 
 from ckanext.dgu.tests import HarvestFixture
 from ckan.tests.html_check import HtmlCheckMethods
@@ -59,6 +64,25 @@ class TestHarvestFilter(HtmlCheckMethods, HarvestFixture):
         self.check_named_element(res, 'a', 'href="%s"' % harvest_xml_url)
         self.check_named_element(res, 'a', 'href="%s"' % harvest_html_url)
 
+    def test_cached_fragment(self):
+        anna = model.Package.by_name(u'annakarenina')
+        res = harvest_filter(HTML(self.pkg_page), anna).render('html')
+        # the fragment is reused for the next render of the page
+        res2 = harvest_filter(HTML(self.pkg_page), anna).render('html')
+        assert_equal(res2, res)
+
+    def test_timed_filter(self):
+        anna = model.Package.by_name(u'annakarenina')
+        res = harvest_filter(HTML(self.pkg_page), anna).render('html')
+        level = stream_filters.log.level
+        stream_filters.log.setLevel(logging.DEBUG)
+        try:
+            timed_res = timed_filter('harvest', HTML(self.pkg_page),
+                lambda stream: harvest_filter(stream, anna)).render('html')
+        finally:
+            stream_filters.log.setLevel(level)
+        assert_equal(timed_res, res)
+
 
 # test disabled - archive filter never written
 class _TestArchiveFilter(HtmlCheckMethods):
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+
+from nose.tools import assert_equal
+
+from ckanext.dgu.harvest_queue import HarvestJobQueue, queue_from_config, \
+     process_queue
+
+class TestHarvestJobQueue:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'harvest_queue.db')
+        self.queue = HarvestJobQueue(self.filepath)
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_and_claim(self):
+        request_id = self.queue.put('source-1')
+        assert_equal(self.queue.get(request_id)['status'], 'queued')
+        # a second request for the same source is the same request
+        assert_equal(self.queue.put('source-1'), request_id)
+        request_id_2 = self.queue.put('source-2')
+        assert_equal(len(self.queue), 2)
+
+        # the queue is shared through the file
+        queue = HarvestJobQueue(self.filepath)
+        request = queue.claim()
+        assert_equal(request['id'], request_id)
+        assert_equal(request['status'], 'running')
+        assert_equal(queue.claim()['id'], request_id_2)
+        assert_equal(queue.claim(), None)
+        # the source can be queued again once it is running
+        assert self.queue.put('source-1') != request_id
+
+    def test_done_and_failed(self):
+        request_id = self.queue.put('source-1')
+        request_id_2 = self.queue.put('source-2')
+        self.queue.claim()
+        self.queue.claim()
+        self.queue.done(request_id, 'job-1')
+        self.queue.failed(request_id_2, 'Invalid source')
+        request = self.queue.get(request_id)
+        assert_equal((request['status'], request['job_id']), ('done', 'job-1'))
+        request = self.queue.get(request_id_2)
+        assert_equal((request['status'], request['error']), ('error', 'Invalid source'))
+        assert_equal(self.queue.get('unknown'), None)
+
+    def test_abandoned_request_requeued(self):
+        request_id = self.queue.put('source-1')
+        self.queue.claim()
+        self.queue.running_timeout = -1
+        assert_equal(self.queue.claim()['id'], request_id)
+
+    def test_process_queue(self):
+        request_ids = [self.queue.put('source-%i' % i) for i in range(3)]
+        def create_job(source_id):
+            if source_id == 'source-1':
+                raise Exception('There already is an unrun job for this source')
+            return {'id': 'job-for-' + source_id}
+        assert_equal(process_queue(self.queue, create_job, run_forever=False), 3)
+        statuses = [(self.queue.get(request_id)['status'],
+                     self.queue.get(request_id)['job_id']) \
+                    for request_id in request_ids]
+        assert_equal(statuses, [('done', 'job-for-source-0'),
+                                ('error', None),
+                                ('done', 'job-for-source-2')])
+
+    def test_queue_from_config(self):
+        assert_equal(queue_from_config({}), None)
+        queue = queue_from_config({'dgu.harvest_queue.path': self.filepath})
+        assert_equal(queue.filepath, self.filepath)
@@ -3,7 +3,8 @@ import Cookie
 from nose.tools import assert_equal
 from ckan import model
 
-from ckanext.dgu.middleware import drupal_extract_cookie, is_ckan_signed_in, AuthAPIMiddleware
+from ckanext.dgu.middleware import drupal_extract_cookie, is_ckan_signed_in, \
+     scan_cookies, is_static_file_request, AuthAPIMiddleware
 from ckanext.dgu.drupalclient import DrupalClient
 from ckanext.dgu.tests import MockDrupalCase
 
@@ -26,6 +27,23 @@ class TestCookie:
         res = is_ckan_signed_in(self.drupal_cookie)
         assert_equal(res, False)
 
+    def test_scan_cookies(self):
+        res = scan_cookies(self.ckan_cookie)
+        assert_equal(res, ('ae257e890935e0cc123ccc71797668e4', True))
+
+    def test_scan_cookies_quoted(self):
+        res = scan_cookies('SESS9854552e7c5dba5831db083c5372623c="ae257e89"; has_js=1')
+        assert_equal(res, ('ae257e89', False))
+
+    def test_scan_cookies_empty(self):
+        assert_equal(scan_cookies(''), (None, False))
+
+    def test_is_static_file_request(self):
+        assert is_static_file_request('/css/style.css')
+        assert is_static_file_request('/images/1x1.GIF')
+        assert not is_static_file_request('/package/annakarenina')
+        assert not is_static_file_request('/api/2/rest/package')
+
 class MockApp:
     def __init__(self):
         self.calls = []
@@ -186,3 +204,41 @@ class TestAuthAPIMiddleware(MockDrupalCase):
         # no need for auth_tkt to be told to remember the Drupal user info
         assert_equal(len(self.mock_auth_tkt.remembered), 0)
 
+
+    def test_3_session_cached(self):
+        middleware = AuthAPIMiddleware(MockApp(), None)
+        middleware.drupal_client = DrupalClient()
+        user = middleware._get_drupal_user('4160a72a4d6831abec1ac57d7b5a59eb')
+        assert_equal(user['uid'], '62')
+
+        # second time it comes from the cache, not Drupal
+        middleware.drupal_client = None
+        cached_user = middleware._get_drupal_user('4160a72a4d6831abec1ac57d7b5a59eb')
+        assert_equal(cached_user, user)
+
+    def test_4_static_file(self):
+        app = MockApp()
+        middleware = AuthAPIMiddleware(app, None)
+        environ = {'HTTP_COOKIE': 'SESS9854522e7c5dba5831db083c5372623c=4160a72a4d6831abec1ac57d7b5a59eb;',
+                   'PATH_INFO': '/css/style.css'}
+        res = middleware(environ, mock_start_response)
+
+        # passed straight through without asking Drupal
+        environ = res.calls[0][0]
+        assert 'drupal.uid' not in environ
+        assert_equal(middleware.drupal_client, None)
+
+    def test_5_invalid_session(self):
+        cookie_string = 'SESS9854522e7c5dba5831db083c5372623c=unknownsession;'
+        app = MockApp()
+        middleware = AuthAPIMiddleware(app, None)
+        environ = {'HTTP_COOKIE': cookie_string,
+                   'repoze.who.plugins': {'auth_tkt': MockAuthTkt()}}
+        res = middleware(environ, mock_start_response)
+
+        # request passes through without a Drupal user
+        environ = res.calls[0][0]
+        assert_equal(environ['drupal.uid'], None)
+
+        # the negative result is cached
+        assert_equal(middleware.session_cache.get('unknownsession'), None)
@@ -1,3 +1,9 @@
+import os
+import re
+import random
+import shutil
+import tempfile
+
 from ckanext.dgu.schema import *
 from nose.tools import assert_equal
 from ckanext.dgu.tests import MockDrupalCase
@@ -37,6 +43,21 @@ class TestGeoCoverageType:
             result_form = GeoCoverageType.get_instance().db_to_form(db)
             assert_equal(result_form, form)
 
+    def test_all_combinations(self):
+        geo_coverage_type = GeoCoverageType.get_instance()
+        regions = geo_coverage_type.regions_munged
+        for mask in range(64):
+            form = [region for i, region in enumerate(regions) if mask & (1 << i)]
+            db = geo_coverage_type.form_to_db(form)
+            assert_equal(db[:6], ''.join([str((mask >> i) & 1) for i in range(6)]))
+            assert_equal(geo_coverage_type.db_to_form(db), form)
+            assert_equal(db[8:], geo_coverage_type.munged_regions_to_printable_region_names(form))
+
+    def test_db_to_form_malformed(self):
+        geo_coverage_type = GeoCoverageType.get_instance()
+        assert_equal(geo_coverage_type.db_to_form(''), [])
+        assert_equal(geo_coverage_type.db_to_form('1x1000: England, Wales'), ['england', 'wales'])
+
 class TestCanonicalOrganisationNames:
     def test_basic(self):
         res = canonise_organisation_name('MFA')
@@ -73,11 +94,28 @@ class TestTags:
               'agency':'Traffic accidents'}, ['road', 'traffic', 'accident']),
             ({'name':'road',
               'extras':{'agency':'Traffic accidents'}}, ['road', 'traffic', 'accident']),
+            ({'name':'road',
+              'title':u'Traffic caf\xe9',
+              'notes':'Accidents costing \xc2\xa3'}, ['road', 'traffic', 'accident']),
+            ({'title':'Greenhouse gas'}, ['green', 'greenhouse-gas', 'gas']),
             ]
         for pkg_dict, tags in expected_data:
             result_tags = suggest_tags(pkg_dict)
             assert_equal(result_tags, set(tags))
 
+def previous_name_munge(name):
+    # name_munge before it was optimised
+    name = re.sub(' ', '_', name).lower()
+    name = re.sub('[:]', '_-', name)
+    name = re.sub('[/]', '-', name)
+    name = re.sub('[^a-zA-Z0-9-_]', '', name)
+    name = re.sub('__', '_', name)
+    name = re.sub("_-_", "-", name)
+    return name[:100]
+
+def previous_tag_munge(name):
+    return previous_name_munge(name).replace('_', '-').replace('--', '-').replace("_-_", "-")
+
 class TestName:
     def test_parse(self):
         expected_data = [
@@ -87,8 +125,28 @@ class TestName:
         for str_, name in expected_data:
             result_name = name_munge(str_)
             assert_equal(result_name, name)
+
+    def test_same_as_previous_munge(self):
+        rand = random.Random(0)
+        chars = u' :/_-_-aZ09.,()$\'\xe9\u0130\u212a\xa3'
+        for i in range(5000):
+            name = u''.join([rand.choice(chars) for j in range(rand.randint(0, 120))])
+            if i % 2:
+                name = name.encode('utf8')
+            for munge, previous_munge in ((name_munge, previous_name_munge),
+                                          (tag_munge, previous_tag_munge)):
+                result = munge(name)
+                expected = previous_munge(name)
+                assert_equal(result, expected)
+                assert_equal(type(result), type(expected))
     
 class TestDrupalHelper(MockDrupalCase):
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
     def test_dept_to_organisation(self):
         source_agency = 'Ealing PCT'
         publisher = DrupalHelper.department_or_agency_to_organisation(source_agency)
@@ -99,6 +157,78 @@ class TestDrupalHelper(MockDrupalCase):
         publisher = DrupalHelper.department_or_agency_to_organisation(source_agency, include_id=False)
         assert publisher == 'Ealing PCT'
 
+    def test_warm_organisation_cache(self):
+        drupal_helper = DrupalHelper()
+        drupal_helper.warm_organisation_cache(['Ealing PCT', 'Health', 'Unknown'])
+        assert_equal(drupal_helper._organisation_cache['Ealing PCT'], ('Ealing PCT', '2'))
+        # matched by its canonical name
+        assert_equal(drupal_helper._organisation_cache['Health'], ('Department of Health', '7'))
+        assert_equal(drupal_helper._organisation_cache['Department of Health'], ('Department of Health', '7'))
+        assert_equal(drupal_helper._organisation_cache['Unknown'], None)
+
+        # cached lookups no longer need Drupal
+        drupal_helper._drupal_client_cache = None
+        assert_equal(drupal_helper.cached_department_or_agency_to_organisation('Health'),
+                     'Department of Health [7]')
+        assert_equal(drupal_helper.cached_department_or_agency_to_organisation('Unknown'),
+                     None)
+
+    def test_persistent_organisation_cache(self):
+        cache_filepath = os.path.join(self.tmp_dir, 'org_cache.db')
+        drupal_helper = DrupalHelper(organisation_cache_filepath=cache_filepath)
+        drupal_helper.warm_organisation_cache(['Ealing PCT', 'Unknown'])
+
+        # a later run uses the file, without calling Drupal
+        drupal_helper = DrupalHelper(organisation_cache_filepath=cache_filepath)
+        drupal_helper._drupal_client_cache = NoDrupalClient()
+        drupal_helper.warm_organisation_cache(['Ealing PCT', 'Unknown'])
+        assert_equal(drupal_helper.cached_department_or_agency_to_organisation('Ealing PCT'),
+                     'Ealing PCT [2]')
+        assert_equal(drupal_helper.cached_department_or_agency_to_organisation('Unknown'),
+                     None)
+
+        # refresh clears it
+        drupal_helper = DrupalHelper(organisation_cache_filepath=cache_filepath,
+                                     refresh_organisation_cache=True)
+        assert 'Ealing PCT' not in drupal_helper._organisation_cache
+
+class NoDrupalClient(object):
+    def __getattr__(self, name):
+        raise AssertionError('Drupal should not be called: %s' % name)
+
+class TestOrganisationCache:
+    def setup(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_expiry(self):
+        cache_filepath = os.path.join(self.tmp_dir, 'org_cache.db')
+        cache = OrganisationCache(cache_filepath, ttl=-1, negative_ttl=300)
+        cache['Ealing PCT'] = ('Ealing PCT', '2')
+        cache['Unknown'] = None
+
+        cache = OrganisationCache(cache_filepath)
+        assert 'Ealing PCT' not in cache
+        assert 'Unknown' in cache
+        assert_equal(cache['Unknown'], None)
+
+    def test_separate_drupals(self):
+        cache_filepath = os.path.join(self.tmp_dir, 'org_cache.db')
+        cache = OrganisationCache(cache_filepath,
+                                  drupal_url='http://test.example.com/services/xmlrpc')
+        cache['Ealing PCT'] = ('Ealing PCT', '2')
+        cache[u'Caf\xe9'] = ('Cafe', '3')
+
+        cache = OrganisationCache(cache_filepath,
+                                  drupal_url='http://live.example.com/services/xmlrpc')
+        assert 'Ealing PCT' not in cache
+        cache = OrganisationCache(cache_filepath,
+                                  drupal_url='http://test.example.com/services/xmlrpc')
+        assert_equal(cache['Ealing PCT'], ('Ealing PCT', '2'))
+        assert_equal(cache[u'Caf\xe9'], ('Cafe', '3'))
+
 class TestGovTags(object):
     def test_tags_parse(self):
         def test_parse(tag_str, expected_tags):
@@ -83,6 +83,7 @@ class MockDrupal(object):
                                     requestHandler=RequestHandler,
                                     logRequests=False)
         server.register_introspection_functions()
+        server.register_multicall_functions()
 
         class MyFuncs:
             class user: # lower case to match Drupal definition
@@ -59,6 +59,7 @@ setup(
 
         [paste.paster_command]
         mock_drupal = ckanext.dgu.testtools.mock_drupal:Command
+        harvest_queue = ckanext.dgu.harvest_queue:Command
     """,
     test_suite = 'nose.collector',
 )